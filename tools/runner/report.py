@@ -3,13 +3,19 @@
 from __future__ import print_function
 
 import argparse
+import heapq
 import json
+import os
+import shutil
 import sys
+import tempfile
 from cgi import escape
-from collections import defaultdict
+from itertools import groupby
 
 import types
 
+here = os.path.dirname(os.path.abspath(__file__))
+
 
 def html_escape(item, escape_quote=False):
     if isinstance(item, types.StringTypes):
@@ -38,7 +44,7 @@ class Node(object):
         self.attrs = attrs
         self.children = children
 
-    def __unicode__(self):
+    def start_tag(self):
         if self.attrs:
             #Need to escape
             attrs_unicode = " " + " ".join("%s=\"%s\"" % (html_escape(key),
@@ -47,11 +53,16 @@ class Node(object):
                                            for key, value in self.attrs.iteritems())
         else:
             attrs_unicode = ""
-        return "<%s%s>%s</%s>\n" % (self.name,
-                                    attrs_unicode,
-                                    "".join(unicode(html_escape(item))
-                                            for item in self.children),
-                                    self.name)
+        return "<%s%s>" % (self.name, attrs_unicode)
+
+    def end_tag(self):
+        return "</%s>\n" % self.name
+
+    def __unicode__(self):
+        return "%s%s%s" % (self.start_tag(),
+                           "".join(unicode(html_escape(item))
+                                   for item in self.children),
+                           self.end_tag())
 
     def __str__(self):
         return unicode(self).encode("utf8")
@@ -119,17 +130,22 @@ class HTML(object):
 h = HTML()
 
 
-class TestResult(object):
-    """Simple holder for the results of a single test in a single UA"""
-    def __init__(self, test):
-        self.test = test
-        self.results = {}
+class HTMLWriter(object):
+    """Writes HTML to a file incrementally. Complete nodes are written
+    with write, and the tags of elements whose content is written
+    separately with start and end."""
+    def __init__(self, f):
+        self.f = f
+
+    def write(self, *items):
+        for item in flatten(items):
+            self.f.write(unicode(html_escape(item)).encode("utf8"))
 
-    def __cmp__(self, other):
-        return self.test == other.test
+    def start(self, node):
+        self.f.write(node.start_tag().encode("utf8"))
 
-    def __hash__(self):
-        return hash(self.test)
+    def end(self, node):
+        self.f.write(node.end_tag().encode("utf8"))
 
 
 def load_data(args):
@@ -155,52 +171,55 @@ def test_id(id):
         return id
 
 
-def all_tests(data):
-    tests = defaultdict(set)
-    for UA, results in data.iteritems():
-        for result in results["results"]:
-            id = test_id(result["test"])
-            tests[id] |= {subtest["name"] for subtest in result["subtests"]}
-    return tests
-
-
-def group_results(data):
-    """Produce a list of UAs and a dictionary mapping specific tests to their
-    status in all UAs e.g.
-    ["UA1", "UA2"], {"test_id":{"harness":{"UA1": (status1, message1),
-                                           "UA2": (status2, message2)},
-                                "subtests":{"subtest1": "UA1": (status1-1, message1-1),
-                                                        "UA2": (status2-1, message2-1)}}}
-    Status and message are None if the test didn't run in a particular UA.
-    Message is None if the test didn't produce a message"""
-    tests = all_tests(data)
-
+def test_dir(id, depth):
+    """Directory of a test, limited to depth path components"""
+    url = id if isinstance(id, types.StringTypes) else id[0]
+    parts = [item for item in url.split("?", 1)[0].split("/")[:-1] if item]
+    return "/" + "/".join(parts[:depth])
+
+
+def sorted_results(UA, results, key):
+    """Iterator over the results for a UA, sorted by key. Results are
+    removed from the list as they are produced, so the memory they use can
+    be freed once they have been written"""
+    for result in results:
+        result["test"] = test_id(result["test"])
+    results.sort(key=key, reverse=True)
+    while results:
+        result = results.pop()
+        yield key(result), UA, result
+
+
+def merged_results(data, key):
+    """Merge the results from all UAs in test order, without grouping them
+    all in memory.
+
+    :param data: Dictionary of UA name to loaded results
+    :param key: Function returning the sort key for a result
+    :returns: Iterator of (test id, result) pairs, where result is a
+              dictionary like
+              {"harness":{"UA1": (status1, message1),
+                          "UA2": (status2, message2)},
+               "subtests":{"subtest1": {"UA1": (status1-1, message1-1),
+                                        "UA2": (status2-1, message2-1)}}}
+              Status and message are None if the test didn't run in a
+              particular UA. Message is None if the test didn't produce a
+              message"""
     UAs = data.keys()
-
-    def result():
-        return {
-            "harness": {UA: (None, None) for UA in UAs},
-            "subtests": None  # init this later
-        }
-
-    results_by_test = defaultdict(result)
-
-    for UA, results in data.iteritems():
-        for test_data in results["results"]:
-            id = test_id(test_data["test"])
-            result = results_by_test[id]
-
-            if result["subtests"] is None:
-                result["subtests"] = {
-                    name: {UA: (None, None) for UA in UAs} for name in tests[id]
-                }
-
+    iterators = [sorted_results(UA, results["results"], key)
+                 for UA, results in data.iteritems()]
+    for _, items in groupby(heapq.merge(*iterators), key=lambda item: item[0]):
+        items = list(items)
+        result = {"harness": {UA: (None, None) for UA in UAs},
+                  "subtests": {}}
+        for _, UA, test_data in items:
             result["harness"][UA] = (test_data["status"], test_data["message"])
             for subtest in test_data["subtests"]:
+                if subtest["name"] not in result["subtests"]:
+                    result["subtests"][subtest["name"]] = {UA: (None, None) for UA in UAs}
                 result["subtests"][subtest["name"]][UA] = (subtest["status"],
                                                            subtest["message"])
-
-    return UAs, results_by_test
+        yield items[0][2]["test"], result
 
 
 def status_cell(status, message=None):
@@ -227,20 +246,25 @@ def test_link(test_id, subtest=None):
     return rv
 
 
-def summary(UAs, results_by_test):
+def not_passing(test, result):
+    """List of (test, subtest) pairs for the test and subtests that
+    didn't pass in any UA, with subtest None for the test itself"""
+    rv = []
+    if not any(item[0] in ("PASS", "OK") for item in result["harness"].values()):
+        rv.append((test, None))
+    for subtest_name, subtest_results in sorted(result["subtests"].iteritems()):
+        if not any(item[0] == "PASS" for item in subtest_results.values()):
+            rv.append((test, subtest_name))
+    return rv
+
+
+def summary(failures):
     """Render the implementation report summary"""
-    not_passing = []
-    for test, results in results_by_test.iteritems():
-        if not any(item[0] in ("PASS", "OK") for item in results["harness"].values()):
-            not_passing.append((test, None))
-        for subtest_name, subtest_results in results["subtests"].iteritems():
-            if not any(item[0] == "PASS" for item in subtest_results.values()):
-                not_passing.append((test, subtest_name))
-    if not_passing:
+    if failures:
         rv = [
             h.p("The following tests failed to pass in all UAs:"),
             h.ul([h.li(test_link(test, subtest))
-                  for test, subtest in not_passing])
+                  for test, subtest in failures])
         ]
     else:
         rv = "All tests passed in at least one UA"
@@ -269,41 +293,155 @@ def result_rows(UAs, test, result):
         )
 
 
-def result_bodies(UAs, results_by_test):
-    return [h.tbody(result_rows(UAs, test, result))
-            for test, result in sorted(results_by_test.iteritems())]
-
-
-def generate_html(UAs, results_by_test):
-    """Generate all the HTML output"""
-    return h(h.html(
-        h.head(
-            h.meta(charset="utf8"),
-            h.title("Implementation Report"),
-            h.link(href="report.css", rel="stylesheet")),
-        h.body(
-            h.h1("Implementation Report"),
-            h.h2("Summary"),
-            summary(UAs, results_by_test),
-            h.h2("Full Results"),
-            h.table(
-                h.thead(
-                    h.tr(
-                        h.th("Test"),
-                        h.th("Subtest"),
-                        [h.th(UA) for UA in sorted(UAs)])),
-                result_bodies(UAs, results_by_test)))))
+def results_table(writer, UAs, results):
+    """Write the table of results, one tbody at a time, and return the
+    tests and subtests that didn't pass in any UA"""
+    failures = []
+    table = h.table()
+    writer.start(table)
+    writer.write(h.thead(
+        h.tr(
+            h.th("Test"),
+            h.th("Subtest"),
+            [h.th(UA) for UA in sorted(UAs)])))
+    for test, result in results:
+        failures.extend(not_passing(test, result))
+        writer.write(h.tbody(result_rows(UAs, test, result)))
+    writer.end(table)
+    return failures
+
+
+def write_page(f, title, content, css_href="report.css"):
+    """Write a page, calling content with an HTMLWriter to write the body
+    after the title"""
+    writer = HTMLWriter(f)
+    html, body = h.html(), h.body()
+    writer.write(Raw("<!DOCTYPE html>"))
+    writer.start(html)
+    writer.write(h.head(
+        h.meta(charset="utf8"),
+        h.title(title),
+        h.link(href=css_href, rel="stylesheet")))
+    writer.start(body)
+    writer.write(h.h1(title))
+    rv = content(writer)
+    writer.end(body)
+    writer.end(html)
+    return rv
 
 
-def main(filenames):
-    data = load_data(filenames)
-    UAs, results_by_test = group_results(data)
-    return generate_html(UAs, results_by_test)
+def generate_html(data, f):
+    """Write the report as a single page"""
+    UAs = data.keys()
+    # The summary comes before the results, but isn't known until all the
+    # results have been written, so buffer the results in a temporary file
+    with tempfile.TemporaryFile() as results_file:
+        failures = results_table(HTMLWriter(results_file),
+                                 UAs,
+                                 merged_results(data, key=lambda result: result["test"]))
+
+        def content(writer):
+            writer.write(h.h2("Summary"),
+                         summary(failures),
+                         h.h2("Full Results"))
+            results_file.seek(0)
+            shutil.copyfileobj(results_file, f)
+
+        write_page(f, "Implementation Report", content)
+
+
+def page_path(directory):
+    """Path of the page for a directory, relative to the output directory"""
+    parts = [item for item in directory.split("/") if item]
+    if not parts:
+        return "_root.html"
+    return "/".join(parts) + ".html"
+
+
+def generate_split_html(data, output_dir, depth):
+    """Write the report as a page of results for each directory, up to
+    depth path components, and an index.html page with the summary"""
+    UAs = data.keys()
+    dir_key = lambda result: (test_dir(result["test"], depth), result["test"])
+    results = merged_results(data, key=dir_key)
+    directories = []
+    failures = []
+
+    for directory, dir_results in groupby(results, key=lambda item: test_dir(item[0], depth)):
+        path = page_path(directory)
+        prefix = "../" * path.count("/")
+        full_path = os.path.join(output_dir, *path.split("/"))
+        if not os.path.exists(os.path.dirname(full_path)):
+            os.makedirs(os.path.dirname(full_path))
+
+        counts = {"tests": 0}
+
+        def counted(items):
+            for item in items:
+                counts["tests"] += 1
+                yield item
+
+        def content(writer):
+            writer.write(h.p(h.a("Summary", href=prefix + "index.html")))
+            return results_table(writer, UAs, counted(dir_results))
+
+        with open(full_path, "wb") as f:
+            dir_failures = write_page(f, "Implementation Report: %s" % directory, content,
+                                      css_href=prefix + "report.css")
+        failures.extend(dir_failures)
+        directories.append((directory, path, counts["tests"], len(dir_failures)))
+
+    def index_content(writer):
+        writer.write(h.h2("Summary"),
+                     summary(failures),
+                     h.h2("Directories"),
+                     h.table(
+                         h.thead(h.tr(h.th("Directory"), h.th("Tests"), h.th("Not passing"))),
+                         h.tbody([h.tr(h.td(h.a(directory, href=path)), h.td(tests),
+                                       h.td(not_passing_count))
+                                  for directory, path, tests, not_passing_count
+                                  in directories])))
+
+    with open(os.path.join(output_dir, "index.html"), "wb") as f:
+        write_page(f, "Implementation Report", index_content)
+    if not os.path.exists(os.path.join(output_dir, "report.css")):
+        shutil.copy(os.path.join(here, "report.css"), output_dir)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Generate an implementation report from JSON result files",
+        epilog="e.g. python report.py Firefox firefox.json Chrome chrome.json "
+        "IE internet_explorer.json")
+    parser.add_argument("--output", "-o", help="File to write the report to (default: stdout)")
+    parser.add_argument("--output-dir",
+                        help="Write a page of results for each directory, and an index.html "
+                        "page with the summary, to this directory")
+    parser.add_argument("--split-depth", type=int, default=2,
+                        help="Number of path components of the directories that each page of "
+                        "results covers, with --output-dir")
+    parser.add_argument("results", nargs="+", metavar="UA_OR_FILENAME",
+                        help="List of UA name, filename pairs")
+    return parser
+
+
+def main(argv):
+    args = get_parser().parse_args(argv)
+    if len(args.results) % 2:
+        print("Please supply a list of UA name, filename pairs")
+        return 1
+    data = load_data(args.results)
+    if args.output_dir:
+        if not os.path.exists(args.output_dir):
+            os.makedirs(args.output_dir)
+        generate_split_html(data, args.output_dir, args.split_depth)
+    elif args.output:
+        with open(args.output, "wb") as f:
+            generate_html(data, f)
+    else:
+        generate_html(data, sys.stdout)
+    return 0
 
 
 if __name__ == "__main__":
-    if not sys.argv[1:]:
-        print("""Please supply a list of UA name, filename pairs e.g.
-
-python report.py Firefox firefox.json Chrome chrome.json IE internet_explorer.json""")
-    print(main(sys.argv[1:]))
+    sys.exit(main(sys.argv[1:]))
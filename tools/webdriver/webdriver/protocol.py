@@ -24,6 +24,10 @@ class Encoder(json.JSONEncoder):
 
 
 class Decoder(json.JSONDecoder):
+    # object_hook converts nested values itself, so it can also be applied
+    # to a whole document parsed by a different JSON codec
+    recursive_object_hook = True
+
     def __init__(self, *args, **kwargs):
         self.session = kwargs.pop("session")
         super(Decoder, self).__init__(
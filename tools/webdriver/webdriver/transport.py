@@ -1,14 +1,59 @@
+import errno
 import httplib
 import json
 import select
+import socket
+import threading
 import urlparse
 
 import error
 
 from six import text_type
 
+try:
+    import orjson as fast_json
+except ImportError:
+    try:
+        import ujson as fast_json
+    except ImportError:
+        fast_json = None
+
 """Implements HTTP transport for the WebDriver wire protocol."""
 
+# Methods of requests that can be sent again when a reused connection fails,
+# because sending them twice has no further effect
+retry_methods = frozenset(["GET", "HEAD"])
+
+
+def dumps(obj, encoder=json.JSONEncoder, **codec_kwargs):
+    """Serialise obj as JSON, using a faster codec than the json module
+    when one is installed and no custom encoder is needed."""
+    if fast_json is not None and encoder is json.JSONEncoder and not codec_kwargs:
+        try:
+            return fast_json.dumps(obj)
+        except (TypeError, ValueError, OverflowError):
+            # Let the json module handle, or report, anything unusual
+            pass
+    return json.dumps(obj, cls=encoder, **codec_kwargs)
+
+
+def loads(data, decoder=json.JSONDecoder, **codec_kwargs):
+    """Parse JSON data, using a faster codec than the json module when
+    one is installed.
+
+    A faster codec is used with a custom decoder only if the decoder has
+    a ``recursive_object_hook`` attribute set, indicating that its
+    object hook can convert a complete parsed document at once."""
+    if fast_json is not None:
+        try:
+            if decoder is json.JSONDecoder and not codec_kwargs:
+                return fast_json.loads(data)
+            if getattr(decoder, "recursive_object_hook", False):
+                return decoder(**codec_kwargs).object_hook(fast_json.loads(data))
+        except ValueError:
+            pass
+    return json.loads(data, cls=decoder, **codec_kwargs)
+
 
 class Response(object):
     """
@@ -38,12 +83,12 @@ class Response(object):
 
     @classmethod
     def from_http(cls, http_response, decoder=json.JSONDecoder, **kwargs):
+        data = http_response.read()
         try:
-            body = json.load(http_response, cls=decoder, **kwargs)
-            headers = dict(http_response.getheaders())
+            body = loads(data.decode("utf-8"), decoder=decoder, **kwargs)
         except ValueError:
-            raise ValueError("Failed to decode response body as JSON:\n" +
-                http_response.read())
+            raise ValueError("Failed to decode response body as JSON:\n" + data)
+        headers = dict(http_response.getheaders())
 
         return cls(http_response.status, body, headers)
 
@@ -75,40 +120,66 @@ class HTTPWireProtocol(object):
         # => webdriver.Element
     """
 
-    def __init__(self, host, port, url_prefix="/", timeout=None):
+    def __init__(self, host, port, url_prefix="/", timeout=None, pool_size=4):
         """
         Construct interface for communicating with the remote server.
 
         :param url: URL of remote WebDriver server.
         :param wait: Duration to wait for remote to appear.
+        :param pool_size: Maximum number of idle keep-alive connections
+            to keep for reuse.  Concurrent callers each get their own
+            connection.
         """
         self.host = host
         self.port = port
         self.url_prefix = url_prefix
 
-        self._conn = None
         self._timeout = timeout
+        self._pool_size = pool_size
+        self._pool = []
+        self._pool_lock = threading.Lock()
 
     def __del__(self):
         self.close()
 
     def close(self):
-        """Closes the current HTTP connection, if there is one."""
-        if self._conn:
-            self._conn.close()
+        """Closes any idle HTTP connections."""
+        with self._pool_lock:
+            pool, self._pool = self._pool, []
+        for conn in pool:
+            conn.close()
 
-    @property
-    def connection(self):
-        """Gets the current HTTP connection, or lazily creates one."""
-        if not self._conn:
-            conn_kwargs = {}
-            if self._timeout is not None:
-                conn_kwargs["timeout"] = self._timeout
+    def _new_connection(self):
+        conn_kwargs = {}
+        if self._timeout is not None:
+            conn_kwargs["timeout"] = self._timeout
 
-            self._conn = httplib.HTTPConnection(
-                self.host, self.port, strict=True, **conn_kwargs)
+        return httplib.HTTPConnection(
+            self.host, self.port, strict=True, **conn_kwargs)
 
-        return self._conn
+    def _acquire_connection(self):
+        """Gets an idle HTTP connection from the pool, or creates one.
+
+        :return: Tuple of the connection and whether it was reused.
+        """
+        while True:
+            with self._pool_lock:
+                if not self._pool:
+                    break
+                conn = self._pool.pop()
+            if not is_dropped(conn):
+                return conn, True
+            conn.close()
+        return self._new_connection(), False
+
+    def _release_connection(self, conn):
+        """Returns a connection whose last response was fully read to
+        the pool."""
+        with self._pool_lock:
+            if len(self._pool) < self._pool_size:
+                self._pool.append(conn)
+                return
+        conn.close()
 
     def url(self, suffix):
         """
@@ -167,13 +238,21 @@ class HTTPWireProtocol(object):
         payload = None
         if body is not None:
             try:
-                payload = json.dumps(body, cls=encoder, **codec_kwargs)
+                payload = dumps(body, encoder=encoder, **codec_kwargs)
             except ValueError:
                 raise ValueError("Failed to encode request body as JSON:\n"
                     "%s" % json.dumps(body, indent=2))
 
-        response = self._request(method, uri, payload, headers)
-        return Response.from_http(response, decoder=decoder, **codec_kwargs)
+        conn, response = self._request(method, uri, payload, headers)
+        try:
+            return Response.from_http(response, decoder=decoder, **codec_kwargs)
+        finally:
+            # Since the response has been read in full, the connection can be
+            # reused without checking it for unread data.
+            if response.isclosed() and not response.will_close:
+                self._release_connection(conn)
+            else:
+                conn.close()
 
     def _request(self, method, uri, payload, headers=None):
         if isinstance(payload, text_type):
@@ -185,10 +264,43 @@ class HTTPWireProtocol(object):
 
         url = self.url(uri)
 
-        if self._has_unread_data():
-            self.close()
-        self.connection.request(method, url, payload, headers)
-        return self.connection.getresponse()
-
-    def _has_unread_data(self):
-        return self._conn and self._conn.sock and select.select([self._conn.sock], [], [], 0)[0]
+        conn, reused = self._acquire_connection()
+        try:
+            conn.request(method, url, payload, headers)
+            return conn, conn.getresponse()
+        except socket.timeout:
+            conn.close()
+            raise
+        except (httplib.BadStatusLine, socket.error) as e:
+            conn.close()
+            # The remote end may have closed an idle connection as the
+            # request was sent. It may also have acted on the request before
+            # the connection failed, so only requests that can safely be
+            # repeated are sent again on a new connection.
+            if (not reused or method not in retry_methods or
+                (isinstance(e, socket.error) and
+                 e.errno not in (errno.ECONNRESET, errno.EPIPE))):
+                raise
+        except Exception:
+            conn.close()
+            raise
+
+        conn = self._new_connection()
+        try:
+            conn.request(method, url, payload, headers)
+            return conn, conn.getresponse()
+        except Exception:
+            conn.close()
+            raise
+
+
+def is_dropped(conn):
+    """Whether an idle keep-alive connection has been closed by the remote
+    end, which shows as the socket becoming readable."""
+    if conn.sock is None:
+        return True
+    try:
+        readable, _, _ = select.select([conn.sock], [], [], 0)
+    except (select.error, ValueError):
+        return True
+    return bool(readable)
@@ -0,0 +1,95 @@
+import argparse
+import json
+import os
+import sys
+
+wpt_root = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir))
+sys.path.insert(0, os.path.abspath(os.path.join(wpt_root, "tools")))
+
+
+def create_parser():
+    p = argparse.ArgumentParser()
+    commands = p.add_subparsers(dest="archive_command")
+
+    add = commands.add_parser("add", help="Add the runs in wptreport or raw logs to an archive")
+    add.add_argument("archive", help="Path to the archive, which is created if it doesn't exist")
+    add.add_argument("logs", nargs="+", type=argparse.FileType("rb"),
+                     help="wptreport or raw log files")
+
+    merge = commands.add_parser("merge",
+                                help="Merge archives into a single archive, sharing test and "
+                                "subtest names between all the runs")
+    merge.add_argument("output", help="Path to write the merged archive to, which may be one "
+                       "of the input archives")
+    merge.add_argument("archives", nargs="+", help="Archives to merge, oldest first")
+
+    runs = commands.add_parser("runs", help="List the runs in an archive")
+    runs.add_argument("archive", help="Path to the archive")
+    runs.add_argument("--last", type=int, help="Number of most recent runs to list")
+
+    durations = commands.add_parser("durations",
+                                    help="Get the durations of tests with a given path prefix")
+    durations.add_argument("archive", help="Path to the archive")
+    durations.add_argument("prefix", nargs="?", default="",
+                           help="Prefix of the ids of the tests to include")
+    durations.add_argument("--last", type=int,
+                           help="Number of most recent runs to include")
+    durations.add_argument("--format", choices=["text", "json"], default="text",
+                           help="Output format")
+    return p
+
+
+def add(archive, logs):
+    from wptrunner import metadata, resultsarchive
+    from wptrunner.formatters.resultsarchive import ResultsArchiveFormatter
+    from mozlog import reader
+
+    count = 0
+    for log_file in logs:
+        if metadata.log_format(log_file) == "wptreport":
+            resultsarchive.append_chunk(archive,
+                                        resultsarchive.from_wptreport(json.load(log_file)).to_bytes())
+            count += 1
+            continue
+        formatter = ResultsArchiveFormatter()
+        for data in reader.read(log_file):
+            chunk = formatter(data)
+            if chunk:
+                resultsarchive.append_chunk(archive, chunk)
+                count += 1
+    print("Added %i runs to %s" % (count, archive))
+
+
+def run(venv, **kwargs):
+    from wptrunner import resultsarchive
+
+    command = kwargs["archive_command"]
+    if command == "add":
+        add(kwargs["archive"], kwargs["logs"])
+        return 0
+
+    if command == "merge":
+        resultsarchive.merge(kwargs["archives"], kwargs["output"])
+        return 0
+
+    with open(kwargs["archive"], "rb") as f:
+        archive = resultsarchive.ArchiveReader(f)
+        runs = archive.runs(kwargs["last"])
+        if command == "runs":
+            for i, run_data in enumerate(runs):
+                print("%i\t%s\t%s" % (i, run_data["time_start"],
+                                      json.dumps(run_data["run_info"], sort_keys=True)))
+            return 0
+
+        durations = archive.durations(kwargs["prefix"], kwargs["last"])
+
+    if kwargs["format"] == "json":
+        print(json.dumps({"runs": runs, "durations": durations}, indent=2, sort_keys=True))
+        return 0
+
+    for test in sorted(durations):
+        values = ["-"] * len(runs)
+        for run_index, status, duration in durations[test]:
+            values[run_index] = "%s:%s" % (status, "?" if duration is None else duration)
+        print("%s\t%s" % (test, "\t".join(values)))
+    return 0
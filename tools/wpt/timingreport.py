@@ -0,0 +1,35 @@
+import argparse
+import os
+import sys
+
+wpt_root = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir))
+sys.path.insert(0, os.path.abspath(os.path.join(wpt_root, "tools")))
+
+
+def create_parser():
+    p = argparse.ArgumentParser()
+    p.add_argument("--depth", type=int, default=2,
+                   help="Number of path components of the directories to group tests by")
+    p.add_argument("--limit", type=int, default=20,
+                   help="Maximum number of directories to list, or 0 for all directories")
+    p.add_argument("--format", choices=["text", "json"], default="text",
+                   help="Output format")
+    p.add_argument("logs", nargs="+", type=argparse.FileType("r"),
+                   help="Raw log files from wpt run")
+    return p
+
+
+def run(venv, **kwargs):
+    from wptrunner import timing
+
+    timings = timing.read_timings(kwargs["logs"])
+    if not timings:
+        print("No timings found; the logs must be raw logs from a run that records phase timings")
+        return 1
+
+    summary = timing.summarise(timings, depth=kwargs["depth"])
+    if kwargs["format"] == "json":
+        print(timing.format_json(summary))
+    else:
+        print(timing.format_text(summary, limit=kwargs["limit"]))
+    return 0
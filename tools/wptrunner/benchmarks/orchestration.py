@@ -0,0 +1,84 @@
+"""Measure the per-test overhead of the wptrunner orchestration layer.
+
+This runs a ManagerGroup using a browser that does nothing and an executor
+that immediately returns a result, so the elapsed time is almost entirely
+spent passing commands and results between the TestRunnerManager and
+TestRunner processes and in the manager's state machine.
+
+Usage: python benchmarks/orchestration.py [--tests N] [--processes N]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.abspath(os.path.join(here, "..", "..")))
+sys.path.insert(0, os.path.abspath(os.path.join(here, "..")))
+
+from mozlog import structuredlog  # noqa: E402
+
+from wptrunner import testloader, testrunner, wpttest  # noqa: E402
+from wptrunner.browsers.base import NullBrowser  # noqa: E402
+from wptrunner.executors.base import TestExecutor  # noqa: E402
+
+
+class NoopExecutor(TestExecutor):
+    test_type = "testharness"
+
+    def is_alive(self):
+        return True
+
+    def on_environment_change(self, new_environment):
+        pass
+
+    def do_test(self, test):
+        return (test.result_cls("OK", None),
+                [test.subtest_result_cls("subtest", "PASS", None)])
+
+
+def make_tests(count):
+    return [wpttest.TestharnessTest("/", "/noop/%i.html" % i, [], None)
+            for i in range(count)]
+
+
+def run(test_count, processes):
+    logger = structuredlog.StructuredLogger("web-platform-tests")
+    tests = make_tests(test_count)
+    logger.suite_start([test.id for test in tests], name="orchestration")
+
+    with testrunner.ManagerGroup("web-platform-tests",
+                                 processes,
+                                 testloader.SingleTestSource,
+                                 {"processes": processes},
+                                 NullBrowser,
+                                 {},
+                                 NoopExecutor,
+                                 {"server_config": {}, "timeout_multiplier": 1},
+                                 capture_stdio=False) as group:
+        start = time.time()
+        group.run("testharness", {"testharness": tests})
+        elapsed = time.time() - start
+        run_count = group.test_count()
+
+    logger.suite_end()
+    return run_count, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tests", type=int, default=2000,
+                        help="Number of tests to run")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="Number of TestRunnerManagers to use")
+    args = parser.parse_args()
+
+    run_count, elapsed = run(args.tests, args.processes)
+    print("Ran %i tests with %i processes in %.2fs" % (run_count, args.processes, elapsed))
+    print("Mean overhead: %.3fms per test" % (1000 * elapsed / max(run_count, 1)))
+    return 0 if run_count == args.tests else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
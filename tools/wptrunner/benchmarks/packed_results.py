@@ -0,0 +1,91 @@
+"""Measure the time and memory taken to store results in PackedResultList.
+
+This interns a set of synthetic run_info configurations, and then appends
+a status result for a number of tests in each of a subset of the
+configurations, in the same way ExpectedUpdater does when reading logs.
+The size of the packed data is reported along with the peak memory use of
+the process, which also includes the PackedResultList objects themselves.
+
+Usage: python benchmarks/packed_results.py [--tests N] [--configs N] [--results-per-test N]
+"""
+
+import argparse
+import os
+import random
+import resource
+import sys
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.abspath(os.path.join(here, "..", "..")))
+sys.path.insert(0, os.path.abspath(os.path.join(here, "..")))
+
+from wptrunner import metadata  # noqa: E402
+
+statuses = ["PASS", "FAIL", "TIMEOUT", "ERROR", "CRASH", "NOTRUN", "PRECONDITION_FAILED"]
+
+
+def run_infos(count):
+    products = ["firefox", "chrome", "safari", "edge", "webkitgtk"]
+    platforms = ["linux", "mac", "win", "android"]
+    for i in range(count):
+        yield metadata.RunInfo({"product": products[i % len(products)],
+                                "os": platforms[(i // len(products)) % len(platforms)],
+                                "debug": bool(i % 2),
+                                "fission": bool(i % 3),
+                                "channel": "channel-%i" % (i // 40)})
+
+
+def ingest(tests, configs, results_per_test, seed=0):
+    rand = random.Random(seed)
+    metadata.prop_intern.clear()
+    metadata.run_info_intern.clear()
+    metadata.status_intern.clear()
+
+    status_prop = metadata.prop_intern.store("status")
+    status_ids = [metadata.status_intern.store(status) for status in statuses]
+    run_info_ids = [metadata.run_info_intern.store(run_info) for run_info in run_infos(configs)]
+
+    all_results = []
+    start = time.time()
+    for _ in range(tests):
+        results = metadata.PackedResultList()
+        for _ in range(results_per_test):
+            results.append(status_prop,
+                           rand.choice(run_info_ids),
+                           status_ids[0] if rand.random() < 0.9 else rand.choice(status_ids))
+        all_results.append(results)
+    return all_results, time.time() - start
+
+
+def max_rss():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--tests", type=int, default=1000000,
+                        help="Number of tests to store results for")
+    parser.add_argument("--configs", type=int, default=1000,
+                        help="Number of distinct run_info configurations")
+    parser.add_argument("--results-per-test", type=int, default=4,
+                        help="Number of results to store for each test")
+    args = parser.parse_args()
+
+    all_results, elapsed = ingest(args.tests, args.configs, args.results_per_test)
+
+    count = sum(len(results.data) for results in all_results)
+    packed_bytes = sum(results.data.buffer_info()[1] * results.data.itemsize
+                       for results in all_results)
+    print("Stored %i results for %i tests in %i configurations in %.2fs (%.0f results/s)" %
+          (count, args.tests, args.configs, elapsed, count / elapsed if elapsed else 0))
+    print("Packed data: %.1f MB (%i bytes per result)" %
+          (packed_bytes / 1024. / 1024., metadata.PackedResultList().data.itemsize))
+    print("Peak memory: %.1f MB" % (max_rss() / 1024. / 1024.))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+"""Measure the time taken by fuzzy comparison of reftest screenshots.
+
+This compares a set of 800x600 screenshots against a single reference, as
+happens when many reftests share one reference file, using both the cached
+NumPy comparison and the uncached PIL comparison. Real screenshots can be
+passed with --images; otherwise page-like images with small rendering
+differences are generated.
+
+Usage: python benchmarks/reftest_compare.py [--tests N] [--images REF TEST...]
+"""
+
+import argparse
+import base64
+import hashlib
+import os
+import random
+import sys
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.abspath(os.path.join(here, "..", "..")))
+sys.path.insert(0, os.path.abspath(os.path.join(here, "..")))
+
+from PIL import Image, ImageDraw  # noqa: E402
+
+from wptrunner.imagecompare import ImageComparator, encode_png  # noqa: E402
+
+
+def make_screenshot(rng, jitter):
+    image = Image.new("RGB", (800, 600), (255, 255, 255))
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((0, 0, 799, 40), fill=(30, 30, 120))
+    for i in range(20):
+        draw.text((20, 60 + 25 * i), "Line %i of some reftest content" % i, fill=(0, 0, 0))
+    draw.rectangle((400, 100, 600, 300), fill=(0, 128, 0))
+    draw.ellipse((450, 350, 650, 550), outline=(200, 0, 0))
+    for _ in range(jitter):
+        x, y = rng.randrange(800), rng.randrange(600)
+        r, g, b = image.getpixel((x, y))
+        image.putpixel((x, y), (max(r - rng.randrange(1, 4), 0), g, b))
+    return encode_png(image)
+
+
+def load_screenshot(path):
+    with open(path, "rb") as f:
+        return base64.b64encode(f.read()).decode("ascii")
+
+
+def screenshot_hash(data):
+    return hashlib.sha1(base64.b64decode(data)).hexdigest()
+
+
+def run(ref, tests, use_numpy):
+    comparator = ImageComparator()
+    ref_hash = screenshot_hash(ref)
+    start = time.time()
+    for test, test_hash in tests:
+        if use_numpy:
+            comparator.get_differences((test, ref), (test_hash, ref_hash))
+        else:
+            comparator._get_differences_pil((test, ref), False)
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tests", type=int, default=200,
+                        help="Number of test screenshots to compare against the reference")
+    parser.add_argument("--images", nargs="+", metavar="PNG",
+                        help="Reference screenshot followed by test screenshots to use")
+    args = parser.parse_args()
+
+    if args.images:
+        ref = load_screenshot(args.images[0])
+        test_data = [load_screenshot(path) for path in args.images[1:]]
+        test_data = [test_data[i % len(test_data)] for i in range(args.tests)]
+    else:
+        rng = random.Random(0)
+        ref = make_screenshot(rng, 0)
+        test_data = [make_screenshot(rng, 50) for _ in range(args.tests)]
+    tests = [(item, screenshot_hash(item)) for item in test_data]
+
+    for name, use_numpy in [("PIL", False), ("NumPy", True)]:
+        elapsed = run(ref, tests, use_numpy)
+        print("%s: compared %i screenshots in %.2fs (%.2fms per comparison)" %
+              (name, len(tests), elapsed, 1000 * elapsed / len(tests)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+"""Measure WebDriver commands per second against a local stub driver.
+
+The stub driver answers every command with a small JSON response containing
+an element reference, so the measurement is dominated by the client side:
+connection handling and JSON encoding and decoding in webdriver.transport.
+Commands are sent through webdriver.Session, as the WebDriver executors do,
+both from a single caller and from several threads sharing one session.
+Setting --pool-size 0 opens a new connection for every command.
+
+Usage: python benchmarks/webdriver_transport.py [--commands N] [--threads N]
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.abspath(os.path.join(here, "..", "..")))
+sys.path.insert(0, os.path.abspath(os.path.join(here, "..")))
+
+import localpaths  # noqa: E402, F401
+
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer  # noqa: E402
+from six.moves.socketserver import ThreadingMixIn  # noqa: E402
+
+import webdriver  # noqa: E402
+from webdriver import transport  # noqa: E402
+
+
+response_body = json.dumps({"value": {
+    "element": {webdriver.Element.identifier: "a6f5d1b0-0d64-4ef3-9b5f-2b7c1b63c2a8"},
+    "rect": {"x": 0, "y": 0, "width": 800, "height": 600},
+    "text": "Some text returned by the stub driver"}}).encode("utf8")
+
+
+class StubDriverHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Send each response in a single write, to avoid Nagle delays
+    wbufsize = -1
+
+    def handle_command(self):
+        length = int(self.headers.get("Content-Length", 0))
+        if length:
+            self.rfile.read(length)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(response_body)))
+        self.end_headers()
+        self.wfile.write(response_body)
+
+    def do_GET(self):
+        self.handle_command()
+
+    def do_POST(self):
+        self.handle_command()
+
+    def do_DELETE(self):
+        self.handle_command()
+
+    def log_message(self, *args):
+        pass
+
+
+class StubDriver(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def send_commands(session, count):
+    body = {"script": "return document.title", "args": []}
+    for _ in range(count):
+        session.send_session_command("POST", "execute/sync", body)
+
+
+def run(port, commands, threads, pool_size):
+    session = webdriver.Session("127.0.0.1", port)
+    session.transport = transport.HTTPWireProtocol("127.0.0.1", port, pool_size=pool_size)
+    session.session_id = "stub"
+    per_thread = commands // threads
+    workers = [threading.Thread(target=send_commands, args=(session, per_thread))
+               for _ in range(threads)]
+    start = time.time()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.time() - start
+    session.transport.close()
+    session.session_id = None
+    return per_thread * threads, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--commands", type=int, default=5000,
+                        help="Number of commands to send in each configuration")
+    parser.add_argument("--threads", type=int, default=4,
+                        help="Number of threads for the concurrent configuration")
+    parser.add_argument("--pool-size", type=int, default=4,
+                        help="Maximum number of idle keep-alive connections")
+    args = parser.parse_args()
+
+    server = StubDriver(("127.0.0.1", 0), StubDriverHandler)
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+    port = server.server_address[1]
+
+    print("JSON codec: %s" % (transport.fast_json.__name__ if transport.fast_json else "json"))
+    try:
+        for threads in sorted({1, args.threads}):
+            count, elapsed = run(port, args.commands, threads, args.pool_size)
+            print("%i thread(s), pool size %i: %i commands in %.2fs (%.0f commands/s)" %
+                  (threads, args.pool_size, count, elapsed, count / elapsed))
+    finally:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+"""Measure the time taken to parse a large tree of expectation metadata files.
+
+This generates a synthetic metadata tree containing a mix of the constructs
+found in real expectation files (headings, subtests, conditional values,
+lists, atoms, escapes and comments), and then parses every file with
+wptmanifest, optionally also compiling it against a run_info dictionary.
+
+Usage: python benchmarks/wptmanifest_parse.py [--files N] [--compile]
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.abspath(os.path.join(here, "..", "..")))
+sys.path.insert(0, os.path.abspath(os.path.join(here, "..")))
+
+from wptrunner.wptmanifest import parser  # noqa: E402
+from wptrunner.wptmanifest.backends import static  # noqa: E402
+from wptrunner.wptmanifest.backends.base import ManifestItem  # noqa: E402
+
+templates = [
+    """[test-%(i)i.html]
+  expected: TIMEOUT
+""",
+    """[test-%(i)i.html]
+  [Subtest one for %(i)i]
+    expected: FAIL
+
+  [Subtest "two" with \\u00e9scape]
+    expected:
+      if os == "win": FAIL
+      if (os == "linux") and debug: [PASS, FAIL]
+      PASS
+
+""",
+    """prefs: [dom.foo.enabled:true, layout.bar:2]
+lsan-allowed: [Alloc, Create, mozilla::dom::Thing]
+
+[test-%(i)i.html]
+  disabled:
+    if (os == "mac") and (version == "OS X 10.14"): https://bugzilla.example/%(i)i
+  expected:
+    if not debug and (processor == "x86_64") and (bits == 64): ERROR  # Comment
+    if webrender or (os == "android"): CRASH
+""",
+    """[test-%(i)i.html?a=1]
+  bug: %(i)i
+  [subtest a]
+    expected:
+      if product == "firefox" and os != "win": @False
+      PASS
+
+[test-%(i)i.html?a=2]
+  fuzzy: maxDifference=0-3;totalPixels=0-%(i)i
+  min-asserts: 1
+  max-asserts: 3
+""",
+]
+
+
+def generate_tree(root, count):
+    paths = []
+    for i in range(count):
+        dir_path = os.path.join(root, "dir%i" % (i // 500), "sub%i" % (i // 50 % 10))
+        if not os.path.exists(dir_path):
+            os.makedirs(dir_path)
+        path = os.path.join(dir_path, "test-%i.html.ini" % i)
+        with open(path, "wb") as f:
+            f.write((templates[i % len(templates)] % {"i": i}).encode("utf8"))
+        paths.append(path)
+    return paths
+
+
+def run(paths, compile_data):
+    run_info = {"os": "linux", "debug": False, "processor": "x86_64", "bits": 64,
+                "version": "Ubuntu 18.04", "webrender": False, "product": "firefox"}
+    start = time.time()
+    for path in paths:
+        with open(path, "rb") as f:
+            if compile_data:
+                static.compile(f, run_info,
+                               data_cls_getter=lambda x, y: ManifestItem)
+            else:
+                parser.parse(f)
+    return time.time() - start
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--files", type=int, default=50000,
+                            help="Number of .ini files to generate")
+    arg_parser.add_argument("--compile", action="store_true",
+                            help="Compile each file against run_info as well as parsing it")
+    args = arg_parser.parse_args()
+
+    root = tempfile.mkdtemp()
+    try:
+        paths = generate_tree(root, args.files)
+        elapsed = run(paths, args.compile)
+    finally:
+        shutil.rmtree(root)
+
+    print("%s %i files in %.2fs (%.1fus per file)" % ("Compiled" if args.compile else "Parsed",
+                                                     len(paths), elapsed,
+                                                     1e6 * elapsed / max(len(paths), 1)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -78,6 +78,12 @@ class Browser(object):
 
     process_cls = None
     init_timeout = 30
+    # Whether multiple instances of the browser can run at the same time, so
+    # that a standby instance can be launched while tests are running
+    supports_prewarm = False
+    # Whether the group metadata passed to start affects the browser, so that
+    # a standby instance can only be used for the group it was started for
+    start_uses_group_metadata = False
 
     def __init__(self, logger):
         """Abstract class serving as the basis for Browser implementations.
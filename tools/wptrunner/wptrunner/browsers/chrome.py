@@ -98,6 +98,8 @@ class ChromeBrowser(Browser):
     ``wptrunner.webdriver.ChromeDriverServer``.
     """
 
+    supports_prewarm = True
+
     def __init__(self, logger, binary, webdriver_binary="chromedriver",
                  webdriver_args=None):
         """Creates a new representation of Chrome.  The `binary` argument gives
@@ -84,6 +84,8 @@ class EdgeChromiumBrowser(Browser):
     ``wptrunner.webdriver.EdgeChromiumDriverServer``.
     """
 
+    supports_prewarm = True
+
     def __init__(self, logger, binary, webdriver_binary="msedgedriver",
                  webdriver_args=None):
         """Creates a new representation of MicrosoftEdge.  The `binary` argument gives
@@ -188,6 +188,8 @@ def update_properties():
 class FirefoxBrowser(Browser):
     init_timeout = 70
     shutdown_timeout = 70
+    supports_prewarm = True
+    start_uses_group_metadata = True
 
     def __init__(self, logger, binary, prefs_root, test_type, extra_prefs=None, debug_info=None,
                  symbols_path=None, stackwalk_binary=None, certutil_binary=None,
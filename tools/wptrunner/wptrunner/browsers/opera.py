@@ -70,6 +70,8 @@ class OperaBrowser(Browser):
     ``wptrunner.webdriver.OperaDriverServer``.
     """
 
+    supports_prewarm = True
+
     def __init__(self, logger, binary, webdriver_binary="operadriver",
                  webdriver_args=None):
         """Creates a new representation of Opera.  The `binary` argument gives
@@ -0,0 +1,174 @@
+import select
+import sys
+import threading
+import time
+from multiprocessing import Pipe
+from six.moves.queue import Empty
+
+try:
+    from multiprocessing.connection import wait as connection_wait
+except ImportError:
+    # Python 2 doesn't have multiprocessing.connection.wait
+    connection_wait = None
+
+
+def wait(objects, timeout=None):
+    """Wait until at least one of the given Connection objects is readable,
+    or one of the given process sentinels is ready.
+
+    :param objects: List of Connection objects and process sentinels
+    :param timeout: Maximum number of seconds to wait, or None to wait
+                    indefinitely
+    :returns: List of the objects that are ready
+    """
+    if connection_wait is not None:
+        return connection_wait(objects, timeout)
+
+    if sys.platform != "win32":
+        try:
+            ready, _, _ = select.select(objects, [], [], timeout)
+        except select.error:
+            return []
+        return ready
+
+    # Pipes on Windows can't be passed to select, so fall back to polling
+    end_time = time.time() + timeout if timeout is not None else None
+    while True:
+        ready = [item for item in objects if hasattr(item, "poll") and item.poll()]
+        if ready or (end_time is not None and time.time() >= end_time):
+            return ready
+        time.sleep(0.01)
+
+
+class Channel(object):
+    def __init__(self, conn):
+        """One end of a duplex pipe carrying (command, args) messages between
+        a TestRunnerManager and its TestRunner process.
+
+        Unlike a multiprocessing.Queue, there is no feeder thread; messages are
+        written directly to the pipe by the sending thread.
+
+        :param conn: multiprocessing Connection object
+        """
+        self.conn = conn
+        # The runner process sends messages from the main thread and from
+        # executor threads (e.g. via the logger), so writes are serialized.
+        self.lock = threading.Lock()
+
+    def put(self, item):
+        with self.lock:
+            self.conn.send(item)
+
+    def get(self, block=True, timeout=None):
+        if not block:
+            timeout = 0
+        if timeout is not None and not self.conn.poll(timeout):
+            raise Empty
+        return self.conn.recv()
+
+    def get_nowait(self):
+        return self.get(False)
+
+    def close(self):
+        self.conn.close()
+
+
+class ManagerChannel(object):
+    def __init__(self):
+        """Manager end of the transport to a TestRunner process.
+
+        As well as the pipe to the runner, this has a local pipe so that other
+        threads in the manager process (e.g. the browser init timer) can wake
+        the manager's event loop by putting a message. Waiting for a message
+        also returns as soon as the runner process exits, if a process
+        sentinel is available.
+        """
+        self.remote = None
+        self.sentinel = None
+        self.local_reader, local_writer = Pipe(duplex=False)
+        self.local = Channel(local_writer)
+
+    def connect(self):
+        """Create a new pipe to a runner process, discarding any existing
+        pipe.
+
+        :returns: The runner's end of the pipe, which must be passed to the
+                  runner process.
+        """
+        self.close_remote()
+        manager_end, runner_end = Pipe()
+        self.remote = Channel(manager_end)
+        self.sentinel = None
+        return runner_end
+
+    def set_process(self, process):
+        self.sentinel = getattr(process, "sentinel", None)
+
+    def close_remote(self):
+        if self.remote is not None:
+            self.remote.close()
+            self.remote = None
+        self.sentinel = None
+
+    def close(self):
+        self.close_remote()
+        self.local.close()
+        self.local_reader.close()
+
+    def send(self, item):
+        """Send a message to the runner process
+
+        :raises IOError: If there is no open pipe to the runner process
+        """
+        if self.remote is None:
+            raise IOError("No pipe to runner process")
+        self.remote.put(item)
+
+    def put(self, item):
+        """Send a message to the manager from a thread in the manager
+        process"""
+        self.local.put(item)
+
+    def get(self, block=True, timeout=None):
+        """Get the next message from either the runner process or from a
+        thread in this process.
+
+        :raises Empty: If no message was received before the timeout, or if the
+                       runner process exited.
+        """
+        if not block:
+            timeout = 0
+        readers = [self.local_reader]
+        if self.remote is not None:
+            readers.append(self.remote.conn)
+        objects = readers[:]
+        if self.sentinel is not None:
+            objects.append(self.sentinel)
+
+        ready = wait(objects, timeout)
+        for conn in readers:
+            if conn in ready:
+                try:
+                    return conn.recv()
+                except EOFError:
+                    if conn is self.local_reader:
+                        raise
+                    # The runner process closed its end of the pipe, so
+                    # there can't be any more messages from it.
+                    self.close_remote()
+                    raise Empty
+
+        if self.sentinel is not None and self.sentinel in ready:
+            # The process exited without leaving anything in the pipe. Stop
+            # waiting on the sentinel so that callers don't spin, and report
+            # this in the same way as a timeout.
+            self.sentinel = None
+        raise Empty
+
+    def get_nowait(self):
+        return self.get(False)
+
+    def empty(self):
+        if self.local_reader.poll():
+            return False
+        return self.remote is None or not self.remote.conn.poll()
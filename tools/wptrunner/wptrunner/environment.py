@@ -1,6 +1,5 @@
 import json
 import os
-import multiprocessing
 import signal
 import socket
 import sys
@@ -8,6 +7,7 @@ import time
 
 from mozlog import get_default_logger, handlers, proxy
 
+from .screenshotstore import ScreenshotCache
 from .wptlogging import LogLevelRewriter
 
 here = os.path.split(__file__)[0]
@@ -18,6 +18,8 @@ from tools import localpaths  # noqa: F401
 
 from wptserve.handlers import StringHandler
 
+from . import resultchannel
+
 serve = None
 
 
@@ -50,10 +52,12 @@ class TestEnvironmentError(Exception):
 
 
 class TestEnvironment(object):
-    def __init__(self, test_paths, testharness_timeout_multipler, pause_after_test, debug_info, options, ssl_config, env_extras):
+    def __init__(self, test_paths, testharness_timeout_multipler, pause_after_test, debug_info, options, ssl_config, env_extras,
+                 screenshot_cache=None, result_channel=False):
         """Context manager that owns the test environment i.e. the http and
         websockets servers"""
         self.test_paths = test_paths
+        self.result_channel = result_channel
         self.server = None
         self.config_ctx = None
         self.config = None
@@ -63,7 +67,7 @@ class TestEnvironment(object):
         self.debug_info = debug_info
         self.options = options if options is not None else {}
 
-        self.cache_manager = multiprocessing.Manager()
+        self.cache_manager = screenshot_cache if screenshot_cache is not None else ScreenshotCache()
         self.stash = serve.stash.StashServer()
         self.env_extras = env_extras
         self.env_extras_cms = None
@@ -193,6 +197,9 @@ class TestEnvironment(object):
             data += fp.read()
         route_builder.add_handler(b"GET", b"/resources/testdriver.js",
                                   StringHandler(data, "text/javascript"))
+        if self.result_channel:
+            route_builder.add_handler(b"POST", resultchannel.channel_path.encode("ascii"),
+                                      resultchannel.forward_message)
 
         for url_base, paths in self.test_paths.iteritems():
             if url_base == "/":
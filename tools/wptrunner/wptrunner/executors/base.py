@@ -1,7 +1,6 @@
 import base64
 import hashlib
 from six.moves.http_client import HTTPConnection
-import io
 import json
 import os
 import threading
@@ -10,7 +9,10 @@ import socket
 from six.moves.urllib.parse import urljoin, urlsplit, urlunsplit
 from abc import ABCMeta, abstractmethod
 
+from ..imagecompare import ImageComparator
 from ..testrunner import Stop
+from ..timing import PhaseTimer, extra_key as timing_key
+from ..wpttest import pack_results
 from .protocol import Protocol, BaseProtocolPart
 
 here = os.path.split(__file__)[0]
@@ -30,13 +32,18 @@ def executor_kwargs(test_type, server_config, cache_manager, run_info_data,
                        "timeout_multiplier": timeout_multiplier,
                        "debug_info": kwargs["debug_info"]}
 
+    if test_type == "testharness":
+        executor_kwargs["reuse_window"] = kwargs.get("reuse_window", False)
+        executor_kwargs["result_channel"] = kwargs.get("result_channel", False)
+
     if test_type == "reftest":
-        executor_kwargs["screenshot_cache"] = cache_manager.dict()
+        executor_kwargs["screenshot_cache"] = cache_manager.store()
 
     if test_type == "wdspec":
         executor_kwargs["binary"] = kwargs.get("binary")
         executor_kwargs["webdriver_binary"] = kwargs.get("webdriver_binary")
         executor_kwargs["webdriver_args"] = kwargs.get("webdriver_args")
+        executor_kwargs["wdspec_worker"] = kwargs.get("wdspec_worker", False)
 
     return executor_kwargs
 
@@ -157,6 +164,8 @@ class TestExecutor(object):
         self.last_environment = {"protocol": "http",
                                  "prefs": {}}
         self.protocol = None  # This must be set in subclasses
+        # Timings of the phases of the current test
+        self.timer = PhaseTimer()
 
     @property
     def logger(self):
@@ -187,8 +196,12 @@ class TestExecutor(object):
         """Run a particular test.
 
         :param test: The test to run"""
+        # A new timer for each test, so that any thread left running by a
+        # previous test doesn't record its timings against this one
+        self.timer = PhaseTimer()
         if test.environment != self.last_environment:
-            self.on_environment_change(test.environment)
+            with self.timer.phase("setup"):
+                self.on_environment_change(test.environment)
         try:
             result = self.do_test(test)
         except Exception as e:
@@ -198,13 +211,17 @@ class TestExecutor(object):
         if result is Stop:
             return result
 
+        timings = self.timer.pop()
+        if timings:
+            result[0].extra[timing_key] = timings
+
         # log result of parent test
         if result[0].status == "ERROR":
             self.logger.debug(result[0].message)
 
         self.last_environment = test.environment
 
-        self.runner.send_message("test_ended", test, result)
+        self.runner.send_message("test_ended", test.id, pack_results(result))
 
     def server_url(self, protocol):
         return "%s://%s:%s" % (protocol,
@@ -248,24 +265,38 @@ class RefTestExecutor(TestExecutor):
     convert_result = reftest_result_converter
 
     def __init__(self, browser, server_config, timeout_multiplier=1, screenshot_cache=None,
-                 debug_info=None, **kwargs):
+                 debug_info=None, group_metadata=None, **kwargs):
         TestExecutor.__init__(self, browser, server_config,
                               timeout_multiplier=timeout_multiplier,
                               debug_info=debug_info)
 
         self.screenshot_cache = screenshot_cache
+        self.group_metadata = group_metadata
 
 
 class RefTestImplementation(object):
+    # Maximum number of seconds to wait for another process to take a
+    # screenshot before taking it in this process
+    claim_wait = 5
+
     def __init__(self, executor):
         self.timeout_multiplier = executor.timeout_multiplier
         self.executor = executor
-        # Cache of url:(screenshot hash, screenshot). Typically the
-        # screenshot is None, but we set this value if a test fails
-        # and the screenshot was taken from the cache so that we may
-        # retrieve the screenshot from the cache directly in the future
+        # ScreenshotStore mapping (url, viewport_size, dpi) to a screenshot
+        # hash. The screenshot data itself is only read back from the store
+        # when it is needed for a fuzzy comparison or for the logs.
         self.screenshot_cache = self.executor.screenshot_cache
+        self.comparator = ImageComparator()
         self.message = None
+        # Number of remaining uses of each (protocol, url) as a reference by
+        # tests in this group. Screenshots that will be used again are pinned
+        # in the store so that they aren't evicted.
+        group_metadata = getattr(executor, "group_metadata", None) or {}
+        self.url_count = dict(group_metadata.get("url_count", {}))
+        self.pinned = {}
+        self.used = {}
+        # Set by reset() so that the next run takes new screenshots
+        self.retake = False
 
     def setup(self):
         pass
@@ -277,35 +308,77 @@ class RefTestImplementation(object):
     def logger(self):
         return self.executor.logger
 
+    @property
+    def timer(self):
+        return self.executor.timer
+
     def get_hash(self, test, viewport_size, dpi):
         key = (test.url, viewport_size, dpi)
 
-        if key not in self.screenshot_cache:
-            success, data = self.executor.screenshot(test, viewport_size, dpi)
-
-            if not success:
-                return False, data
-
-            screenshot = data
-            hash_value = hash_screenshot(data)
-            self.screenshot_cache[key] = (hash_value, screenshot)
-
-            rv = (hash_value, screenshot)
-        else:
-            rv = self.screenshot_cache[key]
-
+        hash_value = None if self.retake else self.screenshot_cache.get_hash(key)
+        data = None
+        if hash_value is None:
+            # Only one process takes a given screenshot at a time; others
+            # wait briefly for it to appear in the shared index, and take it
+            # themselves if it doesn't.
+            timeout = test.timeout * self.timeout_multiplier
+            claimed = self.screenshot_cache.claim(key, timeout)
+            if not claimed and not self.retake:
+                hash_value = self.screenshot_cache.wait_hash(key, min(timeout, self.claim_wait))
+            try:
+                if hash_value is None:
+                    success, data = self.executor.screenshot(test, viewport_size, dpi)
+
+                    if not success:
+                        return False, data
+
+                    with self.timer.phase("hash"):
+                        hash_value = self.screenshot_cache.put(data)
+                        self.screenshot_cache.set_hash(key, hash_value)
+            finally:
+                if claimed:
+                    self.screenshot_cache.release_claim(key)
+
+        url_key = (test.environment["protocol"], test.url)
+        self.used[key] = (url_key, hash_value)
+        if key not in self.pinned and self.url_count.get(url_key, 0) > 0:
+            self.pinned[key] = hash_value
+            self.screenshot_cache.pin(hash_value)
+
+        rv = (hash_value, data)
         self.message.append("%s %s" % (test.url, rv[0]))
         return True, rv
 
+    def release_screenshots(self, test):
+        """Count the uses of references by a test that has finished, and
+        release the screenshots that no remaining test in the group uses."""
+        stack = [test]
+        while stack:
+            node = stack.pop()
+            for reference, _ in node.references:
+                url_key = (reference.environment["protocol"], reference.url)
+                if self.url_count.get(url_key, 0) > 0:
+                    self.url_count[url_key] -= 1
+                stack.append(reference)
+
+        for key, (url_key, hash_value) in self.used.items():
+            if self.url_count.get(url_key, 0) > 0:
+                continue
+            if key in self.pinned:
+                self.screenshot_cache.unpin(self.pinned.pop(key))
+            else:
+                self.screenshot_cache.release(hash_value)
+        self.used = {}
+
     def reset(self):
-        self.screenshot_cache.clear()
+        self.retake = True
 
     def is_pass(self, hashes, screenshots, relation, fuzzy):
         assert relation in ("==", "!=")
         if not fuzzy or fuzzy == ((0,0), (0,0)):
             equal = hashes[0] == hashes[1]
         else:
-            max_per_channel, pixels_different = self.get_differences(screenshots)
+            max_per_channel, pixels_different = self.get_differences(screenshots, hashes)
             allowed_per_channel, allowed_different = fuzzy
             self.logger.info("Allowed %s pixels different, maximum difference per channel %s" %
                              ("-".join(str(item) for item in allowed_different),
@@ -316,22 +389,20 @@ class RefTestImplementation(object):
                       allowed_different[0] <= pixels_different <= allowed_different[1]))
         return equal if relation == "==" else not equal
 
-    def get_differences(self, screenshots):
-        from PIL import Image, ImageChops, ImageStat
-
-        lhs = Image.open(io.BytesIO(base64.b64decode(screenshots[0]))).convert("RGB")
-        rhs = Image.open(io.BytesIO(base64.b64decode(screenshots[1]))).convert("RGB")
-        diff = ImageChops.difference(lhs, rhs)
-        minimal_diff = diff.crop(diff.getbbox())
-        mask = minimal_diff.convert("L", dither=None)
-        stat = ImageStat.Stat(minimal_diff, mask)
-        per_channel = max(item[1] for item in stat.extrema)
-        count = stat.count[0]
+    def get_differences(self, screenshots, hashes=None):
+        per_channel, count = self.comparator.get_differences(screenshots, hashes)
         self.logger.info("Found %s pixels different, maximum difference per channel %s" %
                          (count, per_channel))
         return per_channel, count
 
     def run_test(self, test):
+        try:
+            return self._run_test(test)
+        finally:
+            self.retake = False
+            self.release_screenshots(test)
+
+    def _run_test(self, test):
         viewport_size = test.viewport_size
         dpi = test.dpi
         self.message = []
@@ -354,7 +425,17 @@ class RefTestImplementation(object):
 
                 hashes[i], screenshots[i] = data
 
-            if self.is_pass(hashes, screenshots, relation, fuzzy):
+            if fuzzy and fuzzy != ((0, 0), (0, 0)):
+                for i, node in enumerate(nodes):
+                    if screenshots[i] is None:
+                        success, data = self.get_screenshot(node, hashes[i], viewport_size, dpi)
+                        if not success:
+                            return {"status": data[0], "message": data[1]}
+                        screenshots[i] = data
+
+            with self.timer.phase("compare"):
+                is_pass = self.is_pass(hashes, screenshots, relation, fuzzy)
+            if is_pass:
                 fuzzy = self.get_fuzzy(test, nodes, relation)
                 if nodes[1].references:
                     stack.extend(list(((nodes[1], item[0]), item[1]) for item in reversed(nodes[1].references)))
@@ -366,19 +447,24 @@ class RefTestImplementation(object):
 
         for i, (node, screenshot) in enumerate(zip(nodes, screenshots)):
             if screenshot is None:
-                success, screenshot = self.retake_screenshot(node, viewport_size, dpi)
+                success, screenshot = self.get_screenshot(node, hashes[i], viewport_size, dpi)
                 if success:
                     screenshots[i] = screenshot
 
         log_data = [
-            {"url": nodes[0].url, "screenshot": screenshots[0], "hash": hashes[0]},
+            self.screenshot_log_entry(nodes[0].url, hashes[0], screenshots[0]),
             relation,
-            {"url": nodes[1].url, "screenshot": screenshots[1], "hash": hashes[1]},
+            self.screenshot_log_entry(nodes[1].url, hashes[1], screenshots[1]),
         ]
 
+        extra = {"reftest_screenshots": log_data}
+        if fuzzy and fuzzy != ((0, 0), (0, 0)) and None not in screenshots:
+            with self.timer.phase("compare"):
+                extra["reftest_differences"] = self.differences_log_entry(screenshots, hashes)
+
         return {"status": "FAIL",
                 "message": "\n".join(self.message),
-                "extra": {"reftest_screenshots": log_data}}
+                "extra": extra}
 
     def get_fuzzy(self, root_test, test_nodes, relation):
         full_key = tuple([item.url for item in test_nodes] + [relation])
@@ -399,14 +485,36 @@ class RefTestImplementation(object):
                 break
         return value
 
+    def screenshot_log_entry(self, url, hash_value, screenshot):
+        entry = {"url": url, "hash": hash_value}
+        if screenshot is not None and self.screenshot_cache.log_files:
+            entry["screenshot_file"] = self.screenshot_cache.export(screenshot)
+        else:
+            entry["screenshot"] = screenshot
+        return entry
+
+    def differences_log_entry(self, screenshots, hashes):
+        per_channel, count, mask = self.comparator.get_differences(screenshots, hashes, mask=True)
+        entry = {"max_difference": per_channel, "pixels_different": count}
+        if self.screenshot_cache.log_files:
+            entry["mask_file"] = self.screenshot_cache.export(mask)
+        else:
+            entry["mask"] = mask
+        return entry
+
+    def get_screenshot(self, node, hash_value, viewport_size, dpi):
+        data = self.screenshot_cache.get(hash_value)
+        if data is not None:
+            return True, data
+        return self.retake_screenshot(node, viewport_size, dpi)
+
     def retake_screenshot(self, node, viewport_size, dpi):
         success, data = self.executor.screenshot(node, viewport_size, dpi)
         if not success:
             return False, data
 
-        key = (node.url, viewport_size, dpi)
-        hash_val, _ = self.screenshot_cache[key]
-        self.screenshot_cache[key] = hash_val, data
+        with self.timer.phase("hash"):
+            self.screenshot_cache.put(data)
         return True, data
 
 
@@ -416,7 +524,14 @@ class WdspecExecutor(TestExecutor):
 
     def __init__(self, browser, server_config, webdriver_binary,
                  webdriver_args, timeout_multiplier=1, capabilities=None,
-                 debug_info=None, **kwargs):
+                 debug_info=None, wdspec_worker=False, **kwargs):
+        """Executor for wdspec tests
+
+        :param wdspec_worker: Run the tests in a long-lived pytest worker
+                              process that reuses the WebDriver session
+                              across test files, rather than starting pytest
+                              in this process for each file.
+        """
         self.do_delayed_imports()
         TestExecutor.__init__(self, browser, server_config,
                               timeout_multiplier=timeout_multiplier,
@@ -426,6 +541,14 @@ class WdspecExecutor(TestExecutor):
         self.timeout_multiplier = timeout_multiplier
         self.capabilities = capabilities
         self.protocol = self.protocol_cls(self, browser)
+        self.use_worker = wdspec_worker
+        self.worker = None
+
+    def teardown(self):
+        if self.worker is not None:
+            self.worker.stop()
+            self.worker = None
+        super(WdspecExecutor, self).teardown()
 
     def is_alive(self):
         return self.protocol.is_alive
@@ -436,10 +559,17 @@ class WdspecExecutor(TestExecutor):
     def do_test(self, test):
         timeout = test.timeout * self.timeout_multiplier + extra_timeout
 
-        success, data = WdspecRun(self.do_wdspec,
-                                  self.protocol.session_config,
-                                  test.abs_path,
-                                  timeout).run()
+        if self.use_worker:
+            if self.worker is None:
+                environ = pytestrunner.session_environment(self.server_config,
+                                                           self.protocol.session_config)
+                self.worker = pytestrunner.PytestWorker(self.logger, environ)
+            success, data = self.worker.run(test.abs_path, timeout)
+        else:
+            success, data = WdspecRun(self.do_wdspec,
+                                      self.protocol.session_config,
+                                      test.abs_path,
+                                      timeout).run()
 
         if success:
             return self.convert_result(test, data)
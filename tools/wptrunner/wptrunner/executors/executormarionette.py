@@ -32,7 +32,9 @@ from .protocol import (ActionSequenceProtocolPart,
                        SendKeysProtocolPart,
                        TestDriverProtocolPart,
                        CoverageProtocolPart)
+from ..resultchannel import ResultChannel, ResultChannelTimeout
 from ..testrunner import Stop
+from ..timing import PhaseTimer
 from ..webdriver_server import GeckoDriverServer
 
 
@@ -567,7 +569,7 @@ class MarionetteProtocol(Protocol):
 
 
 class ExecuteAsyncScriptRun(object):
-    def __init__(self, logger, func, protocol, url, timeout):
+    def __init__(self, logger, func, protocol, url, timeout, timer=None):
         self.logger = logger
         self.result = (None, None)
         self.protocol = protocol
@@ -575,26 +577,28 @@ class ExecuteAsyncScriptRun(object):
         self.url = url
         self.timeout = timeout
         self.result_flag = threading.Event()
+        self.timer = timer if timer is not None else PhaseTimer()
 
     def run(self):
-        index = self.url.rfind("/storage/")
-        if index != -1:
-            # Clear storage
-            self.protocol.storage.clear_origin(self.url)
-
         timeout = self.timeout
 
-        try:
-            if timeout is not None:
-                self.protocol.base.set_timeout(timeout + extra_timeout)
-            else:
-                # We just want it to never time out, really, but marionette doesn't
-                # make that possible. It also seems to time out immediately if the
-                # timeout is set too high. This works at least.
-                self.protocol.base.set_timeout(2**28 - 1)
-        except IOError:
-            self.logger.error("Lost marionette connection before starting test")
-            return Stop
+        with self.timer.phase("setup"):
+            index = self.url.rfind("/storage/")
+            if index != -1:
+                # Clear storage
+                self.protocol.storage.clear_origin(self.url)
+
+            try:
+                if timeout is not None:
+                    self.protocol.base.set_timeout(timeout + extra_timeout)
+                else:
+                    # We just want it to never time out, really, but marionette doesn't
+                    # make that possible. It also seems to time out immediately if the
+                    # timeout is set too high. This works at least.
+                    self.protocol.base.set_timeout(2**28 - 1)
+            except IOError:
+                self.logger.error("Lost marionette connection before starting test")
+                return Stop
 
         if timeout is not None:
             wait_timeout = timeout + 2 * extra_timeout
@@ -625,7 +629,7 @@ class ExecuteAsyncScriptRun(object):
     def _run(self):
         try:
             self.result = True, self.func(self.protocol, self.url, self.timeout)
-        except errors.ScriptTimeoutException:
+        except (errors.ScriptTimeoutException, ResultChannelTimeout):
             self.logger.debug("Got a marionette timeout")
             self.result = False, ("EXTERNAL-TIMEOUT", None)
         except IOError:
@@ -660,8 +664,13 @@ class MarionetteTestharnessExecutor(TestharnessExecutor):
 
     def __init__(self, browser, server_config, timeout_multiplier=1,
                  close_after_done=True, debug_info=None, capabilities=None,
-                 debug=False, ccov=False, **kwargs):
-        """Marionette-based executor for testharness.js tests"""
+                 debug=False, ccov=False, result_channel=False, **kwargs):
+        """Marionette-based executor for testharness.js tests
+
+        :param result_channel: Have tests post their results and testdriver
+                               actions to a ResultChannel, rather than
+                               collecting each one with an async script.
+        """
         TestharnessExecutor.__init__(self, browser, server_config,
                                      timeout_multiplier=timeout_multiplier,
                                      debug_info=debug_info)
@@ -673,9 +682,12 @@ class MarionetteTestharnessExecutor(TestharnessExecutor):
                                            ccov)
         with open(os.path.join(here, "testharness_webdriver_resume.js")) as f:
             self.script_resume = f.read()
+        with open(os.path.join(here, "testharness_channel.js")) as f:
+            self.script_channel = f.read()
         self.close_after_done = close_after_done
         self.window_id = str(uuid.uuid4())
         self.debug = debug
+        self.result_channel = ResultChannel() if result_channel else None
 
         self.original_pref_values = {}
 
@@ -686,6 +698,11 @@ class MarionetteTestharnessExecutor(TestharnessExecutor):
         super(MarionetteTestharnessExecutor, self).setup(runner)
         self.protocol.testharness.load_runner(self.last_environment["protocol"])
 
+    def teardown(self):
+        if self.result_channel is not None:
+            self.result_channel.close()
+        super(MarionetteTestharnessExecutor, self).teardown()
+
     def is_alive(self):
         return self.protocol.is_alive
 
@@ -703,7 +720,8 @@ class MarionetteTestharnessExecutor(TestharnessExecutor):
                                               self.do_testharness,
                                               self.protocol,
                                               self.test_url(test),
-                                              timeout).run()
+                                              timeout,
+                                              timer=self.timer).run()
         # The format of data depends on whether the test ran to completion or not
         # For asserts we only care about the fact that if it didn't complete, the
         # status is in the first field.
@@ -723,28 +741,47 @@ class MarionetteTestharnessExecutor(TestharnessExecutor):
         return (test.result_cls(extra=extra, *data), [])
 
     def do_testharness(self, protocol, url, timeout):
+        timer = self.timer
+        with timer.phase("navigation"):
+            test_window = self.load_test(protocol, url)
+        with timer.phase("script"):
+            return self.wait_for_result(protocol, url, timeout, test_window)
+
+    def load_test(self, protocol, url):
+        """Open a new test window, and load the test into it"""
         parent_window = protocol.testharness.close_old_windows(protocol)
 
         if self.protocol.coverage.is_enabled:
             self.protocol.coverage.reset()
 
-        format_map = {"url": strip_server(url)}
-
         protocol.base.execute_script("window.open(undefined, '%s', 'noopener')" % self.window_id)
         test_window = protocol.testharness.get_test_window(self.window_id, parent_window,
                                                            timeout=10*self.timeout_multiplier)
         self.protocol.base.set_window(test_window)
-        handler = CallbackHandler(self.logger, protocol, test_window)
         protocol.marionette.navigate(url)
-        while True:
-            result = protocol.base.execute_script(
-                self.script_resume % format_map, async=True)
-            if result is None:
-                # This can happen if we get an content process crash
+        return test_window
+
+    def wait_for_result(self, protocol, url, timeout, test_window):
+        format_map = {"url": strip_server(url)}
+        handler = CallbackHandler(self.logger, protocol, test_window)
+        if self.result_channel is not None:
+            format_map["channel_url"] = self.result_channel.start()
+            protocol.base.execute_script(self.script_channel % format_map)
+            if timeout is not None:
+                timeout += extra_timeout
+            rv = self.result_channel.run(handler, timeout, self.is_alive)
+            if rv is None:
                 return None
-            done, rv = handler(result)
-            if done:
-                break
+        else:
+            while True:
+                result = protocol.base.execute_script(
+                    self.script_resume % format_map, async=True)
+                if result is None:
+                    # This can happen if we get an content process crash
+                    return None
+                done, rv = handler(result)
+                if done:
+                    break
 
         if self.protocol.coverage.is_enabled:
             self.protocol.coverage.dump()
@@ -764,7 +801,8 @@ class MarionetteRefTestExecutor(RefTestExecutor):
                                  server_config,
                                  screenshot_cache=screenshot_cache,
                                  timeout_multiplier=timeout_multiplier,
-                                 debug_info=debug_info)
+                                 debug_info=debug_info,
+                                 group_metadata=group_metadata)
         self.protocol = MarionetteProtocol(self, browser, capabilities,
                                            timeout_multiplier, kwargs["e10s"],
                                            ccov)
@@ -777,7 +815,6 @@ class MarionetteRefTestExecutor(RefTestExecutor):
         self.close_after_done = close_after_done
         self.has_window = False
         self.original_pref_values = {}
-        self.group_metadata = group_metadata
         self.debug = debug
 
         with open(os.path.join(here, "reftest.js")) as f:
@@ -853,14 +890,18 @@ class MarionetteRefTestExecutor(RefTestExecutor):
                                      self._screenshot,
                                      self.protocol,
                                      test_url,
-                                     timeout).run()
+                                     timeout,
+                                     timer=self.timer).run()
 
     def _screenshot(self, protocol, url, timeout):
-        protocol.marionette.navigate(url)
+        timer = self.timer
+        with timer.phase("navigation"):
+            protocol.marionette.navigate(url)
 
-        protocol.base.execute_script(self.wait_script, async=True)
+        with timer.phase("screenshot"):
+            protocol.base.execute_script(self.wait_script, async=True)
 
-        screenshot = protocol.marionette.screenshot(full=False)
+            screenshot = protocol.marionette.screenshot(full=False)
         # strip off the data:img/png, part of the url
         if screenshot.startswith("data:image/png;base64,"):
             screenshot = screenshot.split(",", 1)[1]
@@ -352,7 +352,8 @@ class SeleniumRefTestExecutor(RefTestExecutor):
                                  server_config,
                                  screenshot_cache=screenshot_cache,
                                  timeout_multiplier=timeout_multiplier,
-                                 debug_info=debug_info)
+                                 debug_info=debug_info,
+                                 group_metadata=kwargs.get("group_metadata"))
         self.protocol = SeleniumProtocol(self, browser,
                                          capabilities=capabilities)
         self.implementation = RefTestImplementation(self)
@@ -177,6 +177,7 @@ class ServoRefTestExecutor(ProcessTestExecutor):
 
         self.protocol = ConnectionlessProtocol(self, browser)
         self.screenshot_cache = screenshot_cache
+        self.group_metadata = kwargs.get("group_metadata")
         self.implementation = RefTestImplementation(self)
         self.tempdir = tempfile.mkdtemp()
         self.hosts_path = write_hosts_file(server_config)
@@ -252,7 +252,8 @@ class ServoWebDriverRefTestExecutor(RefTestExecutor):
                                  server_config,
                                  screenshot_cache=screenshot_cache,
                                  timeout_multiplier=timeout_multiplier,
-                                 debug_info=debug_info)
+                                 debug_info=debug_info,
+                                 group_metadata=kwargs.get("group_metadata"))
         self.protocol = ServoWebDriverProtocol(self, browser,
                                                capabilities=capabilities)
         self.implementation = RefTestImplementation(self)
@@ -8,6 +8,8 @@ import traceback
 import urlparse
 import uuid
 
+from six.moves.queue import Queue
+
 from .base import (CallbackHandler,
                    RefTestExecutor,
                    RefTestImplementation,
@@ -23,28 +25,46 @@ from .protocol import (BaseProtocolPart,
                        ActionSequenceProtocolPart,
                        TestDriverProtocolPart,
                        GenerateTestReportProtocolPart)
+from ..resultchannel import ResultChannel, ResultChannelTimeout
 from ..testrunner import Stop
+from ..timing import PhaseTimer
 
 import webdriver as client
 
 here = os.path.join(os.path.split(__file__)[0])
 
 
+class CountingSession(client.Session):
+    """WebDriver session that counts the commands it sends, so that the
+    number of commands used to run each test can be reported."""
+    def __init__(self, *args, **kwargs):
+        super(CountingSession, self).__init__(*args, **kwargs)
+        self.command_count = 0
+
+    def send_command(self, method, url, body=None):
+        self.command_count += 1
+        return super(CountingSession, self).send_command(method, url, body)
+
+
 class WebDriverBaseProtocolPart(BaseProtocolPart):
     def setup(self):
         self.webdriver = self.parent.webdriver
+        self.script_timeout = None
 
     def execute_script(self, script, async=False):
         method = self.webdriver.execute_async_script if async else self.webdriver.execute_script
         return method(script)
 
     def set_timeout(self, timeout):
+        if timeout == self.script_timeout:
+            return
         try:
             self.webdriver.timeouts.script = timeout
         except client.WebDriverException:
             # workaround https://bugs.chromium.org/p/chromedriver/issues/detail?id=2057
             body = {"type": "script", "ms": timeout * 1000}
             self.webdriver.send_session_command("POST", "timeouts", body)
+        self.script_timeout = timeout
 
     @property
     def current_window(self):
@@ -110,29 +130,33 @@ class WebDriverTestharnessProtocolPart(TestharnessProtocolPart):
                         window being added to the list of WebDriver accessible windows."""
         test_window = None
         end_time = time.time() + timeout
+        # The window is usually available immediately, so check the handles
+        # first and back off quickly rather than sleeping for a fixed time.
+        interval = 0.005
         while time.time() < end_time:
-            try:
-                # Try using the JSON serialization of the WindowProxy object,
-                # it's in Level 1 but nothing supports it yet
-                win_s = self.webdriver.execute_script("return window['%s'];" % window_id)
-                win_obj = json.loads(win_s)
-                test_window = win_obj["window-fcc6-11e5-b4f8-330a88ab9d7f"]
-            except Exception:
-                pass
+            after = self.webdriver.handles
+            if len(after) == 2:
+                test_window = next(iter(set(after) - {parent}))
+            elif after[0] == parent and len(after) > 2:
+                # Hope the first one here is the test window
+                test_window = after[1]
 
             if test_window is None:
-                after = self.webdriver.handles
-                if len(after) == 2:
-                    test_window = next(iter(set(after) - {parent}))
-                elif after[0] == parent and len(after) > 2:
-                    # Hope the first one here is the test window
-                    test_window = after[1]
+                try:
+                    # Try using the JSON serialization of the WindowProxy object,
+                    # it's in Level 1 but nothing supports it yet
+                    win_s = self.webdriver.execute_script("return window['%s'];" % window_id)
+                    win_obj = json.loads(win_s)
+                    test_window = win_obj["window-fcc6-11e5-b4f8-330a88ab9d7f"]
+                except Exception:
+                    pass
 
             if test_window is not None:
                 assert test_window != parent
                 return test_window
 
-            time.sleep(0.1)
+            time.sleep(interval)
+            interval = min(2 * interval, 0.1)
 
         raise Exception("unable to find test window")
 
@@ -226,7 +250,7 @@ class WebDriverProtocol(Protocol):
         host, port = self.url.split(":")[1].strip("/"), self.url.split(':')[-1].strip("/")
 
         capabilities = {"alwaysMatch": self.capabilities}
-        self.webdriver = client.Session(host, port, capabilities=capabilities)
+        self.webdriver = CountingSession(host, port, capabilities=capabilities)
         self.webdriver.start()
 
 
@@ -254,26 +278,59 @@ class WebDriverProtocol(Protocol):
         self.testharness.load_runner(self.executor.last_environment["protocol"])
 
 
+class WebDriverRunThread(threading.Thread):
+    def __init__(self):
+        """Long-lived thread that runs the WebDriver commands for each test in
+        turn, so that a thread isn't started for every test. A thread that is
+        still running when a test times out is abandoned."""
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.queue = Queue()
+        self.busy = False
+        self.start()
+
+    def submit(self, func):
+        self.busy = True
+        self.queue.put(func)
+
+    def stop(self):
+        self.queue.put(None)
+
+    def run(self):
+        while True:
+            func = self.queue.get()
+            if func is None:
+                break
+            try:
+                func()
+            finally:
+                self.busy = False
+
+
 class WebDriverRun(object):
-    def __init__(self, func, protocol, url, timeout):
+    def __init__(self, func, protocol, url, timeout, thread=None, timer=None):
         self.func = func
         self.result = None
         self.protocol = protocol
         self.url = url
         self.timeout = timeout
         self.result_flag = threading.Event()
+        self.thread = thread
+        self.timer = timer if timer is not None else PhaseTimer()
 
     def run(self):
         timeout = self.timeout
 
         try:
-            self.protocol.base.set_timeout(timeout + extra_timeout)
+            with self.timer.phase("setup"):
+                self.protocol.base.set_timeout(timeout + extra_timeout)
         except client.UnknownErrorException:
             self.logger.error("Lost WebDriver connection")
             return Stop
 
-        executor = threading.Thread(target=self._run)
-        executor.start()
+        if self.thread is None or self.thread.busy or not self.thread.is_alive():
+            self.thread = WebDriverRunThread()
+        self.thread.submit(self._run)
 
         flag = self.result_flag.wait(timeout + 2 * extra_timeout)
         if self.result is None:
@@ -284,7 +341,7 @@ class WebDriverRun(object):
             else:
                 message = "Waiting on browser:\n"
                 # get a traceback for the current stack of the executor thread
-                message += "".join(traceback.format_stack(sys._current_frames()[executor.ident]))
+                message += "".join(traceback.format_stack(sys._current_frames()[self.thread.ident]))
                 self.result = False, ("EXTERNAL-TIMEOUT", message)
 
         return self.result
@@ -292,7 +349,8 @@ class WebDriverRun(object):
     def _run(self):
         try:
             self.result = True, self.func(self.protocol, self.url, self.timeout)
-        except (client.TimeoutException, client.ScriptTimeoutException):
+        except (client.TimeoutException, client.ScriptTimeoutException,
+                ResultChannelTimeout):
             self.result = False, ("EXTERNAL-TIMEOUT", None)
         except (socket.timeout, client.UnknownErrorException):
             self.result = False, ("CRASH", None)
@@ -317,17 +375,47 @@ class WebDriverTestharnessExecutor(TestharnessExecutor):
 
     def __init__(self, browser, server_config, timeout_multiplier=1,
                  close_after_done=True, capabilities=None, debug_info=None,
-                 supports_eager_pageload=True, **kwargs):
-        """WebDriver-based executor for testharness.js tests"""
+                 supports_eager_pageload=True, reuse_window=False,
+                 result_channel=False, **kwargs):
+        """WebDriver-based executor for testharness.js tests
+
+        :param reuse_window: Load tests that don't use testdriver into the same
+                             window from the runner page, and get the results
+                             from the completion message testharness.js posts
+                             to the runner, so that each test needs a single
+                             WebDriver command.
+        :param result_channel: Have tests post their results and testdriver
+                               actions to a ResultChannel, rather than
+                               collecting each one with an async script.
+        """
         TestharnessExecutor.__init__(self, browser, server_config,
                                      timeout_multiplier=timeout_multiplier,
                                      debug_info=debug_info)
         self.protocol = WebDriverProtocol(self, browser, capabilities)
         with open(os.path.join(here, "testharness_webdriver_resume.js")) as f:
             self.script_resume = f.read()
+        with open(os.path.join(here, "testharness_webdriver_load.js")) as f:
+            self.script_load = f.read()
+        with open(os.path.join(here, "testharness_channel.js")) as f:
+            self.script_channel = f.read()
         self.close_after_done = close_after_done
         self.window_id = str(uuid.uuid4())
         self.supports_eager_pageload = supports_eager_pageload
+        self.reuse_window = reuse_window
+        # Whether the runner window is the current window and the reusable
+        # test window, if any, is in a known state
+        self.runner_current = False
+        self.last_url = None
+        self.result_channel = ResultChannel() if result_channel else None
+        self.run_thread = None
+
+    def teardown(self):
+        if self.result_channel is not None:
+            self.result_channel.close()
+        if self.run_thread is not None:
+            self.run_thread.stop()
+            self.run_thread = None
+        super(WebDriverTestharnessExecutor, self).teardown()
 
     def is_alive(self):
         return self.protocol.is_alive()
@@ -335,23 +423,77 @@ class WebDriverTestharnessExecutor(TestharnessExecutor):
     def on_environment_change(self, new_environment):
         if new_environment["protocol"] != self.last_environment["protocol"]:
             self.protocol.testharness.load_runner(new_environment["protocol"])
+            self.runner_current = False
 
     def do_test(self, test):
         url = self.test_url(test)
 
-        success, data = WebDriverRun(self.do_testharness,
-                                    self.protocol,
-                                    url,
-                                    test.timeout * self.timeout_multiplier).run()
+        if self.reuse_window and not test.testdriver:
+            func = self.do_testharness_reuse
+        else:
+            func = self.do_testharness
+
+        webdriver = self.protocol.webdriver
+        command_count = webdriver.command_count if webdriver is not None else 0
+        run = WebDriverRun(func,
+                           self.protocol,
+                           url,
+                           test.timeout * self.timeout_multiplier,
+                           thread=self.run_thread,
+                           timer=self.timer)
+        success, data = run.run()
+        self.run_thread = run.thread
 
         if success:
-            return self.convert_result(test, data)
+            result = self.convert_result(test, data)
+        else:
+            self.runner_current = False
+            result = (test.result_cls(*data), [])
+
+        if webdriver is not None:
+            result[0].extra["webdriver_commands"] = webdriver.command_count - command_count
+        return result
+
+    def do_testharness_reuse(self, protocol, url, timeout):
+        timer = self.timer
+        if not self.runner_current or url == self.last_url:
+            # Start from a new test window; in particular, loading the same
+            # url again may only be a fragment navigation.
+            with timer.phase("navigation"):
+                protocol.testharness.close_old_windows()
+            self.runner_current = True
+        self.last_url = url
+
+        format_map = {"url": url,
+                      "result_url": strip_server(url),
+                      "window_id": self.window_id}
+        # The test is loaded by the same script that waits for its result
+        with timer.phase("script"):
+            result = protocol.base.execute_script(self.script_load % format_map, async=True)
+        if not isinstance(result, list) or len(result) != 3:
+            self.runner_current = False
+            try:
+                is_alive = self.is_alive()
+            except client.WebDriverException:
+                is_alive = False
 
-        return (test.result_cls(*data), [])
+            if not is_alive:
+                raise Exception("Browser crashed during script execution.")
+            raise Exception("Unexpected result loading test in reused window: %r" % (result,))
 
-    def do_testharness(self, protocol, url, timeout):
-        format_map = {"url": strip_server(url)}
+        _, rv = CallbackHandler(self.logger, protocol, None)(result)
+        return rv
 
+    def do_testharness(self, protocol, url, timeout):
+        timer = self.timer
+        with timer.phase("navigation"):
+            test_window = self.load_test(protocol, url)
+        with timer.phase("script"):
+            return self.wait_for_result(protocol, url, timeout, test_window)
+
+    def load_test(self, protocol, url):
+        """Open a new test window, and load the test into it"""
+        self.runner_current = False
         parent_window = protocol.testharness.close_old_windows()
         # Now start the test harness
         protocol.base.execute_script("window.open('about:blank', '%s', 'noopener')" % self.window_id)
@@ -359,11 +501,23 @@ class WebDriverTestharnessExecutor(TestharnessExecutor):
                                                            parent_window,
                                                            timeout=5*self.timeout_multiplier)
         self.protocol.base.set_window(test_window)
-        handler = CallbackHandler(self.logger, protocol, test_window)
         protocol.webdriver.url = url
 
         if not self.supports_eager_pageload:
             self.wait_for_load(protocol)
+        return test_window
+
+    def wait_for_result(self, protocol, url, timeout, test_window):
+        format_map = {"url": strip_server(url)}
+        handler = CallbackHandler(self.logger, protocol, test_window)
+
+        if self.result_channel is not None:
+            format_map["channel_url"] = self.result_channel.start()
+            protocol.base.execute_script(self.script_channel % format_map)
+            rv = self.result_channel.run(handler, timeout + extra_timeout, self.is_alive)
+            if rv is None:
+                raise Exception("Browser crashed during test execution.")
+            return rv
 
         while True:
             result = protocol.base.execute_script(
@@ -421,16 +575,24 @@ class WebDriverRefTestExecutor(RefTestExecutor):
                                  server_config,
                                  screenshot_cache=screenshot_cache,
                                  timeout_multiplier=timeout_multiplier,
-                                 debug_info=debug_info)
+                                 debug_info=debug_info,
+                                 group_metadata=kwargs.get("group_metadata"))
         self.protocol = WebDriverProtocol(self, browser,
                                           capabilities=capabilities)
         self.implementation = RefTestImplementation(self)
         self.close_after_done = close_after_done
         self.has_window = False
+        self.run_thread = None
 
         with open(os.path.join(here, "reftest-wait_webdriver.js")) as f:
             self.wait_script = f.read()
 
+    def teardown(self):
+        if self.run_thread is not None:
+            self.run_thread.stop()
+            self.run_thread = None
+        super(WebDriverRefTestExecutor, self).teardown()
+
     def reset(self):
         self.implementation.reset()
 
@@ -458,18 +620,26 @@ class WebDriverRefTestExecutor(RefTestExecutor):
         assert viewport_size is None
         assert dpi is None
 
-        return WebDriverRun(self._screenshot,
+        run = WebDriverRun(self._screenshot,
                            self.protocol,
                            self.test_url(test),
-                           test.timeout).run()
+                           test.timeout,
+                           thread=self.run_thread,
+                           timer=self.timer)
+        rv = run.run()
+        self.run_thread = run.thread
+        return rv
 
     def _screenshot(self, protocol, url, timeout):
+        timer = self.timer
         webdriver = protocol.webdriver
-        webdriver.url = url
+        with timer.phase("navigation"):
+            webdriver.url = url
 
-        webdriver.execute_async_script(self.wait_script)
+        with timer.phase("screenshot"):
+            webdriver.execute_async_script(self.wait_script)
 
-        screenshot = webdriver.screenshot()
+            screenshot = webdriver.screenshot()
 
         # strip off the data:img/png, part of the url
         if screenshot.startswith("data:image/png;base64,"):
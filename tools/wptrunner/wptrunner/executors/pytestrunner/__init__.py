@@ -1 +1,2 @@
-from .runner import run  # noqa: F401
+from .runner import run, session_environment  # noqa: F401
+from .worker import PytestWorker  # noqa: F401
@@ -24,6 +24,15 @@ def do_delayed_imports():
     import pytest
 
 
+def session_environment(server_config, session_config):
+    """Environment variables used to pass the WebDriver session and wptserve
+    configuration to the wdspec fixtures."""
+    return {"WD_HOST": session_config["host"],
+            "WD_PORT": str(session_config["port"]),
+            "WD_CAPABILITIES": json.dumps(session_config["capabilities"]),
+            "WD_SERVER_CONFIG": json.dumps(server_config.as_dict())}
+
+
 def run(path, server_config, session_config, timeout=0):
     """
     Run Python test at ``path`` in pytest.  The provided ``session``
@@ -35,17 +44,28 @@ def run(path, server_config, session_config, timeout=0):
     :param timeout: Duration before interrupting potentially hanging
         tests.  If 0, there is no timeout.
 
+    :returns: (<harness result>, [<subtest result>, ...]),
+        where <subtest result> is (test id, status, message, stacktrace).
+    """
+    os.environ.update(session_environment(server_config, session_config))
+    return run_file(path)
+
+
+def run_file(path):
+    """
+    Run Python test at ``path`` in pytest, using the session configuration
+    in the ``WD_*`` environment variables.
+
+    Modules imported by pytest, including plugins and the wdspec fixtures,
+    stay loaded between calls in the same process, so module-level state
+    such as the current WebDriver session is reused by later files.
+
     :returns: (<harness result>, [<subtest result>, ...]),
         where <subtest result> is (test id, status, message, stacktrace).
     """
     if pytest is None:
         do_delayed_imports()
 
-    os.environ["WD_HOST"] = session_config["host"]
-    os.environ["WD_PORT"] = str(session_config["port"])
-    os.environ["WD_CAPABILITIES"] = json.dumps(session_config["capabilities"])
-    os.environ["WD_SERVER_CONFIG"] = json.dumps(server_config.as_dict())
-
     harness = HarnessResultRecorder()
     subtests = SubtestResultRecorder()
 
@@ -0,0 +1,137 @@
+"""
+Long-lived process for running wdspec tests in pytest.
+
+Starting pytest for each test file means importing pytest, its plugins and
+the wdspec fixtures, and starting a new WebDriver session, every time. A
+worker instead runs each file it is sent in the same process, so those
+modules, and the WebDriver session held by the fixtures, are reused across
+files. It also means a hung test can be stopped by killing the worker.
+
+Requests and results are sent as JSON, one per line, over the worker's
+stdin and stdout. Output from pytest goes to stderr.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+if __name__ == "__main__":
+    # Running as the worker process, so set up the paths to the wpt tools
+    sys.path.insert(0, os.path.abspath(os.path.join(here, *([os.pardir] * 5))))
+    from tools import localpaths  # noqa: F401
+    sys.path.insert(0, here)
+
+from six.moves.queue import Empty, Queue
+
+
+class PytestWorker(object):
+    def __init__(self, logger, environ):
+        """Client for a worker process.
+
+        :param logger: Structured logger
+        :param environ: Environment variables to set in the worker, in
+                        addition to those of the current process
+        """
+        self.logger = logger
+        self.environ = environ
+        self.proc = None
+        self.results = None
+
+    @property
+    def is_alive(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def start(self):
+        env = os.environ.copy()
+        env.update(self.environ)
+        self.proc = subprocess.Popen([sys.executable, os.path.join(here, "worker.py")],
+                                     stdin=subprocess.PIPE,
+                                     stdout=subprocess.PIPE,
+                                     env=env)
+        self.results = Queue()
+        reader = threading.Thread(target=self._read_results,
+                                  args=(self.proc.stdout, self.results))
+        reader.daemon = True
+        reader.start()
+        self.logger.debug("Started pytest worker with pid %i" % self.proc.pid)
+
+    def _read_results(self, stdout, results):
+        for line in iter(stdout.readline, b""):
+            results.put(json.loads(line.decode("utf8")))
+        results.put(None)
+
+    def stop(self, timeout=5):
+        if self.proc is None:
+            return
+        proc, self.proc = self.proc, None
+        try:
+            proc.stdin.close()
+        except IOError:
+            pass
+        # Give the worker a chance to exit cleanly, ending its WebDriver
+        # session, before killing it
+        end_time = time.time() + timeout
+        while proc.poll() is None and time.time() < end_time:
+            time.sleep(0.05)
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+
+    def run(self, path, timeout):
+        """Run the test file at path in the worker, starting it if needed.
+
+        :returns: (True, (<harness result>, [<subtest result>, ...])) if the
+                  file was run, or (False, (status, message)) if the worker
+                  timed out or exited.
+        """
+        if not self.is_alive:
+            self.start()
+
+        try:
+            self.proc.stdin.write(json.dumps({"path": path}).encode("utf8") + b"\n")
+            self.proc.stdin.flush()
+        except IOError:
+            self.stop()
+            return False, ("CRASH", "pytest worker exited unexpectedly")
+
+        try:
+            result = self.results.get(timeout=timeout)
+        except Empty:
+            self.stop(timeout=0)
+            return False, ("EXTERNAL-TIMEOUT", None)
+
+        if result is None:
+            self.stop()
+            return False, ("CRASH", "pytest worker exited unexpectedly")
+        return True, result
+
+
+def main():
+    import runner
+
+    # pytest and the tests write to stdout, so keep the original stdout for
+    # the results and send everything else to stderr.
+    results = os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    for line in iter(sys.stdin.readline, ""):
+        request = json.loads(line)
+        harness_result, subtest_results = runner.run_file(request["path"])
+        results.write(json.dumps([harness_result, subtest_results]).encode("utf8") + b"\n")
+        results.flush()
+
+    fixtures = sys.modules.get("tests.support.fixtures")
+    if fixtures is not None and fixtures._current_session is not None:
+        try:
+            fixtures._current_session.end()
+        except Exception:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,6 @@
+// Have the test post its results and testdriver actions to the runner's
+// result channel, rather than waiting for a resume script to collect them.
+// We have to set the url here to ensure we get the same escaping as in the harness
+window.__wptrunner_url = "%(url)s";
+window.__wptrunner_channel_url = "%(channel_url)s";
+window.__wptrunner_process_next_event();
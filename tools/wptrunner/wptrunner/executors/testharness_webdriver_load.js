@@ -0,0 +1,28 @@
+// Load a test into the reusable test window from the runner window, and
+// wait for the completion message that testharness.js posts to its opener.
+var callback = arguments[arguments.length - 1];
+var url = "%(url)s";
+var result_url = "%(result_url)s";
+var win = window.__wptrunner_test_window;
+
+function on_message(event) {
+  if (event.source !== win || !event.data || event.data.type !== "complete") {
+    return;
+  }
+  window.removeEventListener("message", on_message);
+  var status = event.data.status;
+  var subtest_results = event.data.tests.map(function(x) {
+    return [x.name, x.status, x.message, x.stack];
+  });
+  callback([result_url,
+            "complete",
+            [status.status, status.message, status.stack, subtest_results]]);
+}
+
+window.addEventListener("message", on_message);
+if (!win || win.closed) {
+  win = window.open(url, "%(window_id)s");
+  window.__wptrunner_test_window = win;
+} else {
+  win.location = url;
+}
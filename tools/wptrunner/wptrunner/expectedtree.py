@@ -1,5 +1,13 @@
-from math import log
+import operator
+from bisect import bisect_right
 from collections import defaultdict
+from itertools import repeat
+import math
+from math import log
+
+from six import iteritems, itervalues
+from six.moves import map
+
 
 class Node(object):
     def __init__(self, prop, value):
@@ -48,6 +56,23 @@ def entropy(results):
     return entropy_sum
 
 
+def entropy_from_counts(counts, total, fsum=True):
+    """Shannon entropy of a set of results given the number of run_infos
+    with each result value, and the total number of run_infos.
+
+    By default the terms are summed with fsum, so the result is within
+    rounding error of entropy(), but doesn't depend on the order of the
+    counts. Otherwise they are summed as in entropy()."""
+    total = float(total)
+    if fsum:
+        return -math.fsum(prop * log(prop, 2) for prop in (count / total for count in counts))
+    entropy_sum = 0
+    for count in counts:
+        prop = float(count) / total
+        entropy_sum -= prop * log(prop, 2)
+    return entropy_sum
+
+
 def split_results(prop, results):
     """Split a dictionary of results into a dictionary of dictionaries where
     each sub-dictionary has a specific value of the given property"""
@@ -58,6 +83,137 @@ def split_results(prop, results):
     return by_prop
 
 
+class ResultColumns(object):
+    # Number of run_infos below which counting in a Python loop is faster
+    # than sorting the keys
+    count_threshold = 16
+    # Relative difference in entropy below which two splits are treated as
+    # equally good, so the choice depends on how the entropies are summed
+    tie_tolerance = 1e-9
+
+    def __init__(self, results):
+        """Results stored by integer run_info index, with the values of
+        run_info properties encoded as integer columns.
+
+        The results for each run_info are stored as the id of their
+        signature, the set of (result value, count) pairs, and each column
+        combines the property value with the signature, so the counts needed
+        to pick the property to split on come from counting the distinct
+        integers in a column.
+
+        :param results: Dictionary mapping run_info to a dictionary of
+                        result value to count
+        """
+        self.results = results
+        # Map of (path to a node, property) to the results dictionary for the
+        # node split by the property, for nodes that needed split_results_prop
+        self.split_cache = {}
+        items = list(iteritems(results))
+        self.run_infos = [run_info for run_info, _ in items]
+        # Map of property name to (list of keys combining the value id and
+        #                          signature id for each run_info index,
+        #                          property value for each value id)
+        self.columns = {}
+        # Map of frozenset of (signature id, number of run_infos) pairs to
+        # (number of run_infos, entropy)
+        self.entropy_cache = {}
+
+        # Signature id for each run_info index
+        self.signature_ids, signatures = self.encode(frozenset(iteritems(values))
+                                                     for _, values in items)
+        # Tuple of (result value, count) pairs for each signature id
+        self.signatures = [tuple(item) for item in signatures]
+
+    @staticmethod
+    def encode(values):
+        """Encode an iterable of values as a list of integer ids and a list
+        of the value for each id"""
+        values = list(values)
+        decoded = list(set(values))
+        ids = {value: i for i, value in enumerate(decoded)}
+        return list(map(ids.__getitem__, values)), decoded
+
+    def column(self, prop):
+        """Keys for the property prop for each run_info index, and the value
+        for each value id. Each key is value_id * len(self.signatures) +
+        signature id, and run_infos without the property get the value id -1."""
+        if prop not in self.columns:
+            try:
+                value_ids, values = self.encode(map(operator.itemgetter(prop), self.run_infos))
+            except KeyError:
+                missing = object()
+
+                def get_value(run_info):
+                    try:
+                        return run_info[prop]
+                    except KeyError:
+                        return missing
+
+                value_ids, values = self.encode(map(get_value, self.run_infos))
+                missing_id = values.index(missing)
+                value_ids = [-1 if value_id == missing_id else value_id for value_id in value_ids]
+            keys = list(map(operator.add,
+                            map(operator.mul, value_ids, repeat(len(self.signatures))),
+                            self.signature_ids))
+            self.columns[prop] = keys, values
+        return self.columns[prop]
+
+    def partition_entropy(self, signature_counts):
+        """Number of run_infos and entropy of a set of run_infos, given as a
+        list of (signature id, number of run_infos) pairs, along with the
+        entropy as computed by entropy(), or None if that depends on the
+        order of the results.
+
+        The same sets come up repeatedly when building a tree, so the
+        results are cached."""
+        cache_key = frozenset(signature_counts)
+        if cache_key not in self.entropy_cache:
+            size = 0
+            result_counts = defaultdict(int)
+            for signature_id, run_info_count in signature_counts:
+                size += run_info_count
+                for result_value, _ in self.signatures[signature_id]:
+                    result_counts[result_value] += run_info_count
+            ordered_entropy = None
+            if len(result_counts) <= 2:
+                # A sum of two terms is the same in either order
+                ordered_entropy = entropy_from_counts(itervalues(result_counts), size, fsum=False)
+            self.entropy_cache[cache_key] = (size,
+                                             entropy_from_counts(itervalues(result_counts), size),
+                                             ordered_entropy)
+        return self.entropy_cache[cache_key]
+
+    def node_results(self, path):
+        """Results dictionary for a node of the tree, split with
+        split_results, given the tuple of (property, value) pairs leading to
+        the node."""
+        if not path:
+            return self.results
+        parent_path = path[:-1]
+        prop, value = path[-1]
+        key = (parent_path, prop)
+        if key not in self.split_cache:
+            self.split_cache[key] = split_results(prop, self.node_results(parent_path))
+        return self.split_cache[key][value]
+
+    def count(self, keys, indices):
+        """Number of run_infos with the given indices that have each key
+        in keys"""
+        if len(indices) < self.count_threshold:
+            counts = defaultdict(int)
+            for i in indices:
+                counts[keys[i]] += 1
+            return counts
+        subset = sorted(map(keys.__getitem__, indices))
+        counts = {}
+        start = 0
+        for key in sorted(set(subset)):
+            end = bisect_right(subset, key, start)
+            counts[key] = end - start
+            start = end
+        return counts
+
+
 def build_tree(properties, dependent_props, results, tree=None):
     """Build a decision tree mapping properties to results
 
@@ -74,58 +230,145 @@ def build_tree(properties, dependent_props, results, tree=None):
     if tree is None:
         tree = Node(None, None)
 
-    prop_index = {prop: i for i, prop in enumerate(properties)}
+    data = ResultColumns(results)
+    indices = list(range(len(data.run_infos)))
+    signature_counts = list(iteritems(data.count(data.signature_ids, indices)))
+    return _build_tree(properties, dependent_props, data, indices, signature_counts, (), tree)
+
 
+def _build_tree(properties, dependent_props, data, indices, signature_counts, path, tree):
+    """Build the (sub)tree for the run_infos with the given indices into
+    data.run_infos, given the number of those run_infos with each result
+    signature as a list of (signature id, number of run_infos) pairs, and
+    the tuple of (property, value) pairs leading to the subtree."""
     all_results = defaultdict(int)
-    for result_values in results.itervalues():
-        for result_value, count in result_values.iteritems():
-            all_results[result_value] += count
+    for signature_id, run_info_count in signature_counts:
+        for result_value, count in data.signatures[signature_id]:
+            all_results[result_value] += count * run_info_count
 
-    # If there is only one result we are done
-    if not properties or len(all_results) == 1:
-        for value, count in all_results.iteritems():
+    # If there is only one result, or no properties partition the space, we
+    # are done
+    best_prop = None
+    if properties and len(all_results) > 1 and len(indices) > 1:
+        prop_index = {prop: i for i, prop in enumerate(properties)}
+        best_prop, remove_properties, sub_signature_counts = _best_split(properties, prop_index,
+                                                                         data, indices, path)
+
+    if best_prop is None:
+        for value, count in iteritems(all_results):
             tree.result_values[value] += count
-        tree.run_info |= set(results.keys())
+        tree.run_info |= set(data.run_infos[i] for i in indices)
         return tree
 
-    results_partitions = []
+    # Create a new set of properties that can be used
+    new_props = properties[:prop_index[best_prop]] + properties[prop_index[best_prop] + 1:]
+    new_props.extend(dependent_props.get(best_prop, []))
+    if remove_properties:
+        new_props = [item for item in new_props if item not in remove_properties]
+
+    # Reuse the partitioning of the run_infos by the best property for the
+    # subtrees
+    keys, values = data.column(best_prop)
+    num_signatures = len(data.signatures)
+    partitions = defaultdict(list)
+    for i in indices:
+        partitions[keys[i] // num_signatures].append(i)
+
+    for value_id, sub_indices in iteritems(partitions):
+        node = Node(best_prop, values[value_id])
+        tree.add(node)
+        _build_tree(new_props, dependent_props, data, sub_indices, sub_signature_counts[value_id],
+                    path + ((best_prop, values[value_id]),), node)
+    return tree
+
+
+def _best_split(properties, prop_index, data, indices, path):
+    """Find the property that gives the lowest entropy when used to split
+    the run_infos with the given indices.
+
+    When the best splits are within rounding error of each other, the
+    choice depends on the order in which the entropies are summed, so the
+    entropies are summed in the order of the results dictionary for the
+    node, as in split_results_prop. Where there are at most two terms in
+    each sum the order doesn't matter, and the dictionary isn't needed.
+
+    :returns: Tuple of (the best property, or None if no property partitions
+              the run_infos, set of properties that don't partition them,
+              dictionary of value id of the best property to a list of
+              (signature id, number of run_infos) pairs)"""
+    total = float(len(indices))
+    num_signatures = len(data.signatures)
     remove_properties = set()
+    results_partitions = []
     for prop in properties:
-        result_sets = split_results(prop, results)
-        if len(result_sets) == 1:
+        keys, _ = data.column(prop)
+
+        # Number of run_infos with each signature for each value of the
+        # property
+        signature_counts = defaultdict(list)
+        for key, run_info_count in iteritems(data.count(keys, indices)):
+            value_id, signature_id = divmod(key, num_signatures)
+            signature_counts[value_id].append((signature_id, run_info_count))
+
+        if -1 in signature_counts:
+            raise KeyError(prop)
+        if len(signature_counts) == 1:
             # If this property doesn't partition the space then just remove it
             # from the set to consider
             remove_properties.add(prop)
             continue
-        new_entropy = 0.
-        results_sets_entropy = []
-        for prop_value, result_set in result_sets.iteritems():
-            results_sets_entropy.append((entropy(result_set), prop_value, result_set))
-            new_entropy += (float(len(result_set)) / len(results)) * results_sets_entropy[-1][0]
 
-        results_partitions.append((new_entropy,
-                                   prop,
-                                   results_sets_entropy))
+        partition_entropies = [data.partition_entropy(counts) for counts in itervalues(signature_counts)]
+        new_entropy = math.fsum((size / total) * value for size, value, _ in partition_entropies)
+        results_partitions.append((new_entropy, prop_index[prop], prop, signature_counts,
+                                   partition_entropies))
 
-    # In the case that no properties partition the space
     if not results_partitions:
-        for value, count in all_results.iteritems():
-            tree.result_values[value] += count
-        tree.run_info |= set(results.keys())
-        return tree
+        return None, remove_properties, None
 
     # split by the property with the highest entropy
-    results_partitions.sort(key=lambda x: (x[0], prop_index[x[1]]))
-    _, best_prop, sub_results = results_partitions[0]
+    results_partitions.sort(key=lambda x: x[:2])
+    best_entropy, _, best_prop, signature_counts, _ = results_partitions[0]
+    # Entropies of zero are exact however they are summed, so only nonzero
+    # ties need checking
+    tied = [item for item in results_partitions[1:]
+            if item[0] - best_entropy <= data.tie_tolerance * max(best_entropy, 1.)]
+    if tied and best_entropy > 0:
+        tied.insert(0, results_partitions[0])
+        ordered = [(ordered_entropy(item[4], len(indices)), item[1], item[2], item[3])
+                   for item in tied]
+        if all(item[0] is not None for item in ordered):
+            _, _, best_prop, signature_counts = min(ordered, key=lambda x: x[:2])
+        else:
+            best_prop = split_results_prop(prop_index, data.node_results(path),
+                                           [item[2] for item in tied])
+            signature_counts = [item[3] for item in tied if item[2] == best_prop][0]
+    return best_prop, remove_properties, signature_counts
 
-    # Create a new set of properties that can be used
-    new_props = properties[:prop_index[best_prop]] + properties[prop_index[best_prop] + 1:]
-    new_props.extend(dependent_props.get(best_prop, []))
-    if remove_properties:
-        new_props = [item for item in new_props if item not in remove_properties]
 
-    for _, prop_value, results_sets in sub_results:
-        node = Node(best_prop, prop_value)
-        tree.add(node)
-        build_tree(new_props, dependent_props, results_sets, node)
-    return tree
+def ordered_entropy(partition_entropies, total):
+    """Entropy of a split as computed by split_results_prop, given the
+    result of partition_entropy for each partition, or None if that depends
+    on the order of the partitions."""
+    if len(partition_entropies) > 2:
+        return None
+    new_entropy = 0.
+    for size, _, value in partition_entropies:
+        if value is None:
+            return None
+        new_entropy += (float(size) / total) * value
+    return new_entropy
+
+
+def split_results_prop(prop_index, results, properties):
+    """Get the property to split a results dictionary by, out of properties
+    that all partition the results, by splitting the dictionary for each
+    property and summing the entropies in the order of the dictionary"""
+    results_partitions = []
+    for prop in properties:
+        new_entropy = 0.
+        for result_set in split_results(prop, results).itervalues():
+            new_entropy += (float(len(result_set)) / len(results)) * entropy(result_set)
+        results_partitions.append((new_entropy, prop))
+    results_partitions.sort(key=lambda x: (x[0], prop_index[x[1]]))
+    return results_partitions[0][1]
@@ -0,0 +1,46 @@
+from mozlog.structured.formatters.base import BaseFormatter
+from ..resultsarchive import ChunkBuilder
+
+
+class ResultsArchiveFormatter(BaseFormatter):
+    """Formatter that writes each suite as a chunk of a results archive.
+
+    The output is binary, and the file it's written to is a results
+    archive that can be read with resultsarchive.ArchiveReader, or
+    appended to an existing archive.
+    """
+
+    binary = True
+
+    def __init__(self):
+        self.builder = None
+        self.run = None
+        # Map of test id to (start time, subtest results) for running tests
+        self.running = {}
+
+    def suite_start(self, data):
+        self.builder = ChunkBuilder()
+        self.run = self.builder.add_run(data.get("run_info", {}), data["time"])
+        self.running = {}
+
+    def suite_end(self, data):
+        for test in list(self.running):
+            self.test_end({"test": test, "status": ""})
+        self.builder.runs[self.run]["time_end"] = data["time"]
+        rv = self.builder.to_bytes()
+        self.builder = None
+        return rv
+
+    def test_start(self, data):
+        self.running[data["test"]] = (data["time"], [])
+
+    def test_status(self, data):
+        if data["test"] in self.running:
+            self.running[data["test"]][1].append((data["subtest"], data["status"]))
+
+    def test_end(self, data):
+        start_time, subtests = self.running.pop(data["test"], (None, []))
+        duration = None
+        if start_time is not None and "time" in data:
+            duration = data["time"] - start_time
+        self.builder.add_result(self.run, data["test"], data["status"], duration, subtests)
@@ -1,6 +1,7 @@
 import json
 import re
 import sys
+import zlib
 
 from mozlog.structured.formatters.base import BaseFormatter
 from ..executors.base import strip_server
@@ -52,25 +53,70 @@ def replace_lone_surrogate(data):
 
 
 class WptreportFormatter(BaseFormatter):
-    """Formatter that produces results in the format that wptreport expects."""
+    """Formatter that produces results in the format that wptreport expects.
+
+    The output is written incrementally: the opening of the JSON object is
+    written in suite_start, the entry for each test as soon as it ends, and
+    the rest of the object in suite_end. Only the results of tests that are
+    currently running are kept in memory.
+
+    Each test gets a single entry. If the extra data of suite_start has a
+    rerun count greater than 1, each test runs several times in the suite,
+    so the results are kept until suite_end and the runs of each test are
+    merged into one entry, as when all the results were written at the end.
+
+    If compress is set, the output is gzip-compressed as it is written.
+    """
 
     def __init__(self):
+        # Results of the tests that are currently running
         self.raw_results = {}
+        # Suite-level data that is written in suite_end
         self.results = {}
+        # Whether tests run more than once in the suite
+        self.merge_runs = False
+        self.results_written = 0
+        self.compress = False
+        self.compressor = None
+
+    @property
+    def binary(self):
+        return self.compress
+
+    def output(self, data, finish=False):
+        if not self.compress:
+            return data
+        if self.compressor is None:
+            self.compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        rv = self.compressor.compress(data.encode("utf-8"))
+        if finish:
+            rv += self.compressor.flush()
+            self.compressor = None
+        return rv
 
     def suite_start(self, data):
+        self.results = {}
+        self.results_written = 0
+        self.merge_runs = (data.get('extra') or {}).get('rerun', 1) > 1
+        header = {'time_start': data['time']}
         if 'run_info' in data:
-            self.results['run_info'] = data['run_info']
-        self.results['time_start'] = data['time']
+            header['run_info'] = data['run_info']
+        return self.output(json.dumps(header)[:-1] + ', "results": [')
 
     def suite_end(self, data):
+        # Tests that never ended, or that ran more than once, are written
+        # at the end of the suite
+        entries = [self.format_result(test_name) for test_name in list(self.raw_results)]
         self.results['time_end'] = data['time']
-        self.results["results"] = []
-        for test_name in self.raw_results:
-            result = {"test": test_name}
-            result.update(self.raw_results[test_name])
-            self.results["results"].append(result)
-        return json.dumps(self.results)
+        footer = json.dumps(self.results)
+        return self.output("".join(entries) + '], ' + footer[1:], finish=True)
+
+    def format_result(self, test_name):
+        result = {"test": test_name}
+        result.update(self.raw_results.pop(test_name))
+        separator = ", " if self.results_written else ""
+        self.results_written += 1
+        return separator + json.dumps(result)
 
     def find_or_create_test(self, data):
         test_name = data["test"]
@@ -126,6 +172,10 @@ class WptreportFormatter(BaseFormatter):
                 for item in data["extra"]["reftest_screenshots"]
                 if type(item) == dict
             }
+        if self.merge_runs:
+            # Later runs of the test are added to the same entry
+            return
+        return self.output(self.format_result(data["test"]))
 
     def assertion_count(self, data):
         test = self.find_or_create_test(data)
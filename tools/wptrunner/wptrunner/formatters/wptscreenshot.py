@@ -1,3 +1,5 @@
+import base64
+
 import requests
 from mozlog.structured.formatters.base import BaseFormatter
 
@@ -43,5 +45,9 @@ class WptscreenshotFormatter(BaseFormatter):
             if checksum in self.cache:
                 continue
             self.cache.add(checksum)
-            output += "data:image/png;base64,{}\n".format(item["screenshot"])
+            screenshot = item.get("screenshot")
+            if screenshot is None and "screenshot_file" in item:
+                with open(item["screenshot_file"], "rb") as f:
+                    screenshot = base64.b64encode(f.read()).decode("ascii")
+            output += "data:image/png;base64,{}\n".format(screenshot)
         return output if output else None
@@ -0,0 +1,133 @@
+import base64
+import io
+from collections import OrderedDict
+
+# NumPy isn't a requirement of wptrunner; if it isn't installed, screenshots
+# are compared with PIL
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Weights used by PIL when converting RGB to L, scaled by 2**16. A pixel only
+# counts as different if its difference image is non-zero after conversion to
+# grayscale, so we use the same weights to match the results of the PIL-based
+# comparison exactly.
+luma_weights = (19595, 38470, 7471)
+luma_threshold = None
+
+
+def get_luma_threshold():
+    """Get the minimum weighted sum of channel differences that PIL converts
+    to a non-zero L value. Older versions of PIL truncate rather than round."""
+    global luma_threshold
+    if luma_threshold is None:
+        from PIL import Image
+        rounded = Image.new("RGB", (1, 1), (0, 1, 0)).convert("L").getpixel((0, 0))
+        luma_threshold = 0x8000 if rounded else 0x10000
+    return luma_threshold
+
+
+def decode_png(data):
+    from PIL import Image
+
+    return Image.open(io.BytesIO(base64.b64decode(data))).convert("RGB")
+
+
+def encode_png(image):
+    buf = io.BytesIO()
+    image.save(buf, format="PNG")
+    return base64.b64encode(buf.getvalue()).decode("ascii")
+
+
+class ImageComparator(object):
+    def __init__(self, max_cached=16):
+        """Fuzzy comparison of base64-encoded PNG screenshots.
+
+        When NumPy is available, each screenshot is decoded once into an array
+        that is cached by screenshot hash, so that comparing many tests against
+        the same reference doesn't repeatedly decode the reference. Otherwise
+        this falls back to comparing with PIL.
+
+        :param max_cached: Maximum number of decoded screenshots to keep
+        """
+        self.max_cached = max_cached
+        self.cache = OrderedDict()
+
+    def get_array(self, hash_value, data):
+        """Get the decoded screenshot as a (height, width, 3) uint8 array"""
+        if hash_value is not None and hash_value in self.cache:
+            value = self.cache.pop(hash_value)
+            self.cache[hash_value] = value
+            return value
+
+        value = np.asarray(decode_png(data), dtype=np.uint8)
+        if hash_value is not None:
+            self.cache[hash_value] = value
+            while len(self.cache) > self.max_cached:
+                self.cache.popitem(last=False)
+        return value
+
+    def get_differences(self, screenshots, hashes=None, mask=False):
+        """Compare two screenshots.
+
+        :param screenshots: Pair of base64-encoded PNG screenshots
+        :param hashes: Pair of screenshot hashes used as the cache keys for the
+                       decoded images, or None to not cache the images
+        :param mask: Also return a black and white PNG image, base64 encoded,
+                     in which differing pixels are white
+        :returns: Tuple of (maximum difference in any channel, number of
+                  differing pixels), with the mask appended if requested.
+        """
+        if hashes is None:
+            hashes = (None, None)
+        if np is None:
+            return self._get_differences_pil(screenshots, mask)
+
+        lhs = self.get_array(hashes[0], screenshots[0])
+        rhs = self.get_array(hashes[1], screenshots[1])
+        # Like ImageChops.difference, only compare the overlapping region
+        height = min(lhs.shape[0], rhs.shape[0])
+        width = min(lhs.shape[1], rhs.shape[1])
+        lhs = np.ascontiguousarray(lhs[:height, :width]).reshape(-1, 3)
+        rhs = np.ascontiguousarray(rhs[:height, :width]).reshape(-1, 3)
+
+        # A single pass over the full images finds the differing bytes; the
+        # remaining work is proportional to the number of differing pixels.
+        changed = np.flatnonzero(lhs.reshape(-1) != rhs.reshape(-1)) // 3
+        if len(changed):
+            first = np.empty(len(changed), dtype=bool)
+            first[0] = True
+            np.not_equal(changed[1:], changed[:-1], out=first[1:])
+            changed = changed[first]
+        diff = np.abs(lhs[changed].astype(np.int32) - rhs[changed].astype(np.int32))
+        differing = diff.dot(np.array(luma_weights, dtype=np.int32)) >= get_luma_threshold()
+        count = int(np.count_nonzero(differing))
+        per_channel = int(diff[differing].max()) if count else 0
+
+        if not mask:
+            return per_channel, count
+
+        from PIL import Image
+        mask_data = np.zeros(height * width, dtype=np.uint8)
+        mask_data[changed[differing]] = 255
+        mask_image = Image.fromarray(mask_data.reshape(height, width), "L").convert("1")
+        return per_channel, count, encode_png(mask_image)
+
+    def _get_differences_pil(self, screenshots, mask):
+        from PIL import ImageChops, ImageStat
+
+        lhs = decode_png(screenshots[0])
+        rhs = decode_png(screenshots[1])
+        diff = ImageChops.difference(lhs, rhs)
+        minimal_diff = diff.crop(diff.getbbox())
+        mask_image = minimal_diff.convert("L", dither=None)
+        stat = ImageStat.Stat(minimal_diff, mask_image)
+        per_channel = max(item[1] for item in stat.extrema)
+        count = stat.count[0]
+
+        if not mask:
+            return per_channel, count
+
+        full_mask = diff.convert("L", dither=None).point(lambda x: 255 if x else 0).convert("1")
+        return per_channel, count, encode_png(full_mask)
@@ -1,7 +1,15 @@
+import glob
+import hashlib
+import json
 import os
+import shutil
+import tempfile
+from io import BytesIO
+from six.moves import cPickle as pickle  # noqa: N813
 from six.moves.urllib.parse import urljoin
 from collections import deque
 
+import wptmanifest
 from wptmanifest.backends import static
 from wptmanifest.backends.base import ManifestItem
 
@@ -466,7 +474,115 @@ class SubtestNode(TestNode):
         return True
 
 
-def get_manifest(metadata_root, test_path, url_base, run_info):
+def _source_hash():
+    """Hash of the source of the modules that determine the compiled form of
+    an expectation manifest, so that cached data is invalidated when any of
+    them changes"""
+    h = hashlib.sha1()
+    paths = [os.path.abspath(__file__)]
+    for pkg_dir in [os.path.dirname(wptmanifest.__file__),
+                    os.path.dirname(static.__file__)]:
+        paths.extend(sorted(glob.glob(os.path.join(pkg_dir, "*.py"))))
+    for path in paths:
+        if path.endswith((".pyc", ".pyo")):
+            path = path[:-1]
+        with open(path, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+class CompiledManifestCache(object):
+    def __init__(self, cache_root, run_info):
+        """On-disk cache of expectation manifests compiled for a specific
+        run_info.
+
+        Entries are stored per manifest path, along with a hash of the
+        manifest contents; an entry is only used if the contents, the run_info
+        and the source of the parser and compiler are all unchanged. Entries
+        for other run_info values or sources are removed by prune.
+
+        :param cache_root: Directory in which to store the cache files
+        :param run_info: run_info used when compiling the manifests
+        """
+        self.cache_root = cache_root
+        run_info_data = json.dumps(run_info, sort_keys=True, default=repr)
+        self.key = hashlib.sha1(run_info_data.encode("utf8") +
+                                _source_hash().encode("ascii")).hexdigest()
+        self.hits = 0
+        self.misses = 0
+
+    def _cache_path(self, manifest_path):
+        name = hashlib.sha1(os.path.abspath(manifest_path).encode("utf8")).hexdigest()
+        return os.path.join(self.cache_root, self.key[:16], name[:2], name[2:] + ".pkl")
+
+    def prune(self):
+        """Remove the entries for any other key, so that the cache only holds
+        entries for the current run_info and source."""
+        try:
+            names = os.listdir(self.cache_root)
+        except OSError:
+            return
+        for name in names:
+            if name != self.key[:16]:
+                shutil.rmtree(os.path.join(self.cache_root, name), ignore_errors=True)
+
+    def get(self, manifest_path, data, compile_func, extra_key=""):
+        """Get the compiled manifest for the file at manifest_path, compiling
+        and storing it if there isn't an up to date entry
+
+        :param manifest_path: Path to the manifest file
+        :param data: Contents of the manifest file
+        :param compile_func: Function taking a stream containing data and
+                             returning the compiled manifest
+        :param extra_key: Any other input to compile_func that affects the
+                          output
+        """
+        data_hash = hashlib.sha1(extra_key.encode("utf8") + b"\0" + data).hexdigest()
+        cache_path = self._cache_path(manifest_path)
+        try:
+            with open(cache_path, "rb") as f:
+                cached_hash, compiled = pickle.load(f)
+            if cached_hash == data_hash:
+                self.hits += 1
+                return compiled
+        except Exception:
+            # Missing or unreadable entries are treated as a cache miss
+            pass
+
+        self.misses += 1
+        compiled = compile_func(BytesIO(data))
+        self._store(cache_path, data_hash, compiled)
+        return compiled
+
+    def _store(self, cache_path, data_hash, compiled):
+        cache_dir = os.path.dirname(cache_path)
+        try:
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            # Write to a temporary file and rename it into place, so that
+            # concurrent readers never see a partial entry
+            fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump((data_hash, compiled), f, pickle.HIGHEST_PROTOCOL)
+            if os.path.exists(cache_path):
+                os.unlink(cache_path)
+            os.rename(tmp_path, cache_path)
+        except (IOError, OSError):
+            pass
+
+
+def _compile_file(path, compile_func, cache, extra_key=""):
+    try:
+        with open(path) as f:
+            if cache is None:
+                return compile_func(f)
+            data = f.read()
+    except IOError:
+        return None
+    return cache.get(path, data, compile_func, extra_key)
+
+
+def get_manifest(metadata_root, test_path, url_base, run_info, cache=None):
     """Get the ExpectedManifest for a particular test path, or None if there is no
     metadata stored for that test path.
 
@@ -475,31 +591,33 @@ def get_manifest(metadata_root, test_path, url_base, run_info):
     :param url_base: Base url for serving the tests in this manifest
     :param run_info: Dictionary of properties of the test run for which the expectation
                      values should be computed.
+    :param cache: Optional CompiledManifestCache for run_info
     """
     manifest_path = expected.expected_path(metadata_root, test_path)
-    try:
-        with open(manifest_path) as f:
-            return static.compile(f,
-                                  run_info,
-                                  data_cls_getter=data_cls_getter,
-                                  test_path=test_path,
-                                  url_base=url_base)
-    except IOError:
-        return None
 
+    def compile_func(f):
+        return static.compile(f,
+                              run_info,
+                              data_cls_getter=data_cls_getter,
+                              test_path=test_path,
+                              url_base=url_base)
+
+    return _compile_file(manifest_path, compile_func, cache,
+                         extra_key="%s\0%s" % (test_path, url_base))
 
-def get_dir_manifest(path, run_info):
+
+def get_dir_manifest(path, run_info, cache=None):
     """Get the ExpectedManifest for a particular test path, or None if there is no
     metadata stored for that test path.
 
     :param path: Full path to the ini file
     :param run_info: Dictionary of properties of the test run for which the expectation
                      values should be computed.
+    :param cache: Optional CompiledManifestCache for run_info
     """
-    try:
-        with open(path) as f:
-            return static.compile(f,
-                                  run_info,
-                                  data_cls_getter=lambda x,y: DirectoryManifest)
-    except IOError:
-        return None
+    def compile_func(f):
+        return static.compile(f,
+                              run_info,
+                              data_cls_getter=lambda x,y: DirectoryManifest)
+
+    return _compile_file(path, compile_func, cache)
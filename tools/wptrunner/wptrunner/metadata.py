@@ -1,6 +1,9 @@
 from __future__ import print_function
 import array
+import multiprocessing
 import os
+import sys
+import time
 from collections import defaultdict, namedtuple
 
 from mozlog import structuredlog
@@ -52,32 +55,24 @@ class RunInfo(object):
 def update_expected(test_paths, serve_root, log_file_names,
                     update_properties, rev_old=None, rev_new="HEAD",
                     full_update=False, sync_root=None, disable_intermittent=None,
-                    update_intermittent=False, remove_intermittent=False):
+                    update_intermittent=False, remove_intermittent=False, processes=1):
     """Update the metadata files for web-platform-tests based on
     the results obtained in a previous run or runs
 
     If disable_intermittent is not None, assume log_file_names refers to logs from repeated
-    test jobs, disable tests that don't behave as expected on all runs"""
+    test jobs, disable tests that don't behave as expected on all runs
+
+    If processes is greater than 1, logs are read, and metadata files updated,
+    in that many worker processes"""
     do_delayed_imports(serve_root)
 
     id_test_map = load_test_data(test_paths)
 
-    for metadata_path, updated_ini in update_from_logs(id_test_map,
-                                                       update_properties,
-                                                       disable_intermittent,
-                                                       update_intermittent,
-                                                       remove_intermittent,
-                                                       full_update,
-                                                       *log_file_names):
+    updater = ExpectedUpdater(id_test_map)
+    read_logs(updater, log_file_names, processes)
 
-        write_new_expected(metadata_path, updated_ini)
-        if disable_intermittent:
-            for test in updated_ini.iterchildren():
-                for subtest in test.iterchildren():
-                    if subtest.new_disabled:
-                        print("disabled: %s" % os.path.dirname(subtest.root.test_path) + "/" + subtest.name)
-                    if test.new_disabled:
-                        print("disabled: %s" % test.root.test_path)
+    write_results(id_test_map, update_properties, full_update, disable_intermittent,
+                  update_intermittent, remove_intermittent, processes)
 
 
 def do_delayed_imports(serve_root=None):
@@ -160,12 +155,13 @@ class InternedData(object):
     rev_type_conv = None
 
     def __init__(self, max_bits=8):
+        self.max_bits = max_bits
         self.max_idx = 2**max_bits - 2
         # Reserve 0 as a sentinal
         self._data = [None], {}
 
     def clear(self):
-        self.__init__()
+        self.__init__(self.max_bits)
 
     def store(self, obj):
         if self.type_conv is not None:
@@ -201,9 +197,14 @@ class RunInfoInterned(InternedData):
         return dict(value)
 
 
-prop_intern = InternedData(4)
-run_info_intern = InternedData(8)
-status_intern = InternedData(4)
+# Number of bits used for each part of a result packed by PackedResultList
+prop_bits = 4
+status_bits = 8
+run_info_bits = 20
+
+prop_intern = InternedData(prop_bits)
+run_info_intern = InternedData(run_info_bits)
+status_intern = InternedData(status_bits)
 
 
 def load_test_data(test_paths):
@@ -218,20 +219,51 @@ def load_test_data(test_paths):
 
 
 def update_from_logs(id_test_map, update_properties, disable_intermittent, update_intermittent,
-                     remove_intermittent, full_update, *log_filenames):
+                     remove_intermittent, full_update, *log_filenames, **kwargs):
+    processes = kwargs.pop("processes", 1)
+    assert not kwargs
 
     updater = ExpectedUpdater(id_test_map)
-
-    for i, log_filename in enumerate(log_filenames):
-        print("Processing log %d/%d" % (i + 1, len(log_filenames)))
-        with open(log_filename) as f:
-            updater.update_from_log(f)
+    read_logs(updater, log_filenames, processes)
 
     for item in update_results(id_test_map, update_properties, full_update,
                                disable_intermittent, update_intermittent, remove_intermittent):
         yield item
 
 
+def read_logs(updater, log_filenames, processes=1):
+    """Add the results from a list of log files to an ExpectedUpdater.
+
+    If processes is greater than 1, the logs are parsed in that many worker
+    processes and the results merged in this process."""
+    if processes > 1 and len(log_filenames) > 1:
+        pool = multiprocessing.Pool(min(processes, len(log_filenames)))
+        try:
+            # Logs are merged in order, so the results are the same as for
+            # a serial update
+            for i, reduced in enumerate(pool.imap(reduce_log, log_filenames)):
+                print("Processing log %d/%d" % (i + 1, len(log_filenames)))
+                updater.merge(reduced)
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        for i, log_filename in enumerate(log_filenames):
+            print("Processing log %d/%d" % (i + 1, len(log_filenames)))
+            with open(log_filename) as f:
+                updater.update_from_log(f)
+
+
+def get_default_expected_by_type():
+    default_expected_by_type = {}
+    for test_type, test_cls in wpttest.manifest_test_cls.iteritems():
+        if test_cls.result_cls:
+            default_expected_by_type[(test_type, False)] = test_cls.result_cls.default_expected
+        if test_cls.subtest_result_cls:
+            default_expected_by_type[(test_type, True)] = test_cls.subtest_result_cls.default_expected
+    return default_expected_by_type
+
+
 def update_results(id_test_map,
                    update_properties,
                    full_update,
@@ -240,12 +272,7 @@ def update_results(id_test_map,
                    remove_intermittent=False):
     test_file_items = set(id_test_map.itervalues())
 
-    default_expected_by_type = {}
-    for test_type, test_cls in wpttest.manifest_test_cls.iteritems():
-        if test_cls.result_cls:
-            default_expected_by_type[(test_type, False)] = test_cls.result_cls.default_expected
-        if test_cls.subtest_result_cls:
-            default_expected_by_type[(test_type, True)] = test_cls.subtest_result_cls.default_expected
+    default_expected_by_type = get_default_expected_by_type()
 
     for test_file in test_file_items:
         updated_expected = test_file.update(default_expected_by_type, update_properties,
@@ -255,6 +282,98 @@ def update_results(id_test_map,
             yield test_file.metadata_path, updated_expected
 
 
+# Arguments to update_test_file, set before the worker processes are forked
+# so that the test data doesn't have to be sent to them
+_write_state = None
+
+
+def write_results(id_test_map,
+                  update_properties,
+                  full_update,
+                  disable_intermittent,
+                  update_intermittent=False,
+                  remove_intermittent=False,
+                  processes=1):
+    """Update the expectations of every test file with results, and write
+    out the metadata files that changed.
+
+    If processes is greater than 1, files are updated in that many worker
+    processes. Files are processed in a fixed order, so the output doesn't
+    depend on the number of processes."""
+    global _write_state
+
+    test_files = [item for item in set(id_test_map.itervalues())
+                  if full_update or item.requires_update]
+    test_files.sort(key=lambda item: (item.metadata_path, item.test_path))
+    if not test_files:
+        return
+
+    _write_state = (test_files,
+                    (get_default_expected_by_type(), update_properties, full_update,
+                     disable_intermittent, update_intermittent, remove_intermittent))
+
+    start = time.time()
+    modified = 0
+    update_time = 0
+    write_time = 0
+    # The worker processes get the test data by forking, which isn't
+    # possible on Windows
+    if processes > 1 and len(test_files) > 1 and sys.platform != "win32":
+        pool = multiprocessing.Pool(min(processes, len(test_files)))
+        results = pool.imap(update_test_file, range(len(test_files)), chunksize=16)
+    else:
+        pool = None
+        results = (update_test_file(i) for i in range(len(test_files)))
+
+    try:
+        for i, (file_modified, disabled, file_update_time, file_write_time) in enumerate(results):
+            modified += file_modified
+            update_time += file_update_time
+            write_time += file_write_time
+            for item in disabled:
+                print("disabled: %s" % item)
+            if (i + 1) % 1000 == 0 or i + 1 == len(test_files):
+                print("Updated metadata for %d/%d test files" % (i + 1, len(test_files)))
+    finally:
+        _write_state = None
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    print("Wrote %d metadata files in %.1fs (%.1fs updating expectations, %.1fs writing files)" %
+          (modified, time.time() - start, update_time, write_time))
+
+
+def update_test_file(index):
+    """Update and write out the metadata for the test file at index in the
+    list of test files to write.
+
+    :returns: Tuple of (whether the file was modified, list of newly disabled
+              tests, time spent updating, time spent writing)"""
+    test_files, args = _write_state
+    test_file = test_files[index]
+
+    start = time.time()
+    updated_expected = test_file.update(*args)
+    update_time = time.time() - start
+    if updated_expected is None or not updated_expected.modified:
+        return False, [], update_time, 0
+
+    write_new_expected(test_file.metadata_path, updated_expected)
+    write_time = time.time() - start - update_time
+
+    disabled = []
+    disable_intermittent = args[3]
+    if disable_intermittent:
+        for test in updated_expected.iterchildren():
+            for subtest in test.iterchildren():
+                if subtest.new_disabled:
+                    disabled.append(os.path.dirname(subtest.root.test_path) + "/" + subtest.name)
+                if test.new_disabled:
+                    disabled.append(test.root.test_path)
+    return True, disabled, update_time, write_time
+
+
 def directory_manifests(metadata_path):
     rv = []
     for dirpath, dirname, filenames in os.walk(metadata_path):
@@ -307,17 +426,40 @@ class ExpectedUpdater(object):
 
     def update_from_log(self, log_file):
         self.run_info = None
-        try:
-            data = json.load(log_file)
-        except Exception:
-            pass
+        if log_format(log_file) == "wptreport":
+            self.update_from_wptreport_log(json.load(log_file))
         else:
-            if "action" not in data and "results" in data:
-                self.update_from_wptreport_log(data)
-                return
-
-        log_file.seek(0)
-        self.update_from_raw_log(log_file)
+            self.update_from_raw_log(log_file)
+
+    def merge(self, reduced):
+        """Add the results of a log read by reduce_log in another process.
+
+        :param reduced: ReducedResults for the log
+        """
+        # The interned values in the other process don't match those in this
+        # one, so convert them
+        run_info_map = {idx: run_info_intern.store(run_info)
+                        for idx, run_info in enumerate(reduced.run_infos) if idx}
+        status_map = {idx: status_intern.store(status)
+                      for idx, status in enumerate(reduced.statuses) if idx}
+
+        for test_id, results in reduced.results.iteritems():
+            test_id = intern(test_id)
+            test_data = self.id_test_map.get(test_id)
+            if test_data is None:
+                print("Test not found %s, skipping" % test_id)
+                continue
+            for subtest_id, prop, run_info, value in results:
+                if subtest_id is not None:
+                    subtest_id = intern(subtest_id)
+                if prop == "status":
+                    value = status_map[value]
+                test_data.set(test_id, subtest_id, prop, run_info_map[run_info], value)
+
+        for test_id in reduced.requires_update:
+            test_data = self.id_test_map.get(test_id)
+            if test_data is not None:
+                test_data.set_requires_update()
 
     def update_from_raw_log(self, log_file):
         action_map = self.action_map
@@ -449,6 +591,111 @@ class ExpectedUpdater(object):
                 test_data.set_requires_update()
 
 
+def log_format(log_file):
+    """Get the format of a log file from its first line, without parsing the
+    whole file, and rewind the file.
+
+    :returns: "wptreport" or "raw"
+    """
+    prefix = log_file.read(64 * 1024)
+    try:
+        if not prefix.lstrip().startswith(b"{"):
+            return "raw"
+
+        first_line, newline, rest = prefix.partition(b"\n")
+        if newline:
+            return first_line_format(first_line)
+
+        # The first line is longer than the prefix, as for the suite_start of
+        # a raw log with many tests, or a wptreport log written on a single
+        # line. Find the end of the line without keeping it in memory.
+        length = len(first_line)
+        while not newline:
+            data = log_file.read(1024 * 1024)
+            if not data:
+                break
+            part, newline, rest = data.partition(b"\n")
+            length += len(part)
+        if not (rest.strip() or log_file.read(64 * 1024).strip()):
+            # The whole file is one line, so it's a single JSON object
+            return "wptreport"
+        log_file.seek(0)
+        return first_line_format(log_file.read(length))
+    finally:
+        log_file.seek(0)
+
+
+def first_line_format(first_line):
+    """Get the format of a log file that has more than one line from its
+    first line"""
+    try:
+        data = json.loads(first_line)
+    except ValueError:
+        # A wptreport log written over several lines
+        return "wptreport"
+    if isinstance(data, dict) and "action" not in data and "results" in data:
+        return "wptreport"
+    return "raw"
+
+
+class ReducedResults(object):
+    def __init__(self):
+        """Results read from a log by an ExpectedUpdater in a worker process,
+        to be merged into the TestFileData map in the main process.
+
+        This is used in place of the map of test id to TestFileData, and
+        records results for any test id.
+        """
+        # Map of test id to a list of (subtest id, property, run info index,
+        # value) tuples
+        self.results = defaultdict(list)
+        self.requires_update = set()
+        # Interned values in the worker process, in index order
+        self.run_infos = None
+        self.statuses = None
+
+    def get(self, test_id, default=None):
+        return ReducedTestData(self, test_id)
+
+    def __getitem__(self, test_id):
+        return ReducedTestData(self, test_id)
+
+    def __getstate__(self):
+        return {"results": dict(self.results),
+                "requires_update": self.requires_update,
+                "run_infos": self.run_infos,
+                "statuses": self.statuses}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+
+class ReducedTestData(object):
+    """Stand-in for the TestFileData of a test in ReducedResults"""
+    __slots__ = ("reduced", "test_id")
+
+    def __init__(self, reduced, test_id):
+        self.reduced = reduced
+        self.test_id = test_id
+
+    def set(self, test_id, subtest_id, prop, run_info, value):
+        self.reduced.results[test_id].append((subtest_id, prop, run_info, value))
+
+    def set_requires_update(self):
+        self.reduced.requires_update.add(self.test_id)
+
+
+def reduce_log(log_filename):
+    """Read a log file into ReducedResults; used by worker processes."""
+    reduced = ReducedResults()
+    updater = ExpectedUpdater(reduced)
+    with open(log_filename) as f:
+        updater.update_from_log(f)
+    reduced.run_infos = list(run_info_intern._data[0])
+    reduced.statuses = list(status_intern._data[0])
+    return reduced
+
+
 def create_test_tree(metadata_path, test_manifest):
     """Create a map of test_id to TestFileData for that test.
     """
@@ -491,26 +738,33 @@ def create_test_tree(metadata_path, test_manifest):
 class PackedResultList(object):
     """Class for storing test results.
 
-    Results are stored as an array of 2-byte integers for compactness.
-    The first 4 bits represent the property name, the second 4 bits
-    represent the test status (if it's a result with a status code), and
-    the final 8 bits represent the run_info. If the result doesn't have a
-    simple status code but instead a richer type, we place that richer type
-    in a dictionary and set the status part of the result type to 0.
+    Results are stored as an array of 4-byte integers for compactness.
+    The first prop_bits bits represent the property name, the next
+    status_bits bits represent the test status (if it's a result with a
+    status code), and the final run_info_bits bits represent the run_info.
+    If the result doesn't have a simple status code but instead a richer
+    type, we place that richer type in a dictionary and set the status part
+    of the result type to 0.
 
     This class depends on the global prop_intern, run_info_intern and
     status_intern InteredData objects to convert between the bit values
     and corresponding Python objects."""
 
+    typecode = "I" if array.array("I").itemsize >= 4 else "L"
+    status_shift = run_info_bits
+    prop_shift = status_bits + run_info_bits
+    status_mask = (2**status_bits - 1) << status_shift
+    run_info_mask = 2**run_info_bits - 1
+
     def __init__(self):
-        self.data = array.array("H")
+        self.data = array.array(self.typecode)
 
     __slots__ = ("data", "raw_data")
 
     def append(self, prop, run_info, value):
-        out_val = (prop << 12) + run_info
+        out_val = (prop << self.prop_shift) + run_info
         if prop == prop_intern.store("status"):
-            out_val += value << 8
+            out_val += value << self.status_shift
         else:
             if not hasattr(self, "raw_data"):
                 self.raw_data = {}
@@ -518,15 +772,15 @@ class PackedResultList(object):
         self.data.append(out_val)
 
     def unpack(self, idx, packed):
-        prop = prop_intern.get((packed & 0xF000) >> 12)
+        prop = prop_intern.get(packed >> self.prop_shift)
 
-        value_idx = (packed & 0x0F00) >> 8
+        value_idx = (packed & self.status_mask) >> self.status_shift
         if value_idx == 0:
             value = self.raw_data[idx]
         else:
             value = status_intern.get(value_idx)
 
-        run_info = run_info_intern.get(packed & 0x00FF)
+        run_info = run_info_intern.get(packed & self.run_info_mask)
 
         return prop, run_info, value
 
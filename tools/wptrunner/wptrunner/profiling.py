@@ -0,0 +1,135 @@
+"""Profiling of the harness itself, as opposed to the browser under test.
+
+The stacks of each profiled thread or process are sampled at a fixed
+interval, which adds little overhead, and written in the collapsed-stack
+format used by flame graph tools. Optionally each profiled thread or
+process also gets a cProfile profile, written as a pstats file that can be
+loaded with the pstats module or tools such as snakeviz; this gives exact
+call counts, but slows the harness down considerably.
+"""
+
+import cProfile
+import os
+import sys
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+from six import iteritems
+
+
+class StackSampler(threading.Thread):
+    def __init__(self, interval, thread_ident=None):
+        """Thread that periodically records the stacks of other threads in
+        the current process.
+
+        :param interval: Number of seconds between samples
+        :param thread_ident: Identifier of the thread to sample, or None to
+                             sample every thread
+        """
+        threading.Thread.__init__(self, name="StackSampler")
+        self.daemon = True
+        self.interval = interval
+        self.thread_ident = thread_ident
+        # Map of collapsed stack to number of samples
+        self.stacks = defaultdict(int)
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def sample(self):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in iteritems(sys._current_frames()):
+            if ident == self.ident:
+                continue
+            if self.thread_ident is not None and ident != self.thread_ident:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append("%s (%s:%i)" % (code.co_name,
+                                             os.path.basename(code.co_filename),
+                                             code.co_firstlineno))
+                frame = frame.f_back
+            stack.append(names.get(ident, "Thread-%i" % ident))
+            self.stacks[";".join(reversed(stack))] += 1
+
+    def write(self, path):
+        with open(path, "w") as f:
+            for stack, count in sorted(iteritems(self.stacks)):
+                f.write("%s %i\n" % (stack, count))
+
+
+class HarnessProfiler(object):
+    def __init__(self, output_dir, cprofile=False, interval=0.01):
+        """Settings for profiling the harness, shared by the main process
+        and the TestRunner processes.
+
+        :param output_dir: Directory to write profiles to
+        :param cprofile: Also profile with cProfile and write pstats files
+        :param interval: Number of seconds between stack samples
+        """
+        self.output_dir = output_dir
+        self.cprofile = cprofile
+        self.interval = interval
+
+    def path(self, name, extension):
+        return os.path.join(self.output_dir, "profile-%s-%i.%s" % (name, os.getpid(), extension))
+
+    @contextmanager
+    def profile(self, name, all_threads=False):
+        """Profile the current thread while the context is active.
+
+        :param name: Name of the profiled thread or process, used in the
+                     names of the profile files
+        :param all_threads: Sample the stacks of every thread in the process,
+                            rather than only the current thread
+        """
+        sampler = StackSampler(self.interval,
+                               None if all_threads else threading.current_thread().ident)
+        sampler.start()
+        profile = None
+        if self.cprofile:
+            profile = cProfile.Profile()
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+            sampler.stop()
+            if not os.path.exists(self.output_dir):
+                try:
+                    os.makedirs(self.output_dir)
+                except OSError:
+                    # Another process may have created it first
+                    if not os.path.isdir(self.output_dir):
+                        raise
+            sampler.write(self.path(name, "folded"))
+            if profile is not None:
+                profile.dump_stats(self.path(name, "prof"))
+
+
+@contextmanager
+def profile(harness_profiler, name, all_threads=False):
+    """Profile the current thread with harness_profiler, if it isn't None"""
+    if harness_profiler is None:
+        yield
+        return
+    with harness_profiler.profile(name, all_threads=all_threads):
+        yield
+
+
+def from_kwargs(kwargs):
+    """HarnessProfiler for the command line arguments, or None if the harness
+    isn't being profiled"""
+    if not kwargs.get("profile_harness"):
+        return None
+    return HarnessProfiler(kwargs["profile_harness_dir"] or os.getcwd(),
+                           cprofile=kwargs["profile_harness_cprofile"])
@@ -0,0 +1,170 @@
+import json
+import select
+import socket
+import time
+import uuid
+
+from six.moves.urllib.parse import urlencode
+
+from wptserve.handlers import handler
+from wptserve.stash import Stash, load_env_config
+
+# Path of the wptserve handler that forwards messages to a result channel
+channel_path = "/_wptrunner/message"
+
+
+class ResultChannelTimeout(Exception):
+    """Raised when a test doesn't post a completion message in time"""
+    pass
+
+
+class ResultChannel(object):
+    def __init__(self, check_interval=5, stash=None):
+        """Socket owned by the test runner that receives messages posted by
+        testharness tests.
+
+        Tests POST each message to the wptserve channel_path handler, which
+        forwards it to this socket, so the executor can wait for results and
+        testdriver actions without keeping a script running in the browser.
+        Each test gets a new token, which is registered in the server stash
+        along with the port of the socket; the handler only forwards messages
+        with a registered token, so messages from earlier tests are dropped
+        and pages can't have messages sent to any other port.
+
+        :param check_interval: Number of seconds to wait for a message before
+                               checking that the browser is still alive
+        :param stash: Stash to register the tokens in, defaulting to the
+                      stash of the test environment
+        """
+        self.check_interval = check_interval
+        self.stash = stash
+        self.sock = None
+        self.port = None
+        self.token = None
+
+    def start(self):
+        """Start waiting for messages from a new test.
+
+        :returns: The url path that the test should post its messages to
+        """
+        if self.sock is None:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.sock.bind(("127.0.0.1", 0))
+            self.sock.listen(16)
+            self.port = self.sock.getsockname()[1]
+        if self.stash is None:
+            address, authkey = load_env_config()
+            self.stash = Stash(channel_path, address, authkey)
+        self.unregister()
+        self.token = uuid.uuid4().hex
+        self.stash.put(self.token, self.port, channel_path)
+        return "%s?%s" % (channel_path, urlencode([("token", self.token)]))
+
+    def unregister(self):
+        if self.token is not None:
+            self.stash.take(self.token, channel_path)
+            self.token = None
+
+    def close(self):
+        if self.stash is not None:
+            self.unregister()
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+            self.port = None
+
+    def wait(self, timeout):
+        """Wait for the next message from the current test.
+
+        :returns: The decoded message, or None if the timeout expired
+        """
+        end_time = time.time() + timeout
+        while True:
+            remaining = end_time - time.time()
+            if remaining <= 0:
+                return None
+            readable, _, _ = select.select([self.sock], [], [], remaining)
+            if not readable:
+                return None
+            conn, _ = self.sock.accept()
+            try:
+                conn.settimeout(5)
+                chunks = []
+                while True:
+                    chunk = conn.recv(65536)
+                    if not chunk:
+                        break
+                    chunks.append(chunk)
+            except socket.error:
+                continue
+            finally:
+                conn.close()
+            token, _, body = b"".join(chunks).partition(b"\n")
+            if token.decode("ascii", "replace") != self.token:
+                continue
+            try:
+                return json.loads(body.decode("utf8"))
+            except ValueError:
+                continue
+
+    def run(self, callback_handler, timeout, is_alive):
+        """Pass messages from the current test to a CallbackHandler until the
+        test is complete.
+
+        :param timeout: Number of seconds to wait for the test to complete, or
+                        None to wait indefinitely
+        :param is_alive: Function returning whether the browser is still alive
+        :returns: The result returned by the handler, or None if the browser
+                  stopped responding
+        """
+        end_time = time.time() + timeout if timeout is not None else None
+        while True:
+            wait_timeout = self.check_interval
+            if end_time is not None:
+                remaining = end_time - time.time()
+                if remaining <= 0:
+                    raise ResultChannelTimeout()
+                wait_timeout = min(wait_timeout, remaining)
+            message = self.wait(wait_timeout)
+            if message is None:
+                if wait_timeout == self.check_interval and not is_alive():
+                    return None
+                continue
+            done, rv = callback_handler(message)
+            if done:
+                return rv
+
+
+@handler
+def forward_message(request, response):
+    """wptserve handler that forwards a message posted by a test to the
+    ResultChannel that registered the token given in the query string."""
+    try:
+        token = request.GET.first(b"token")
+    except KeyError:
+        return 400, [], "Missing token"
+    if b"\r" in token or b"\n" in token:
+        return 400, [], "Invalid token"
+
+    stash = request.server.stash
+    try:
+        # The entry is put back straight away, since a test can post several
+        # messages; the lock stops concurrent messages from missing it
+        with stash.lock:
+            port = stash.take(token.decode("ascii"), channel_path)
+            if port is not None:
+                stash.put(token.decode("ascii"), port, channel_path)
+    except ValueError:
+        return 400, [], "Invalid token"
+    if port is None:
+        return 404, [], "Unknown result channel"
+
+    try:
+        conn = socket.create_connection(("127.0.0.1", port), timeout=5)
+    except socket.error:
+        return 410, [], "Result channel is closed"
+    try:
+        conn.sendall(token + b"\n" + request.body)
+    finally:
+        conn.close()
+    return 204, [], ""
@@ -0,0 +1,421 @@
+"""Compact columnar archive of the results of many runs.
+
+An archive file is a sequence of chunks, each holding the results of one
+or more runs. Within a chunk, test names, subtest names and statuses are
+interned, each distinct run_info is stored once and referred to by index,
+and the results are stored as typed arrays sorted by test, so the results
+for a range of tests can be read without reading the rest of the chunk.
+
+Each chunk ends with a fixed-size footer giving its length, so chunks are
+found by reading backwards from the end of the file; runs are added by
+appending a chunk, and the most recent runs can be read without reading
+the older chunks. Merging rewrites the chunks of one or more archives as
+a single chunk, so the names are shared between all the runs.
+"""
+
+import array
+import json
+import os
+import struct
+import sys
+from bisect import bisect_left
+
+from six import unichr
+
+magic = b"WRA1"
+header_format = "<4sI"
+footer_format = "<Q4s"
+header_size = struct.calcsize(header_format)
+footer_size = struct.calcsize(footer_format)
+
+# Duration of results with no known duration, such as tests that didn't end
+no_duration = 0xFFFFFFFF
+
+typecodes = {"u8": "B",
+             "u32": "I" if array.array("I").itemsize == 4 else "L"}
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def array_to_bytes(data):
+    if sys.byteorder != "little":
+        data = array.array(data.typecode, data)
+        data.byteswap()
+    return data.tobytes() if hasattr(data, "tobytes") else data.tostring()
+
+
+def array_from_bytes(kind, data):
+    rv = array.array(typecodes[kind])
+    if hasattr(rv, "frombytes"):
+        rv.frombytes(data)
+    else:
+        rv.fromstring(data)
+    if sys.byteorder != "little":
+        rv.byteswap()
+    return rv
+
+
+def prefix_range(names, prefix):
+    """Range of indices of the items of the sorted list names that start
+    with prefix"""
+    if not prefix:
+        return 0, len(names)
+    start = bisect_left(names, prefix)
+    end = bisect_left(names, prefix[:-1] + unichr(ord(prefix[-1]) + 1), start)
+    return start, end
+
+
+class Interned(object):
+    def __init__(self):
+        self.ids = {}
+        self.values = []
+
+    def store(self, value, key=None):
+        if key is None:
+            key = value
+        if key not in self.ids:
+            self.ids[key] = len(self.values)
+            self.values.append(value)
+        return self.ids[key]
+
+
+class ChunkBuilder(object):
+    def __init__(self):
+        """Accumulates results in compact arrays, and serializes them as a
+        chunk of an archive."""
+        self.runs = []
+        self.run_infos = Interned()
+        self.tests = Interned()
+        self.subtests = Interned()
+        self.statuses = Interned()
+
+        self.result_test = array.array(typecodes["u32"])
+        self.result_run = array.array(typecodes["u32"])
+        self.result_status = array.array(typecodes["u8"])
+        self.result_duration = array.array(typecodes["u32"])
+        # Index of the first subtest of each result
+        self.result_subtests = array.array(typecodes["u32"])
+        self.subtest_name = array.array(typecodes["u32"])
+        self.subtest_status = array.array(typecodes["u8"])
+
+    def __len__(self):
+        return len(self.result_test)
+
+    def add_run(self, run_info, time_start=None, time_end=None):
+        """Add a run, and return its index for adding results"""
+        run_info = run_info or {}
+        run_info_id = self.run_infos.store(run_info, json.dumps(run_info, sort_keys=True))
+        self.runs.append({"run_info": run_info_id,
+                          "time_start": time_start,
+                          "time_end": time_end})
+        return len(self.runs) - 1
+
+    def add_result(self, run, test, status, duration=None, subtests=()):
+        """Add the result of a test.
+
+        :param run: Index of the run returned by add_run
+        :param test: Test id
+        :param status: Status of the test
+        :param duration: Duration of the test in milliseconds, or None
+        :param subtests: Iterable of (subtest name, status) pairs
+        """
+        self.result_test.append(self.tests.store(test))
+        self.result_run.append(run)
+        self.result_status.append(self.status_id(status))
+        self.result_duration.append(no_duration if duration is None
+                                    else min(max(int(duration), 0), no_duration - 1))
+        self.result_subtests.append(len(self.subtest_name))
+        for name, subtest_status in subtests:
+            self.subtest_name.append(self.subtests.store(name))
+            self.subtest_status.append(self.status_id(subtest_status))
+
+    def status_id(self, status):
+        status_id = self.statuses.store(status)
+        if status_id > 0xFF:
+            raise ArchiveError("Too many distinct statuses")
+        return status_id
+
+    def to_bytes(self):
+        """Serialize the results as a chunk, with the results sorted by
+        test and then by run"""
+        test_names = sorted(self.tests.values)
+        test_ids = {name: i for i, name in enumerate(test_names)}
+        new_test_id = [test_ids[name] for name in self.tests.values]
+        order = sorted(range(len(self)),
+                       key=lambda i: (new_test_id[self.result_test[i]], self.result_run[i]))
+
+        test_rows = array.array(typecodes["u32"], [0] * (len(test_names) + 1))
+        for i in order:
+            test_rows[new_test_id[self.result_test[i]] + 1] += 1
+        for i in range(len(test_names)):
+            test_rows[i + 1] += test_rows[i]
+
+        result_subtests = array.array(typecodes["u32"])
+        subtest_name = array.array(typecodes["u32"])
+        subtest_status = array.array(typecodes["u8"])
+        for i in order:
+            start = self.result_subtests[i]
+            end = (self.result_subtests[i + 1] if i + 1 < len(self)
+                   else len(self.subtest_name))
+            result_subtests.append(len(subtest_name))
+            subtest_name.extend(self.subtest_name[start:end])
+            subtest_status.extend(self.subtest_status[start:end])
+        result_subtests.append(len(subtest_name))
+
+        columns = [
+            ("tests", "json", test_names),
+            ("test_rows", "u32", test_rows),
+            ("result_run", "u32", array.array(self.result_run.typecode,
+                                              (self.result_run[i] for i in order))),
+            ("result_status", "u8", array.array(self.result_status.typecode,
+                                                (self.result_status[i] for i in order))),
+            ("result_duration", "u32", array.array(self.result_duration.typecode,
+                                                   (self.result_duration[i] for i in order))),
+            ("result_subtests", "u32", result_subtests),
+            ("subtests", "json", self.subtests.values),
+            ("subtest_name", "u32", subtest_name),
+            ("subtest_status", "u8", subtest_status),
+        ]
+
+        # Column offsets are relative to the end of the header
+        blobs = []
+        column_info = {}
+        offset = 0
+        for name, kind, data in columns:
+            if kind == "json":
+                blob = json.dumps(data).encode("utf-8")
+                length = len(blob)
+            else:
+                blob = array_to_bytes(data)
+                length = len(data)
+            column_info[name] = [offset, length, kind]
+            blobs.append(blob)
+            offset += len(blob)
+
+        header = json.dumps({"runs": self.runs,
+                             "run_infos": self.run_infos.values,
+                             "statuses": self.statuses.values,
+                             "columns": column_info}).encode("utf-8")
+        length = header_size + len(header) + offset + footer_size
+        return b"".join([struct.pack(header_format, magic, len(header)), header] +
+                        blobs +
+                        [struct.pack(footer_format, length, magic)])
+
+
+class Chunk(object):
+    def __init__(self, f, offset, length):
+        """A chunk of an archive, whose columns are read from the file as
+        they are needed."""
+        self.f = f
+        self.offset = offset
+        self.length = length
+        f.seek(offset)
+        chunk_magic, header_length = struct.unpack(header_format, f.read(header_size))
+        if chunk_magic != magic:
+            raise ArchiveError("Bad chunk header at offset %i" % offset)
+        self.header = json.loads(f.read(header_length).decode("utf-8"))
+        self.data_start = offset + header_size + header_length
+        self._tests = None
+        self._subtests = None
+
+    @property
+    def runs(self):
+        return self.header["runs"]
+
+    @property
+    def statuses(self):
+        return self.header["statuses"]
+
+    def run_info(self, run):
+        return self.header["run_infos"][self.runs[run]["run_info"]]
+
+    @property
+    def tests(self):
+        if self._tests is None:
+            self._tests = self.read_column("tests")
+        return self._tests
+
+    @property
+    def subtests(self):
+        if self._subtests is None:
+            self._subtests = self.read_column("subtests")
+        return self._subtests
+
+    def read_column(self, name, start=0, end=None):
+        """Read the items from start to end of a column"""
+        offset, length, kind = self.header["columns"][name]
+        self.f.seek(self.data_start + offset)
+        if kind == "json":
+            return json.loads(self.f.read(length).decode("utf-8"))
+        if end is None:
+            end = length
+        itemsize = array.array(typecodes[kind]).itemsize
+        self.f.seek(self.data_start + offset + start * itemsize)
+        return array_from_bytes(kind, self.f.read((end - start) * itemsize))
+
+    def results(self, prefix="", first_run=0, subtests=False):
+        """Iterator over the results for tests starting with prefix.
+
+        :param prefix: Prefix of the ids of the tests to read
+        :param first_run: Index of the first run in the chunk to read
+        :param subtests: Include the results of subtests
+        :returns: Iterator of (test, run, status, duration, subtests)
+                  tuples, where duration is None if it isn't known and
+                  subtests is a list of (name, status) pairs, or None if
+                  subtests aren't included
+        """
+        start, end = prefix_range(self.tests, prefix)
+        if start == end:
+            return
+        test_rows = self.read_column("test_rows", start, end + 1)
+        row_start, row_end = test_rows[0], test_rows[-1]
+        runs = self.read_column("result_run", row_start, row_end)
+        statuses = self.read_column("result_status", row_start, row_end)
+        durations = self.read_column("result_duration", row_start, row_end)
+        if subtests:
+            subtest_rows = self.read_column("result_subtests", row_start, row_end + 1)
+            subtest_names = self.read_column("subtest_name", subtest_rows[0], subtest_rows[-1])
+            subtest_statuses = self.read_column("subtest_status",
+                                                subtest_rows[0], subtest_rows[-1])
+
+        for test_index in range(start, end):
+            test = self.tests[test_index]
+            for row in range(test_rows[test_index - start] - row_start,
+                             test_rows[test_index - start + 1] - row_start):
+                if runs[row] < first_run:
+                    continue
+                duration = durations[row]
+                test_subtests = None
+                if subtests:
+                    base = subtest_rows[0]
+                    test_subtests = [(self.subtests[subtest_names[i - base]],
+                                      self.statuses[subtest_statuses[i - base]])
+                                     for i in range(subtest_rows[row], subtest_rows[row + 1])]
+                yield (test, runs[row], self.statuses[statuses[row]],
+                       None if duration == no_duration else duration, test_subtests)
+
+
+class ArchiveReader(object):
+    def __init__(self, f):
+        """Reader for an archive.
+
+        :param f: Archive file opened in binary mode
+        """
+        self.f = f
+
+    def iter_chunks_reversed(self):
+        """Iterator over the chunks from the end of the archive, reading
+        only the headers of the chunks that are used"""
+        self.f.seek(0, os.SEEK_END)
+        end = self.f.tell()
+        while end > 0:
+            if end < footer_size:
+                raise ArchiveError("Truncated archive")
+            self.f.seek(end - footer_size)
+            length, chunk_magic = struct.unpack(footer_format, self.f.read(footer_size))
+            if chunk_magic != magic or length > end:
+                raise ArchiveError("Bad chunk footer at offset %i" % (end - footer_size))
+            chunk = Chunk(self.f, end - length, length)
+            yield chunk
+            end = chunk.offset
+
+    def chunks(self):
+        return list(reversed(list(self.iter_chunks_reversed())))
+
+    def last_runs(self, count=None):
+        """The chunks holding the last count runs, or all the runs if count
+        is None.
+
+        :returns: List of (chunk, index of the first run to read) tuples in
+                  the order the chunks were added
+        """
+        rv = []
+        for chunk in self.iter_chunks_reversed():
+            first_run = 0
+            if count is not None:
+                first_run = max(len(chunk.runs) - count, 0)
+                count -= len(chunk.runs) - first_run
+            rv.append((chunk, first_run))
+            if count is not None and count <= 0:
+                break
+        rv.reverse()
+        return rv
+
+    def runs(self, last=None):
+        """List of the runs in the archive, as dictionaries with the
+        run_info and start and end times of each run"""
+        rv = []
+        for chunk, first_run in self.last_runs(last):
+            for run in range(first_run, len(chunk.runs)):
+                rv.append({"run_info": chunk.run_info(run),
+                           "time_start": chunk.runs[run]["time_start"],
+                           "time_end": chunk.runs[run]["time_end"]})
+        return rv
+
+    def durations(self, prefix="", last=None):
+        """Durations of the tests starting with prefix in the last runs.
+
+        :param prefix: Prefix of the ids of the tests to include
+        :param last: Number of runs to include, counting back from the most
+                     recent run, or None to include every run
+        :returns: Dictionary of test id to a list of (run, status, duration
+                  in ms) tuples, where run indexes the list returned by
+                  runs() with the same value of last
+        """
+        rv = {}
+        run_offset = 0
+        for chunk, first_run in self.last_runs(last):
+            for test, run, status, duration, _ in chunk.results(prefix, first_run):
+                rv.setdefault(test, []).append((run_offset + run - first_run, status, duration))
+            run_offset += len(chunk.runs) - first_run
+        for results in rv.values():
+            results.sort()
+        return rv
+
+
+def append_chunk(path, data):
+    """Append a chunk returned by ChunkBuilder.to_bytes to the archive at
+    path, creating the archive if it doesn't exist"""
+    with open(path, "ab") as f:
+        f.write(data)
+
+
+def add_chunks(builder, chunks):
+    """Add all the runs and results of chunks to a ChunkBuilder"""
+    for chunk in chunks:
+        run_ids = [builder.add_run(chunk.run_info(run), run_data["time_start"],
+                                   run_data["time_end"])
+                   for run, run_data in enumerate(chunk.runs)]
+        for test, run, status, duration, subtests in chunk.results(subtests=True):
+            builder.add_result(run_ids[run], test, status, duration, subtests)
+
+
+def merge(paths, output):
+    """Merge the archives in paths into a single chunk, written to output.
+
+    The output may be one of the inputs; it is only replaced once the
+    merged archive has been written.
+    """
+    builder = ChunkBuilder()
+    for path in paths:
+        with open(path, "rb") as f:
+            add_chunks(builder, ArchiveReader(f).chunks())
+    tmp_path = output + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(builder.to_bytes())
+    if os.path.exists(output):
+        os.unlink(output)
+    os.rename(tmp_path, output)
+
+
+def from_wptreport(data):
+    """ChunkBuilder holding the run in a parsed wptreport log"""
+    builder = ChunkBuilder()
+    run = builder.add_run(data.get("run_info", {}), data.get("time_start"), data.get("time_end"))
+    for test in data["results"]:
+        builder.add_result(run, test["test"], test["status"], test.get("duration"),
+                           [(subtest["name"], subtest["status"])
+                            for subtest in test["subtests"]])
+    return builder
@@ -0,0 +1,297 @@
+import base64
+import errno
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+
+
+def write_atomic(path, data):
+    """Write data to path so that readers in other processes never see a
+    partially written file."""
+    dir_path = os.path.dirname(path)
+    if not os.path.exists(dir_path):
+        try:
+            os.makedirs(dir_path)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+    fd, tmp_path = tempfile.mkstemp(dir=dir_path, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.rename(tmp_path, path)
+    except OSError:
+        # On Windows rename fails if the destination exists; the content is
+        # addressed by its hash, so the existing file is equivalent.
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        if not os.path.exists(path):
+            raise
+
+
+class ScreenshotStore(object):
+    def __init__(self, root, namespace, max_size=None, log_files=False):
+        """Store for reftest screenshots that can be shared between processes.
+
+        PNG data is written once to a content-addressed directory, keyed by the
+        SHA-1 of the decoded image, and the least recently used files are
+        removed once the directory grows larger than max_size. The index from
+        (url, viewport_size, dpi) to screenshot hash is a set of small files
+        under a per-store namespace, so lookups don't need a round trip to a
+        separate manager process.
+
+        :param root: Directory containing the store
+        :param namespace: Name of the index to use; stores with the same root
+                          and namespace share their index
+        :param max_size: Maximum size of the stored screenshots in bytes, or
+                         None for no limit
+        :param log_files: Refer to stored files from reftest_screenshots log
+                          entries rather than including the image data
+        """
+        self.root = root
+        self.namespace = namespace
+        self.max_size = max_size
+        self.log_files = log_files
+        self.data_dir = os.path.join(root, "screenshots")
+        self.index_dir = os.path.join(root, "index", namespace)
+        self.logged_dir = os.path.join(root, "logged")
+        # Bytes written by this process since the store size was last checked
+        self.written = 0
+        # Number of uses of each screenshot hash still expected by this
+        # process. Pinned screenshots are not evicted by this process.
+        self.pins = defaultdict(int)
+
+    def _index_path(self, key):
+        key_hash = hashlib.sha1(json.dumps(key).encode("utf8")).hexdigest()
+        return os.path.join(self.index_dir, key_hash[:2], key_hash[2:])
+
+    def path(self, hash_value):
+        """Path of the stored PNG with a given hash"""
+        return os.path.join(self.data_dir, hash_value[:2], "%s.png" % hash_value)
+
+    def get_hash(self, key):
+        """Get the screenshot hash for a (url, viewport_size, dpi) key, or None
+        if there isn't one in the index."""
+        try:
+            with open(self._index_path(key), "rb") as f:
+                return f.read().decode("ascii") or None
+        except IOError:
+            return None
+
+    def set_hash(self, key, hash_value):
+        try:
+            write_atomic(self._index_path(key), hash_value.encode("ascii"))
+        except (IOError, OSError):
+            # The index is only a cache, so failing to update it is harmless
+            pass
+
+    def claim(self, key, timeout):
+        """Try to become the process responsible for taking the screenshot
+        for a key.
+
+        :param timeout: Number of seconds after which a claim held by another
+                        process is considered to be stale
+        :returns: True if the claim was acquired, in which case release_claim
+                  must be called once the index has been updated
+        """
+        path = self._index_path(key) + ".lock"
+        for _ in range(2):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except OSError as e:
+                if e.errno == errno.ENOENT:
+                    try:
+                        os.makedirs(os.path.dirname(path))
+                    except OSError:
+                        pass
+                    continue
+                if e.errno != errno.EEXIST:
+                    return False
+                try:
+                    if time.time() - os.stat(path).st_mtime < timeout:
+                        return False
+                    # The process holding the claim probably died
+                    os.unlink(path)
+                except OSError:
+                    pass
+                continue
+            os.close(fd)
+            return True
+        return False
+
+    def release_claim(self, key):
+        try:
+            os.unlink(self._index_path(key) + ".lock")
+        except OSError:
+            pass
+
+    def wait_hash(self, key, timeout, interval=0.02):
+        """Wait for another process that claimed a key to add it to the index.
+
+        :returns: The screenshot hash, or None if the other process released
+                  its claim without updating the index, or the timeout expired
+        """
+        lock_path = self._index_path(key) + ".lock"
+        end_time = time.time() + timeout
+        while True:
+            hash_value = self.get_hash(key)
+            if hash_value is not None:
+                return hash_value
+            if not os.path.exists(lock_path) or time.time() >= end_time:
+                return self.get_hash(key)
+            time.sleep(interval)
+
+    def pin(self, hash_value, count=1):
+        """Record that this process expects count more uses of a screenshot"""
+        if hash_value not in self.pins:
+            try:
+                os.utime(self.path(hash_value), None)
+            except OSError:
+                pass
+        self.pins[hash_value] += count
+
+    def unpin(self, hash_value):
+        """Record that a use of a pinned screenshot is complete"""
+        if hash_value not in self.pins:
+            return
+        self.pins[hash_value] -= 1
+        if self.pins[hash_value] <= 0:
+            del self.pins[hash_value]
+            self.release(hash_value)
+
+    def release(self, hash_value):
+        """Make a screenshot that this process doesn't expect to use again the
+        first candidate for eviction. Using it again from any process makes it
+        recently used."""
+        if hash_value in self.pins:
+            return
+        try:
+            os.utime(self.path(hash_value), (0, 0))
+        except OSError:
+            pass
+
+    def put(self, data):
+        """Store a base64-encoded PNG screenshot.
+
+        :returns: SHA-1 of the decoded image data
+        """
+        png = base64.b64decode(data)
+        hash_value = hashlib.sha1(png).hexdigest()
+        path = self.path(hash_value)
+        if os.path.exists(path):
+            try:
+                os.utime(path, None)
+            except OSError:
+                pass
+            return hash_value
+        try:
+            write_atomic(path, png)
+        except (IOError, OSError):
+            return hash_value
+        self.written += len(png)
+        if self.max_size is not None and self.written > self.max_size // 16:
+            self.evict()
+        return hash_value
+
+    def get(self, hash_value):
+        """Get a stored screenshot as base64-encoded PNG data, or None if it
+        isn't in the store."""
+        try:
+            with open(self.path(hash_value), "rb") as f:
+                png = f.read()
+        except IOError:
+            return None
+        return base64.b64encode(png).decode("ascii")
+
+    def export(self, data):
+        """Write a base64-encoded PNG screenshot to a location that is never
+        evicted, so that it can be referenced from the logs.
+
+        :returns: Path to the file
+        """
+        png = base64.b64decode(data)
+        hash_value = hashlib.sha1(png).hexdigest()
+        path = os.path.join(self.logged_dir, "%s.png" % hash_value)
+        if not os.path.exists(path):
+            write_atomic(path, png)
+        return path
+
+    def clear(self):
+        """Remove all entries from the index. Stored screenshots are kept,
+        subject to eviction."""
+        shutil.rmtree(self.index_dir, ignore_errors=True)
+
+    def evict(self):
+        """Remove the least recently used screenshots until the total size of
+        the store is no more than max_size. Screenshots pinned by this process
+        are only removed if there is nothing else to remove."""
+        self.written = 0
+        if self.max_size is None:
+            return
+        entries = []
+        total = 0
+        for dir_path, _, file_names in os.walk(self.data_dir):
+            for name in file_names:
+                if not name.endswith(".png"):
+                    continue
+                path = os.path.join(dir_path, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                pinned = name[:-len(".png")] in self.pins
+                entries.append((pinned, stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        if total <= self.max_size:
+            return
+        entries.sort()
+        for _, _, size, path in entries:
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
+            if total <= self.max_size:
+                break
+
+
+class ScreenshotCache(object):
+    def __init__(self, root=None, max_size=None, log_files=False):
+        """Context manager owning the screenshot store for a test run.
+
+        :param root: Directory to keep screenshots in. If this is None, a
+                     temporary directory is created and removed on exit.
+        :param max_size: Maximum size of the stored screenshots in bytes
+        :param log_files: Refer to stored files from the logs rather than
+                          including the image data
+        """
+        self.root = root
+        self.max_size = max_size
+        self.log_files = log_files
+        self.temporary = False
+
+    def __enter__(self):
+        if self.root is None:
+            self.root = tempfile.mkdtemp(prefix="wptrunner-screenshots-")
+            self.temporary = True
+        elif not os.path.exists(self.root):
+            os.makedirs(self.root)
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        if self.temporary:
+            shutil.rmtree(self.root, ignore_errors=True)
+            self.root = None
+            self.temporary = False
+        elif os.path.exists(os.path.join(self.root, "index")):
+            shutil.rmtree(os.path.join(self.root, "index"), ignore_errors=True)
+
+    def store(self):
+        """Create a ScreenshotStore with a new, empty, index"""
+        assert self.root is not None, "ScreenshotCache must be entered before use"
+        return ScreenshotStore(self.root, uuid.uuid4().hex, self.max_size, self.log_files)
@@ -1,14 +1,14 @@
 import copy
 import functools
 import imp
-import io
 import os
+import sys
 from collections import OrderedDict, defaultdict
 from datetime import datetime
 
 from mozlog import reader
-from mozlog.formatters import JSONFormatter
-from mozlog.handlers import BaseHandler, StreamHandler, LogLevelFilter
+from mozlog.handlers import BaseHandler, LogLevelFilter
+from six import itervalues
 
 here = os.path.dirname(__file__)
 localpaths = imp.load_source("localpaths", os.path.abspath(os.path.join(here, os.pardir, os.pardir, "localpaths.py")))
@@ -46,7 +46,10 @@ class LogHandler(reader.LogHandler):
 
     """Handle updating test and subtest status in log.
 
-    Subclasses reader.LogHandler.
+    Subclasses reader.LogHandler, so it can be used with reader.handle_log,
+    or added to a logger to aggregate results as they are logged. Only the
+    first message for each status of a subtest is kept, so memory use
+    doesn't grow with the number of iterations.
     """
     def __init__(self):
         self.results = OrderedDict()
@@ -73,7 +76,8 @@ class LogHandler(reader.LogHandler):
 
         subtest = {
             "status": defaultdict(int),
-            "messages": set()
+            "messages": set(),
+            "message_statuses": set()
         }
         test["subtests"][subtest_name] = subtest
 
@@ -86,7 +90,8 @@ class LogHandler(reader.LogHandler):
     def test_status(self, data):
         subtest = self.find_or_create_subtest(data)
         subtest["status"][data["status"]] += 1
-        if data.get("message"):
+        if data.get("message") and data["status"] not in subtest["message_statuses"]:
+            subtest["message_statuses"].add(data["status"])
             subtest["messages"].add(data["message"])
 
     def test_end(self, data):
@@ -104,6 +109,98 @@ class LogHandler(reader.LogHandler):
             pass
 
 
+class AdaptiveRepeat(object):
+    def __init__(self, handler, processes=1, deadline=None):
+        """Choose which tests to run again in a verification step, based on
+        the results so far.
+
+        A test stops being rerun once it is known to be unstable, because its
+        results are inconsistent or it has almost timed out. Otherwise tests
+        that came closest to timing out are run first, and once the deadline
+        has passed tests aren't run again.
+
+        :param handler: LogHandler aggregating the results of the step
+        :param processes: Number of processes running tests, used to
+                          estimate how many tests can be run before the
+                          deadline
+        :param deadline: datetime after which tests aren't run again, or None
+        """
+        self.handler = handler
+        self.processes = processes
+        self.deadline = deadline
+
+    def time_left(self):
+        """Seconds until the deadline, or None if there is no deadline"""
+        if self.deadline is None:
+            return None
+        return (self.deadline - datetime.now()).total_seconds()
+
+    def is_finished(self):
+        time_left = self.time_left()
+        return time_left is not None and time_left <= 0
+
+    def is_unstable(self, test):
+        runs = sum(test["status"].values())
+        if is_inconsistent(test["status"], runs):
+            return True
+        if any(is_inconsistent(subtest["status"], runs)
+               for subtest in itervalues(test["subtests"])):
+            return True
+        return find_slow_status(test) is not None
+
+    def stop_rerun(self, test_id):
+        """Whether to stop rerunning a test without a restart before all
+        the iterations have run"""
+        if self.is_finished():
+            return True
+        test = self.handler.results.get(test_id)
+        return test is not None and self.is_unstable(test)
+
+    def priority(self, test_id):
+        """Sort key for a test; tests that haven't run yet come first, and
+        then the tests whose longest run was closest to their timeout"""
+        test = self.handler.results.get(test_id)
+        if test is None:
+            return (0, 0)
+        if not test.get("timeout"):
+            return (1, 0)
+        durations = [test["longest_duration"][status] for status in ["PASS", "FAIL", "OK"]
+                     if status in test["longest_duration"]]
+        return (1, -max(durations) / float(test["timeout"]) if durations else 0)
+
+    def estimated_duration(self, test_id):
+        """Estimated duration of a test in seconds, based on previous runs"""
+        test = self.handler.results.get(test_id)
+        if test is None or not test["longest_duration"]:
+            return 0
+        return max(test["longest_duration"].values()) / 1000.
+
+    def select_tests(self, tests):
+        """Tests to run in the next iteration, in the order to run them.
+
+        :param tests: Iterable of tests that would be run in the iteration
+        """
+        if self.is_finished():
+            return []
+        selected = []
+        for test in tests:
+            results = self.handler.results.get(test.id)
+            if results is not None and self.is_unstable(results):
+                continue
+            selected.append(test)
+        selected.sort(key=lambda test: self.priority(test.id))
+
+        time_left = self.time_left()
+        if time_left is not None:
+            budget = time_left * self.processes
+            for i, test in enumerate(selected):
+                budget -= self.estimated_duration(test.id)
+                if budget < 0:
+                    selected = selected[:i]
+                    break
+        return selected
+
+
 def is_inconsistent(results_dict, iterations):
     """Return whether or not a single test is inconsistent."""
     if 'SKIP' in results_dict:
@@ -135,16 +232,28 @@ def find_slow_status(test):
 
 def process_results(log, iterations):
     """Process test log and return overall results and list of inconsistent tests."""
-    inconsistent = []
-    slow = []
     handler = LogHandler()
     reader.handle_log(reader.read(log), handler)
-    results = handler.results
+    return summarise_results(handler.results, iterations)
+
+
+def summarise_results(results, iterations, adaptive=False):
+    """Return overall results and list of inconsistent tests from the
+    results aggregated by a LogHandler.
+
+    If adaptive is True, tests may have been run fewer than iterations
+    times, so each test is checked against the number of times it ran, which
+    is stored as its "iterations"."""
+    inconsistent = []
+    slow = []
     for test_name, test in results.iteritems():
-        if is_inconsistent(test["status"], iterations):
+        if adaptive:
+            test["iterations"] = sum(test["status"].values())
+        test_iterations = test.get("iterations", iterations)
+        if is_inconsistent(test["status"], test_iterations):
             inconsistent.append((test_name, None, test["status"], []))
         for subtest_name, subtest in test["subtests"].iteritems():
-            if is_inconsistent(subtest["status"], iterations):
+            if is_inconsistent(subtest["status"], test_iterations):
                 inconsistent.append((test_name, subtest_name, subtest["status"], subtest["messages"]))
 
         slow_status = find_slow_status(test)
@@ -159,6 +268,18 @@ def process_results(log, iterations):
     return results, inconsistent, slow
 
 
+def peak_memory():
+    """Peak resident set size of this process in bytes, or None if it isn't
+    available on this platform"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
 def err_string(results_dict, iterations):
     """Create and return string with errors from test run."""
     rv = []
@@ -177,15 +298,23 @@ def err_string(results_dict, iterations):
     return rv
 
 
-def write_inconsistent(log, inconsistent, iterations):
-    """Output inconsistent tests to logger.error."""
+def write_inconsistent(log, inconsistent, iterations, results=None):
+    """Output inconsistent tests to logger.error.
+
+    If results is given, the number of iterations of tests that store it
+    is used in place of iterations."""
+    def test_iterations(test):
+        if results is None:
+            return iterations
+        return results[test].get("iterations", iterations)
+
     log("## Unstable results ##\n")
     strings = [(
         "`%s`" % markdown_adjust(test),
         ("`%s`" % markdown_adjust(subtest)) if subtest else "",
-        err_string(results, iterations),
+        err_string(results_dict, test_iterations(test)),
         ("`%s`" % markdown_adjust(";".join(messages))) if len(messages) else "")
-        for test, subtest, results, messages in inconsistent]
+        for test, subtest, results_dict, messages in inconsistent]
     table(["Test", "Subtest", "Results", "Messages"], strings, log)
 
 
@@ -220,11 +349,12 @@ def write_results(log, results, iterations, pr_number=None, use_details=False):
             log('<summary>%s</summary>\n\n' % title)
         else:
             log("### %s ###" % title)
-        strings = [("", err_string(test["status"], iterations), "")]
+        test_iterations = test.get("iterations", iterations)
+        strings = [("", err_string(test["status"], test_iterations), "")]
 
         strings.extend(((
             ("`%s`" % markdown_adjust(subtest_name)) if subtest else "",
-            err_string(subtest["status"], iterations),
+            err_string(subtest["status"], test_iterations),
             ("`%s`" % markdown_adjust(';'.join(subtest["messages"]))) if len(subtest["messages"]) else "")
             for subtest_name, subtest in test["subtests"].items()))
         table(["Subtest", "Results", "Messages"], strings, log)
@@ -235,7 +365,8 @@ def write_results(log, results, iterations, pr_number=None, use_details=False):
         log("</details>\n")
 
 
-def run_step(logger, iterations, restart_after_iteration, kwargs_extras, **kwargs):
+def run_step(logger, iterations, restart_after_iteration, kwargs_extras, adaptive=False,
+             deadline=None, **kwargs):
     import wptrunner
     kwargs = copy.deepcopy(kwargs)
 
@@ -257,10 +388,13 @@ def run_step(logger, iterations, restart_after_iteration, kwargs_extras, **kwarg
     logger._state.handlers = [wrap_handler(handler)
                               for handler in initial_handlers]
 
-    log = io.BytesIO()
     # Setup logging for wptrunner that keeps process output and
-    # warning+ level logs only
-    logger.add_handler(StreamHandler(log, JSONFormatter()))
+    # warning+ level logs only, and aggregate the results as they are logged
+    handler = LogHandler()
+    logger.add_handler(handler)
+
+    if adaptive:
+        kwargs["adaptive_repeat"] = AdaptiveRepeat(handler, kwargs["processes"], deadline)
 
     wptrunner.run_tests(**kwargs)
 
@@ -268,12 +402,11 @@ def run_step(logger, iterations, restart_after_iteration, kwargs_extras, **kwarg
     logger._state.running_tests = set()
     logger._state.suite_started = False
 
-    log.seek(0)
-    results, inconsistent, slow = process_results(log, iterations)
+    results, inconsistent, slow = summarise_results(handler.results, iterations, adaptive)
     return results, inconsistent, slow, iterations
 
 
-def get_steps(logger, repeat_loop, repeat_restart, kwargs_extras):
+def get_steps(logger, repeat_loop, repeat_restart, kwargs_extras, adaptive=False, deadline=None):
     steps = []
     for kwargs_extra in kwargs_extras:
         if kwargs_extra:
@@ -285,12 +418,14 @@ def get_steps(logger, repeat_loop, repeat_restart, kwargs_extras):
         if repeat_loop:
             desc = "Running tests in a loop %d times%s" % (repeat_loop,
                                                            flags_string)
-            steps.append((desc, functools.partial(run_step, logger, repeat_loop, False, kwargs_extra)))
+            steps.append((desc, functools.partial(run_step, logger, repeat_loop, False, kwargs_extra,
+                                                  adaptive, deadline)))
 
         if repeat_restart:
             desc = "Running tests in a loop with restarts %s times%s" % (repeat_restart,
                                                                          flags_string)
-            steps.append((desc, functools.partial(run_step, logger, repeat_restart, True, kwargs_extra)))
+            steps.append((desc, functools.partial(run_step, logger, repeat_restart, True, kwargs_extra,
+                                                  adaptive, deadline)))
 
     return steps
 
@@ -310,14 +445,20 @@ def write_summary(logger, step_results, final_result):
     logger.info(':::')
 
 def check_stability(logger, repeat_loop=10, repeat_restart=5, chaos_mode=True, max_time=None,
-                    output_results=True, **kwargs):
+                    output_results=True, adaptive=False, **kwargs):
+    """Run the tests repeatedly and check their results are stable.
+
+    If adaptive is True, tests aren't rerun once they are known to be
+    unstable, tests closest to timing out are rerun first, and max_time is
+    checked between iterations rather than only between steps."""
     kwargs_extras = [{}]
     if chaos_mode and kwargs["product"] == "firefox":
         kwargs_extras.append({"chaos_mode_flags": 3})
 
-    steps = get_steps(logger, repeat_loop, repeat_restart, kwargs_extras)
-
     start_time = datetime.now()
+    deadline = start_time + max_time if max_time else None
+    steps = get_steps(logger, repeat_loop, repeat_restart, kwargs_extras, adaptive, deadline)
+
     step_results = []
 
     for desc, step_func in steps:
@@ -331,12 +472,15 @@ def check_stability(logger, repeat_loop=10, repeat_restart=5, chaos_mode=True, m
         logger.info('::: Running test verification step "%s"...' % desc)
         logger.info(':::')
         results, inconsistent, slow, iterations = step_func(**kwargs)
+        memory = peak_memory()
+        if memory is not None:
+            logger.info("::: Peak memory use: %.0f MB" % (memory / 1024. / 1024.))
         if output_results:
             write_results(logger.info, results, iterations)
 
         if inconsistent:
             step_results.append((desc, "FAIL"))
-            write_inconsistent(logger.info, inconsistent, iterations)
+            write_inconsistent(logger.info, inconsistent, iterations, results)
             write_summary(logger, step_results, "FAIL")
             return 1
 
@@ -16,6 +16,12 @@ class MessageQueue {
 window.__wptrunner_testdriver_callback = null;
 window.__wptrunner_message_queue = new MessageQueue();
 window.__wptrunner_url = null;
+// Url to post messages to when the executor uses a result channel, rather
+// than a resume script, to get results and testdriver actions.
+window.__wptrunner_channel_url = null;
+window.__wptrunner_channel_busy = false;
+// Keep a reference in case the test replaces XMLHttpRequest
+window.__wptrunner_XMLHttpRequest = window.XMLHttpRequest;
 
 window.__wptrunner_process_next_event = function() {
   /* This function handles the next testdriver event. The presence of
@@ -28,9 +34,13 @@ window.__wptrunner_process_next_event = function() {
      This function unsets the callback, so no further testdriver actions
      will be run until it is reset, which wptrunner does after it has
      completed handling the current action.
+
+     With a result channel, messages are instead posted to the channel url
+     one at a time, so that they arrive in order.
    */
 
-  if (!window.__wptrunner_testdriver_callback) {
+  var channel_url = window.__wptrunner_channel_url;
+  if (channel_url ? window.__wptrunner_channel_busy : !window.__wptrunner_testdriver_callback) {
     return;
   }
   var data = window.__wptrunner_message_queue.shift();
@@ -60,6 +70,17 @@ window.__wptrunner_process_next_event = function() {
   default:
     return;
   }
+  if (channel_url) {
+    window.__wptrunner_channel_busy = true;
+    var xhr = new window.__wptrunner_XMLHttpRequest();
+    xhr.open("POST", channel_url);
+    xhr.onloadend = function() {
+      window.__wptrunner_channel_busy = false;
+      __wptrunner_process_next_event();
+    };
+    xhr.send(JSON.stringify([__wptrunner_url, data.type, payload]));
+    return;
+  }
   var callback = window.__wptrunner_testdriver_callback;
   window.__wptrunner_testdriver_callback = null;
   callback([__wptrunner_url, data.type, payload]);
@@ -1,11 +1,12 @@
 import hashlib
 import os
+from six.moves import zip
 from six.moves.urllib.parse import urlsplit
 from abc import ABCMeta, abstractmethod
-from six.moves.queue import Empty
 from collections import defaultdict, deque
-from multiprocessing import Queue
+from multiprocessing import Pool, Queue
 
+from . import expected
 from . import manifestinclude
 from . import manifestexpected
 from . import wpttest
@@ -14,6 +15,8 @@ from mozlog import structured
 manifest = None
 manifest_update = None
 download_from_github = None
+_worker_run_info = None
+_worker_metadata_caches = None
 
 def do_delayed_imports():
     # This relies on an already loaded module having set the sys.path correctly :(
@@ -146,6 +149,33 @@ def iterfilter(filters, iter):
         yield item
 
 
+def get_metadata_cache(caches, metadata_path, run_info):
+    """Get the CompiledManifestCache for a metadata directory, or None if
+    caching is disabled.
+
+    :param caches: Dictionary of existing caches, or None if caching is disabled
+    """
+    if caches is None:
+        return None
+    if metadata_path not in caches:
+        caches[metadata_path] = manifestexpected.CompiledManifestCache(
+            os.path.join(metadata_path, ".cache", "expected"), run_info)
+    return caches[metadata_path]
+
+
+def _init_metadata_worker(run_info, cache_metadata):
+    global _worker_run_info, _worker_metadata_caches
+    _worker_run_info = run_info
+    _worker_metadata_caches = {} if cache_metadata else None
+
+
+def _load_test_metadata(args):
+    metadata_path, test_path, url_base = args
+    cache = get_metadata_cache(_worker_metadata_caches, metadata_path, _worker_run_info)
+    return manifestexpected.get_manifest(metadata_path, test_path, url_base, _worker_run_info,
+                                         cache=cache)
+
+
 class TestLoader(object):
     def __init__(self,
                  test_manifests,
@@ -156,7 +186,20 @@ class TestLoader(object):
                  total_chunks=1,
                  chunk_number=1,
                  include_https=True,
-                 skip_timeout=False):
+                 skip_timeout=False,
+                 lazy=False,
+                 metadata_processes=1,
+                 cache_metadata=False):
+        """Load the tests to run, along with their expectation metadata.
+
+        :param lazy: Don't load any tests up front; instead tests are loaded as
+                     they are requested through iter_loaded_tests.
+        :param metadata_processes: Number of processes to use for compiling
+                                   expectation metadata files.
+        :param cache_metadata: Store compiled expectation metadata in the
+                               .cache directory of each metadata path, and
+                               reuse it when the files are unchanged.
+        """
 
         self.test_types = test_types
         self.run_info = run_info
@@ -164,10 +207,20 @@ class TestLoader(object):
         self.manifest_filters = manifest_filters if manifest_filters is not None else []
 
         self.manifests = test_manifests
-        self.tests = None
-        self.disabled_tests = None
+        self._tests = None
+        self._disabled_tests = None
         self.include_https = include_https
         self.skip_timeout = skip_timeout
+        self.lazy = lazy
+        self.metadata_processes = metadata_processes
+        self.cache_metadata = cache_metadata
+        self.metadata_caches = {} if cache_metadata else None
+        if cache_metadata:
+            # Only keep the entries for this run_info, so the cache doesn't
+            # grow with each configuration that has been run
+            for paths in self.manifests.values():
+                get_metadata_cache(self.metadata_caches, paths["metadata_path"],
+                                   run_info).prune()
 
         self.chunk_type = chunk_type
         self.total_chunks = total_chunks
@@ -182,15 +235,43 @@ class TestLoader(object):
 
         self.directory_manifests = {}
 
-        self._load_tests()
+        # The pool is created up front, because with lazy loading the tests
+        # are loaded from a thread that runs alongside the TestRunnerManager
+        # threads, and forking a process that has other threads running can
+        # deadlock
+        self.metadata_pool = None
+        if metadata_processes > 1:
+            self.metadata_pool = Pool(metadata_processes, _init_metadata_worker,
+                                      (run_info, cache_metadata))
+
+        if not self.lazy:
+            self._load_tests()
+
+    @property
+    def tests(self):
+        if self._tests is None:
+            self._load_tests()
+        return self._tests
+
+    @property
+    def disabled_tests(self):
+        if self._disabled_tests is None:
+            self._load_tests()
+        return self._disabled_tests
 
     @property
     def test_ids(self):
         if self._test_ids is None:
             self._test_ids = []
-            for test_dict in [self.disabled_tests, self.tests]:
-                for test_type in self.test_types:
-                    self._test_ids += [item.id for item in test_dict[test_type]]
+            if self._tests is None:
+                # Get the ids from the manifest, so that we don't have to load
+                # the tests themselves
+                for _, _, _, tests in self.iter_manifest_items():
+                    self._test_ids += [item.id for item in tests]
+            else:
+                for test_dict in [self.disabled_tests, self.tests]:
+                    for test_type in self.test_types:
+                        self._test_ids += [item.id for item in test_dict[test_type]]
         return self._test_ids
 
     def get_test(self, manifest_file, manifest_test, inherit_metadata, test_metadata):
@@ -206,8 +287,10 @@ class TestLoader(object):
         for i in xrange(len(path_parts) + 1):
             path = os.path.join(metadata_path, os.path.sep.join(path_parts[:i]), "__dir__.ini")
             if path not in self.directory_manifests:
+                cache = get_metadata_cache(self.metadata_caches, metadata_path, self.run_info)
                 self.directory_manifests[path] = manifestexpected.get_dir_manifest(path,
-                                                                                   self.run_info)
+                                                                                   self.run_info,
+                                                                                   cache=cache)
             manifest = self.directory_manifests[path]
             if manifest is not None:
                 rv.append(manifest)
@@ -215,17 +298,28 @@ class TestLoader(object):
 
     def load_metadata(self, test_manifest, metadata_path, test_path):
         inherit_metadata = self.load_dir_metadata(test_manifest, metadata_path, test_path)
+        cache = get_metadata_cache(self.metadata_caches, metadata_path, self.run_info)
         test_metadata = manifestexpected.get_manifest(
-            metadata_path, test_path, test_manifest.url_base, self.run_info)
+            metadata_path, test_path, test_manifest.url_base, self.run_info, cache=cache)
         return inherit_metadata, test_metadata
 
-    def iter_tests(self):
+    def iter_manifest_items(self, test_types=None):
+        """Iterate over the filtered and chunked manifest items, without
+        loading any metadata.
+
+        :param test_types: Test types to include, defaulting to all the types
+                           passed to the constructor.
+        :returns: Iterator of (manifest_file, test_type, test_path, tests)
+        """
+        if test_types is None:
+            test_types = self.test_types
+
         manifest_items = []
         manifests_by_url_base = {}
 
         for manifest in sorted(self.manifests.keys(), key=lambda x:x.url_base):
             manifest_iter = iterfilter(self.manifest_filters,
-                                       manifest.itertypes(*self.test_types))
+                                       manifest.itertypes(*test_types))
             manifest_items.extend(manifest_iter)
             manifests_by_url_base[manifest.url_base] = manifest
 
@@ -234,28 +328,93 @@ class TestLoader(object):
 
         for test_type, test_path, tests in manifest_items:
             manifest_file = manifests_by_url_base[iter(tests).next().url_base]
+            yield manifest_file, test_type, test_path, tests
+
+    def iter_metadata(self, manifest_items):
+        """Iterate over the (inherit_metadata, test_metadata) for each of a
+        list of manifest items, in the same order as the items.
+
+        When using more than one metadata process the per-test expectation
+        files are compiled in a pool of worker processes. Compiled manifests
+        are returned in order, so tests can be used as soon as the metadata
+        for all earlier tests is available.
+        """
+        if self.metadata_pool is None:
+            for manifest_file, _, test_path, _ in manifest_items:
+                metadata_path = self.manifests[manifest_file]["metadata_path"]
+                yield self.load_metadata(manifest_file, metadata_path, test_path)
+            return
+
+        # Only send paths with an expectation file to the workers; most tests
+        # don't have one, and for those there's nothing to compile
+        args = []
+        has_metadata = []
+        for manifest_file, _, test_path, _ in manifest_items:
             metadata_path = self.manifests[manifest_file]["metadata_path"]
+            exists = os.path.exists(expected.expected_path(metadata_path, test_path))
+            if exists:
+                args.append((metadata_path, test_path, manifest_file.url_base))
+            has_metadata.append(exists)
 
-            inherit_metadata, test_metadata = self.load_metadata(manifest_file, metadata_path, test_path)
+        results = self.metadata_pool.imap(_load_test_metadata, args, chunksize=8)
+        for (manifest_file, _, test_path, _), exists in zip(manifest_items, has_metadata):
+            metadata_path = self.manifests[manifest_file]["metadata_path"]
+            inherit_metadata = self.load_dir_metadata(manifest_file, metadata_path, test_path)
+            test_metadata = results.next() if exists else None
+            yield inherit_metadata, test_metadata
+
+    def close(self):
+        """Stop the metadata worker processes, if any."""
+        if self.metadata_pool is not None:
+            self.metadata_pool.terminate()
+            self.metadata_pool.join()
+            self.metadata_pool = None
+
+    def iter_tests(self, test_types=None):
+        manifest_items = list(self.iter_manifest_items(test_types))
+
+        for (manifest_file, test_type, test_path, tests), metadata in zip(
+                manifest_items, self.iter_metadata(manifest_items)):
+            inherit_metadata, test_metadata = metadata
             for test in tests:
                 yield test_path, test_type, self.get_test(manifest_file, test, inherit_metadata, test_metadata)
 
+    def is_enabled(self, test):
+        if test.disabled():
+            return False
+        if not self.include_https and test.environment["protocol"] == "https":
+            return False
+        if self.skip_timeout and test.expected() == "TIMEOUT":
+            return False
+        return True
+
+    def iter_loaded_tests(self, test_type):
+        """Iterate over the tests of a given type as (test, enabled) pairs.
+
+        If the loader is lazy, each test is loaded as it is reached, so that
+        callers can start running tests before all tests have been loaded.
+        Otherwise the disabled tests are returned before the enabled tests.
+        """
+        if self._tests is None:
+            for _, _, test in self.iter_tests([test_type]):
+                yield test, self.is_enabled(test)
+        else:
+            for test in self.disabled_tests[test_type]:
+                yield test, False
+            for test in self.tests[test_type]:
+                yield test, True
+
     def _load_tests(self):
         """Read in the tests from the manifest file and add them to a queue"""
         tests = {"enabled":defaultdict(list),
                  "disabled":defaultdict(list)}
 
         for test_path, test_type, test in self.iter_tests():
-            enabled = not test.disabled()
-            if not self.include_https and test.environment["protocol"] == "https":
-                enabled = False
-            if self.skip_timeout and test.expected() == "TIMEOUT":
-                enabled = False
-            key = "enabled" if enabled else "disabled"
+            key = "enabled" if self.is_enabled(test) else "disabled"
             tests[key][test_type].append(test)
 
-        self.tests = tests["enabled"]
-        self.disabled_tests = tests["disabled"]
+        self._tests = tests["enabled"]
+        self._disabled_tests = tests["disabled"]
 
     def groups(self, test_types, chunk_type="none", total_chunks=1, chunk_number=1):
         groups = set()
@@ -276,9 +435,23 @@ class TestSource(object):
         self.current_group = None
         self.current_metadata = None
 
+    @classmethod
+    def make_queue(cls, tests, **kwargs):
+        test_queue = Queue()
+        cls.fill_queue(test_queue, tests, **kwargs)
+        return test_queue
+
     @abstractmethod
     #@classmethod (doesn't compose with @abstractmethod in < 3.3)
-    def make_queue(cls, tests, **kwargs):  # noqa: N805
+    def fill_queue(cls, test_queue, tests, **kwargs):  # noqa: N805
+        """Put (group, group_metadata) items for tests into test_queue,
+        followed by None to indicate that there are no more tests.
+
+        :param test_queue: Queue to fill
+        :param tests: Iterable of tests. This may be a generator that is still
+                      loading tests, in which case groups are added to the
+                      queue as soon as they are complete.
+        """
         pass
 
     @classmethod
@@ -287,10 +460,13 @@ class TestSource(object):
 
     def group(self):
         if not self.current_group or len(self.current_group) == 0:
-            try:
-                self.current_group, self.current_metadata = self.test_queue.get(block=False)
-            except Empty:
+            item = self.test_queue.get()
+            if item is None:
+                # Leave the end marker in place for any other TestSources
+                # reading from the same queue
+                self.test_queue.put(None)
                 return None, None
+            self.current_group, self.current_metadata = item
         return self.current_group, self.current_metadata
 
 
@@ -300,35 +476,59 @@ class GroupedSource(TestSource):
         raise NotImplementedError
 
     @classmethod
-    def make_queue(cls, tests, **kwargs):
-        test_queue = Queue()
-        groups = []
+    def fill_queue(cls, test_queue, tests, **kwargs):
+        group = None
 
         state = {}
 
         for test in tests:
             if cls.new_group(state, test, **kwargs):
-                group_metadata = cls.group_metadata(state)
-                groups.append((deque(), group_metadata))
+                if group is not None:
+                    test_queue.put(group)
+                group = (deque(), cls.group_metadata(state))
 
-            group, metadata = groups[-1]
-            group.append(test)
+            group_tests, metadata = group
+            group_tests.append(test)
             test.update_metadata(metadata)
 
-        for item in groups:
-            test_queue.put(item)
-        return test_queue
+        if group is not None:
+            test_queue.put(group)
+        test_queue.put(None)
 
 
 class SingleTestSource(TestSource):
+    # Maximum number of tests by which the process a test's affinity_key is
+    # assigned to may exceed the least loaded process before the key is moved
+    affinity_max_imbalance = 100
+
     @classmethod
-    def make_queue(cls, tests, **kwargs):
-        test_queue = Queue()
+    def fill_queue(cls, test_queue, tests, **kwargs):
         processes = kwargs["processes"]
+        batch_size = kwargs.get("batch_size")
+
+        if batch_size:
+            # Tests are still being loaded, so rather than waiting for all
+            # of them to be available, put them in the queue in batches.
+            # All batches share the same metadata object, so a manager
+            # moving from one batch to the next doesn't restart the browser.
+            group = deque()
+            metadata = cls.group_metadata(None)
+            for test in tests:
+                group.append(test)
+                test.update_metadata(metadata)
+                if len(group) >= batch_size:
+                    test_queue.put((group, metadata))
+                    group = deque()
+            if group:
+                test_queue.put((group, metadata))
+            test_queue.put(None)
+            return
+
         queues = [deque([]) for _ in xrange(processes)]
         metadatas = [cls.group_metadata(None) for _ in xrange(processes)]
+        affinity = {}
         for test in tests:
-            idx = hash(test.id) % processes
+            idx = cls.process_index(test, queues, affinity)
             group = queues[idx]
             metadata = metadatas[idx]
             group.append(test)
@@ -336,8 +536,21 @@ class SingleTestSource(TestSource):
 
         for item in zip(queues, metadatas):
             test_queue.put(item)
+        test_queue.put(None)
 
-        return test_queue
+    @classmethod
+    def process_index(cls, test, queues, affinity):
+        """Choose the queue for a test. Tests with the same affinity_key go to
+        the same queue, unless that would make the queues too unbalanced."""
+        key = test.affinity_key
+        if key is None:
+            return hash(test.id) % len(queues)
+        idx = affinity.get(key)
+        min_length = min(len(queue) for queue in queues)
+        if idx is None or len(queues[idx]) > min_length + cls.affinity_max_imbalance:
+            idx = min(range(len(queues)), key=lambda i: len(queues[i]))
+            affinity[key] = idx
+        return idx
 
 
 class PathGroupedSource(GroupedSource):
@@ -1,14 +1,24 @@
 from __future__ import unicode_literals
 
+import copy
 import multiprocessing
+import sys
 import threading
+import time
 import traceback
+import six
 from six.moves.queue import Empty
 from collections import namedtuple
-from multiprocessing import Process, current_process, Queue
+from multiprocessing import Process, current_process
 
 from mozlog import structuredlog, capture
 
+from .channel import Channel, ManagerChannel
+from .profiling import profile
+from .timing import PhaseTimer, extra_key as timing_key
+from .webdriver_server import WebDriverServerPool, active_pool
+from .wpttest import unpack_results
+
 # Special value used as a sentinal in various commands
 Stop = object()
 
@@ -51,21 +61,18 @@ for level_name in structuredlog.log_levels:
 
 
 class TestRunner(object):
-    def __init__(self, logger, command_queue, result_queue, executor):
+    def __init__(self, logger, channel, executor):
         """Class implementing the main loop for running tests.
 
         This class delegates the job of actually running a test to the executor
         that is passed in.
 
         :param logger: Structured logger
-        :param command_queue: subprocess.Queue used to send commands to the
-                              process
-        :param result_queue: subprocess.Queue used to send results to the
-                             parent TestRunnerManager process
+        :param channel: Channel used to receive commands from, and send results
+                        to, the parent TestRunnerManager process
         :param executor: TestExecutor object that will actually run a test.
         """
-        self.command_queue = command_queue
-        self.result_queue = result_queue
+        self.channel = channel
 
         self.executor = executor
         self.name = current_process().name
@@ -91,8 +98,7 @@ class TestRunner(object):
     def teardown(self):
         self.executor.teardown()
         self.send_message("runner_teardown")
-        self.result_queue = None
-        self.command_queue = None
+        self.channel = None
         self.browser = None
 
     def run(self):
@@ -104,7 +110,7 @@ class TestRunner(object):
                     "stop": self.stop,
                     "wait": self.wait}
         while True:
-            command, args = self.command_queue.get()
+            command, args = self.channel.get()
             try:
                 rv = commands[command](*args)
             except Exception:
@@ -133,17 +139,19 @@ class TestRunner(object):
         self.send_message("wait_finished")
 
     def send_message(self, command, *args):
-        self.result_queue.put((command, args))
+        self.channel.put((command, args))
 
 
-def start_runner(runner_command_queue, runner_result_queue,
+def start_runner(runner_conn,
                  executor_cls, executor_kwargs,
                  executor_browser_cls, executor_browser_kwargs,
-                 capture_stdio, stop_flag):
+                 capture_stdio, stop_flag, harness_profiler=None):
     """Launch a TestRunner in a new process"""
 
+    channel = Channel(runner_conn)
+
     def send_message(command, *args):
-        runner_result_queue.put((command, args))
+        channel.put((command, args))
 
     def handle_error(e):
         logger.critical(traceback.format_exc())
@@ -155,11 +163,12 @@ def start_runner(runner_command_queue, runner_result_queue,
 
     logger = MessageLogger(send_message)
 
-    with capture.CaptureIO(logger, capture_stdio):
+    with profile(harness_profiler, current_process().name, all_threads=True), \
+            capture.CaptureIO(logger, capture_stdio):
         try:
             browser = executor_browser_cls(**executor_browser_kwargs)
             executor = executor_cls(browser, **executor_kwargs)
-            with TestRunner(logger, runner_command_queue, runner_result_queue, executor) as runner:
+            with TestRunner(logger, channel, executor) as runner:
                 try:
                     runner.run()
                 except KeyboardInterrupt:
@@ -179,8 +188,78 @@ def next_manager_number():
     return local
 
 
+class StandbyBrowser(object):
+    def __init__(self, logger, browser, browser_settings, group_metadata):
+        """Browser instance that is launched in a background thread so that
+        a later restart can swap it in rather than waiting for a new browser
+        to start.
+
+        :param logger: Structured logger
+        :param browser: Browser instance that has not yet been started
+        :param browser_settings: Settings dictionary passed to Browser.start
+        :param group_metadata: Group metadata passed to Browser.start
+        """
+        self.logger = logger
+        self.browser = browser
+        self.browser_settings = browser_settings
+        self.group_metadata = group_metadata
+        self.succeeded = False
+        self.launch_time = None
+        self.started = threading.Event()
+        self.thread = threading.Thread(target=self._start, name="StandbyBrowser")
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def _start(self):
+        start_time = time.time()
+        try:
+            self.browser.setup()
+            self.browser.start(group_metadata=self.group_metadata, **self.browser_settings)
+        except Exception:
+            self.logger.warning("Failed to start standby browser:\n%s" % traceback.format_exc())
+        else:
+            self.succeeded = True
+        finally:
+            self.launch_time = time.time() - start_time
+            self.started.set()
+
+    def matches(self, browser_settings, group_metadata):
+        return (self.browser_settings == browser_settings and
+                (not self.browser.start_uses_group_metadata or
+                 self.group_metadata == group_metadata))
+
+    def wait(self, timeout=None):
+        """Wait for the standby browser to finish starting.
+
+        :returns: Boolean indicating whether the browser started successfully
+        """
+        return self.started.wait(timeout) and self.succeeded and self.browser.is_alive()
+
+    def discard(self, background=False):
+        """Stop the standby browser once it has finished starting.
+
+        :param background: Stop the browser in a new thread, rather than
+                           waiting for it to start in this one
+        :returns: The thread stopping the browser, or None
+        """
+        if background:
+            thread = threading.Thread(target=self.discard, name="StandbyBrowserStop")
+            thread.daemon = True
+            thread.start()
+            return thread
+
+        self.started.wait()
+        try:
+            self.browser.stop(force=True)
+            self.browser.cleanup()
+        except Exception:
+            self.logger.warning("Failed to stop standby browser:\n%s" % traceback.format_exc())
+
+
 class BrowserManager(object):
-    def __init__(self, logger, browser, command_queue, no_timeout=False):
+    def __init__(self, logger, browser, command_queue, no_timeout=False, browser_factory=None):
         self.logger = logger
         self.browser = browser
         self.no_timeout = no_timeout
@@ -192,6 +271,21 @@ class BrowserManager(object):
         self.init_timer = None
         self.command_queue = command_queue
 
+        # Callable returning a new, unstarted, Browser instance. If this is
+        # set, a standby browser is launched in the background whenever the
+        # current browser has finished initializing.
+        self.browser_factory = browser_factory
+        self.initial_browser = browser
+        self.group_metadata = None
+        self.standby = None
+        # Threads stopping standby browsers that couldn't be used
+        self.discard_threads = []
+        self.prewarm_hits = 0
+        self.prewarm_misses = 0
+        self.prewarm_time_saved = 0
+        # Time spent stopping and starting browsers since the last test
+        self.timer = PhaseTimer()
+
     def update_settings(self, test):
         browser_settings = self.browser.settings(test)
         restart_required = ((self.browser_settings is not None and
@@ -211,6 +305,7 @@ class BrowserManager(object):
             self.init_timer.cancel()
 
         self.logger.debug("Init called, starting browser and runner")
+        self.group_metadata = group_metadata
 
         if not self.no_timeout:
             self.init_timer = threading.Timer(self.browser.init_timeout,
@@ -218,8 +313,10 @@ class BrowserManager(object):
         try:
             if self.init_timer is not None:
                 self.init_timer.start()
-            self.logger.debug("Starting browser with settings %r" % self.browser_settings)
-            self.browser.start(group_metadata=group_metadata, **self.browser_settings)
+            with self.timer.phase("browser_start"):
+                if not self.use_standby(group_metadata):
+                    self.logger.debug("Starting browser with settings %r" % self.browser_settings)
+                    self.browser.start(group_metadata=group_metadata, **self.browser_settings)
             self.browser_pid = self.browser.pid()
         except Exception:
             self.logger.warning("Failure during init %s" % traceback.format_exc())
@@ -233,6 +330,69 @@ class BrowserManager(object):
 
         return succeeded
 
+    def use_standby(self, group_metadata):
+        """Replace the current browser with the standby browser, if there
+        is one that was started with the current settings.
+
+        :returns: Boolean indicating whether the standby browser was used
+        """
+        if self.standby is None:
+            return False
+
+        standby, self.standby = self.standby, None
+        wait_start = time.time()
+        if (not standby.matches(self.browser_settings, group_metadata) or
+            not standby.wait(self.browser.init_timeout)):
+            self.logger.debug("Standby browser not usable, starting a new browser")
+            self.prewarm_misses += 1
+            self.discard_in_background(standby)
+            return False
+
+        waited = time.time() - wait_start
+        self.logger.debug("Using standby browser, waited %.2fs" % waited)
+        if self.browser is not self.initial_browser:
+            # The initial browser is cleaned up by the TestRunnerManager
+            self.browser.cleanup()
+        self.browser = standby.browser
+        self.prewarm_hits += 1
+        self.prewarm_time_saved += max(standby.launch_time - waited, 0)
+        return True
+
+    def start_standby(self, group_metadata=None):
+        if self.browser_factory is None or self.standby is not None:
+            return
+        if group_metadata is None:
+            group_metadata = self.group_metadata
+        self.logger.debug("Starting standby browser")
+        self.standby = StandbyBrowser(self.logger,
+                                      self.browser_factory(),
+                                      dict(self.browser_settings),
+                                      group_metadata)
+        self.standby.start()
+
+    def prepare_group(self, group_metadata):
+        """Replace a standby browser that can't be used for a new group of
+        tests with one started for that group, so that it launches while the
+        current browser is stopped."""
+        if self.standby is None or self.standby.matches(self.browser_settings, group_metadata):
+            return
+        self.logger.debug("Restarting standby browser for the next group")
+        standby, self.standby = self.standby, None
+        self.discard_in_background(standby)
+        self.start_standby(group_metadata)
+
+    def discard_in_background(self, standby):
+        self.discard_threads = [thread for thread in self.discard_threads if thread.is_alive()]
+        self.discard_threads.append(standby.discard(background=True))
+
+    def discard_standby(self):
+        if self.standby is not None:
+            self.standby.discard()
+            self.standby = None
+        for thread in self.discard_threads:
+            thread.join()
+        self.discard_threads = []
+
     def send_message(self, command, *args):
         self.command_queue.put((command, args))
 
@@ -249,13 +409,22 @@ class BrowserManager(object):
             self.init_timer.cancel()
 
     def stop(self, force=False):
-        self.browser.stop(force=force)
+        with self.timer.phase("browser_stop"):
+            self.browser.stop(force=force)
         self.started = False
 
     def cleanup(self):
         if self.init_timer is not None:
             self.init_timer.cancel()
 
+    def teardown(self):
+        """Stop any standby browser and clean up any browser instance that
+        isn't owned by the TestRunnerManager."""
+        self.discard_standby()
+        if self.browser is not self.initial_browser:
+            self.browser.cleanup()
+            self.browser = self.initial_browser
+
     def check_crash(self, test_id):
         return self.browser.check_crash(process=self.browser_pid, test=test_id)
 
@@ -280,7 +449,8 @@ class TestRunnerManager(threading.Thread):
     def __init__(self, suite_name, test_queue, test_source_cls, browser_cls, browser_kwargs,
                  executor_cls, executor_kwargs, stop_flag, rerun=1, pause_after_test=False,
                  pause_on_unexpected=False, restart_on_unexpected=True, debug_info=None,
-                 capture_stdio=True):
+                 capture_stdio=True, prewarm_browser=False, harness_profiler=None,
+                 adaptive_repeat=None, timeout_tuner=None):
         """Thread that owns a single TestRunner process and any processes required
         by the TestRunner (e.g. the Firefox binary).
 
@@ -312,6 +482,22 @@ class TestRunnerManager(threading.Thread):
 
         self.rerun = rerun
         self.run_count = 0
+        # Decides whether to stop rerunning a test early, or None
+        self.adaptive_repeat = adaptive_repeat
+        # Chooses shorter timeouts for tests, or None
+        self.timeout_tuner = timeout_tuner
+        # Shortened timeout of the current test in seconds, or None
+        self.shortened_timeout = None
+        # Whether the current test is being rerun with the full timeout after
+        # timing out with a shortened timeout
+        self.retrying = False
+        # Time at which a restart caused by a test stopped with a shortened
+        # timeout started, or None
+        self.tuner_restart_time = None
+        # Whether the next restart is for a new group of tests, an unexpected
+        # result or new browser settings, rather than a crash or timeout, so
+        # a pooled WebDriver server can be reused
+        self.clean_restart = False
         self.pause_after_test = pause_after_test
         self.pause_on_unexpected = pause_on_unexpected
         self.restart_on_unexpected = restart_on_unexpected
@@ -319,8 +505,7 @@ class TestRunnerManager(threading.Thread):
 
         self.manager_number = next_manager_number()
 
-        self.command_queue = Queue()
-        self.remote_queue = Queue()
+        self.channel = ManagerChannel()
 
         self.test_runner_proc = None
 
@@ -340,6 +525,20 @@ class TestRunnerManager(threading.Thread):
 
         self.capture_stdio = capture_stdio
 
+        self.prewarm_browser = (prewarm_browser and
+                                debug_info is None and
+                                browser_cls.supports_prewarm)
+
+        # HarnessProfiler used to profile this thread and the TestRunner
+        # processes, if any
+        self.harness_profiler = harness_profiler
+
+        # Timings of the phases of the current test, including any browser
+        # restart before it
+        self.timer = PhaseTimer()
+        self.runner_start_time = None
+        self.test_start_time = None
+
     def run(self):
         """Main loop for the TestRunnerManager.
 
@@ -349,11 +548,17 @@ class TestRunnerManager(threading.Thread):
         that the manager should shut down the next time the event loop
         spins."""
         self.logger = structuredlog.StructuredLogger(self.suite_name)
-        with self.browser_cls(self.logger, **self.browser_kwargs) as browser:
+        with profile(self.harness_profiler, self.name), \
+                self.browser_cls(self.logger, **self.browser_kwargs) as browser:
+            if self.prewarm_browser:
+                browser_factory = lambda: self.browser_cls(self.logger, **self.browser_kwargs)
+            else:
+                browser_factory = None
             self.browser = BrowserManager(self.logger,
                                           browser,
-                                          self.command_queue,
-                                          no_timeout=self.debug_info is not None)
+                                          self.channel,
+                                          no_timeout=self.debug_info is not None,
+                                          browser_factory=browser_factory)
             dispatch = {
                 RunnerManagerState.before_init: self.start_init,
                 RunnerManagerState.initializing: self.init,
@@ -395,6 +600,7 @@ class TestRunnerManager(threading.Thread):
                 self.logger.debug("TestRunnerManager main loop terminating, starting cleanup")
                 clean = isinstance(self.state, RunnerManagerState.stop)
                 self.stop_runner(force=not clean)
+                self.browser.teardown()
                 self.teardown()
         self.logger.debug("TestRunnerManager main loop terminated")
 
@@ -421,7 +627,7 @@ class TestRunnerManager(threading.Thread):
             }
         }
         try:
-            command, data = self.command_queue.get(True, 1)
+            command, data = self.channel.get(True, 1)
             self.logger.debug("Got command: %r" % command)
         except IOError:
             self.logger.error("Got IOError from poll")
@@ -434,7 +640,7 @@ class TestRunnerManager(threading.Thread):
 
             if (isinstance(self.state, RunnerManagerState.running) and
                 not self.test_runner_proc.is_alive()):
-                if not self.command_queue.empty():
+                if not self.channel.empty():
                     # We got a new message so process that
                     return
 
@@ -495,29 +701,39 @@ class TestRunnerManager(threading.Thread):
         # test runner to ensure that any state set when the browser is started
         # can be passed in to the test runner.
         assert isinstance(self.state, RunnerManagerState.initializing)
-        assert self.command_queue is not None
-        assert self.remote_queue is not None
+        assert self.channel is not None
         self.logger.info("Starting runner")
         executor_browser_cls, executor_browser_kwargs = self.browser.browser.executor_browser()
 
-        args = (self.remote_queue,
-                self.command_queue,
+        runner_conn = self.channel.connect()
+        args = (runner_conn,
                 self.executor_cls,
                 self.executor_kwargs,
                 executor_browser_cls,
                 executor_browser_kwargs,
                 self.capture_stdio,
-                self.child_stop_flag)
+                self.child_stop_flag,
+                self.harness_profiler)
         self.test_runner_proc = Process(target=start_runner,
                                         args=args,
                                         name="TestRunner-%i" % self.manager_number)
+        self.runner_start_time = time.time()
         self.test_runner_proc.start()
+        self.channel.set_process(self.test_runner_proc)
+        # The runner process has its own copy of the connection; closing ours
+        # means that we see EOF if the runner exits
+        runner_conn.close()
         self.logger.debug("Test runner started")
         # Now we wait for either an init_succeeded event or an init_failed event
 
     def init_succeeded(self):
         assert isinstance(self.state, RunnerManagerState.initializing)
+        self.timer.add("runner_start", time.time() - self.runner_start_time)
+        if self.tuner_restart_time is not None:
+            self.timeout_tuner.record_restart(time.time() - self.tuner_restart_time)
+            self.tuner_restart_time = None
         self.browser.after_init()
+        self.browser.start_standby()
         return RunnerManagerState.running(self.state.test,
                                           self.state.test_group,
                                           self.state.group_metadata)
@@ -536,7 +752,8 @@ class TestRunnerManager(threading.Thread):
         test = None
         while test is None:
             while test_group is None or len(test_group) == 0:
-                test_group, group_metadata = self.test_source.group()
+                with self.timer.phase("queue_wait"):
+                    test_group, group_metadata = self.test_source.group()
                 if test_group is None:
                     self.logger.info("No more tests")
                     return None, None, None
@@ -550,27 +767,72 @@ class TestRunnerManager(threading.Thread):
 
         if self.browser.update_settings(self.state.test):
             self.logger.info("Restarting browser for new test environment")
+            self.clean_restart = True
             return RunnerManagerState.restarting(self.state.test,
                                                  self.state.test_group,
                                                  self.state.group_metadata)
 
-        self.logger.test_start(self.state.test.id)
-        if self.rerun > 1:
-            self.logger.info("Run %d/%d" % (self.run_count, self.rerun))
-            self.send_message("reset")
-        self.run_count += 1
-        self.send_message("run_test", self.state.test)
-
-    def test_ended(self, test, results):
+        if self.retrying:
+            self.logger.info("Rerunning %s with the full timeout" % self.state.test.id)
+        else:
+            self.logger.test_start(self.state.test.id)
+            if self.rerun > 1:
+                self.logger.info("Run %d/%d" % (self.run_count, self.rerun))
+                self.send_message("reset")
+            self.run_count += 1
+        self.timer.update(self.browser.timer.pop())
+        self.test_start_time = time.time()
+        self.send_message("run_test", self.test_to_run(self.state.test))
+
+    def test_to_run(self, test):
+        """Get the test to send to the TestRunner, which is a copy of test
+        with a shorter timeout if the timeout tuner gives one"""
+        self.shortened_timeout = None
+        if self.timeout_tuner is None or self.retrying or self.debug_info is not None:
+            return test
+        timeout_multiplier = self.executor_kwargs["timeout_multiplier"]
+        timeout = self.timeout_tuner.timeout(test, timeout_multiplier)
+        if timeout is None:
+            return test
+        self.shortened_timeout = timeout
+        test = copy.copy(test)
+        test.timeout = timeout / timeout_multiplier
+        return test
+
+    def test_ended(self, test_id, results):
         """Handle the end of a test.
 
         Output the result of each subtest, and the result of the overall
         harness to the logs.
         """
         assert isinstance(self.state, RunnerManagerState.running)
-        assert test == self.state.test
+        test = self.state.test
+        assert test_id == test.id
+        self.timer.add("run", time.time() - self.test_start_time)
+        log_start = time.time()
+        file_result, test_results = unpack_results(test, results)
+        if self.shortened_timeout is not None:
+            full_timeout = test.timeout * self.executor_kwargs["timeout_multiplier"]
+            retry = self.timeout_tuner.should_retry(test, file_result.status)
+            self.timeout_tuner.record(full_timeout, self.shortened_timeout, file_result.status,
+                                      retry)
+            if file_result.status == "EXTERNAL-TIMEOUT":
+                # The browser is restarted, which costs some of the time saved
+                self.tuner_restart_time = time.time()
+            if retry:
+                self.logger.info("%s timed out after %.1fs; rerunning with the full timeout "
+                                 "of %.1fs" % (test.id, self.shortened_timeout, full_timeout))
+                self.retrying = True
+                if file_result.status == "EXTERNAL-TIMEOUT":
+                    return RunnerManagerState.restarting(test,
+                                                         self.state.test_group,
+                                                         self.state.group_metadata)
+                return RunnerManagerState.running(test,
+                                                  self.state.test_group,
+                                                  self.state.group_metadata)
+        self.retrying = False
+
         # Write the result of each subtest
-        file_result, test_results = results
         subtest_unexpected = False
         for result in test_results:
             if test.disabled(result.name):
@@ -590,6 +852,7 @@ class TestRunnerManager(threading.Thread):
                                     expected=expected,
                                     known_intermittent=known_intermittent,
                                     stack=result.stack)
+        self.timer.add("log", time.time() - log_start)
 
         # We have a couple of status codes that are used internally, but not exposed to the
         # user. These are used to indicate that some possibly-broken state was reached
@@ -621,6 +884,8 @@ class TestRunnerManager(threading.Thread):
                                             test.max_assertion_count)
 
         file_result.extra["test_timeout"] = test.timeout * self.executor_kwargs['timeout_multiplier']
+        self.timer.update(file_result.extra.get(timing_key, {}))
+        file_result.extra[timing_key] = self.timer.pop()
 
         self.logger.test_end(test.id,
                              status,
@@ -630,8 +895,9 @@ class TestRunnerManager(threading.Thread):
                              extra=file_result.extra,
                              stack=file_result.stack)
 
-        restart_before_next = (test.restart_after or
-                               file_result.status in ("CRASH", "EXTERNAL-TIMEOUT", "INTERNAL-ERROR") or
+        broken = (status == "CRASH" or
+                  file_result.status in ("CRASH", "EXTERNAL-TIMEOUT", "INTERNAL-ERROR"))
+        restart_before_next = (test.restart_after or broken or
                                ((subtest_unexpected or is_unexpected) and
                                 self.restart_on_unexpected))
 
@@ -641,7 +907,7 @@ class TestRunnerManager(threading.Thread):
             self.logger.info("Pausing until the browser exits")
             self.send_message("wait")
         else:
-            return self.after_test_end(test, restart_before_next)
+            return self.after_test_end(test, restart_before_next, clean=not broken)
 
     def wait_finished(self):
         assert isinstance(self.state, RunnerManagerState.running)
@@ -651,15 +917,30 @@ class TestRunnerManager(threading.Thread):
         # post-stop processing
         return self.after_test_end(self.state.test, True)
 
-    def after_test_end(self, test, restart):
+    def after_test_end(self, test, restart, clean=False):
+        """Get the state after a test has ended.
+
+        :param restart: Whether to restart the browser before the next test
+        :param clean: Whether the test left the browser in a usable state, so
+                      that its WebDriver server can be reused after a restart
+        """
         assert isinstance(self.state, RunnerManagerState.running)
+        self.clean_restart = restart and clean
+        if self.run_count < self.rerun and self.adaptive_repeat is not None:
+            if self.adaptive_repeat.stop_rerun(test.id):
+                self.logger.info("Not rerunning %s after %i of %i runs" %
+                                 (test.id, self.run_count, self.rerun))
+                self.run_count = self.rerun
         if self.run_count == self.rerun:
             test, test_group, group_metadata = self.get_next_test()
             if test is None:
                 return RunnerManagerState.stop()
-            if test_group != self.state.test_group:
-                # We are starting a new group of tests, so force a restart
+            if group_metadata is not self.state.group_metadata:
+                # We are starting a new group of tests, so force a restart.
+                # Groups sharing metadata are parts of a single group that
+                # were queued separately while the tests were being loaded.
                 restart = True
+                self.browser.prepare_group(group_metadata)
         else:
             test_group = self.state.test_group
             group_metadata = self.state.group_metadata
@@ -671,7 +952,8 @@ class TestRunnerManager(threading.Thread):
     def restart_runner(self):
         """Stop and restart the TestRunner"""
         assert isinstance(self.state, RunnerManagerState.restarting)
-        self.stop_runner()
+        self.stop_runner(retire_server=not self.clean_restart)
+        self.clean_restart = False
         return RunnerManagerState.initializing(self.state.test, self.state.test_group, self.state.group_metadata, 0)
 
     def log(self, action, kwargs):
@@ -681,31 +963,46 @@ class TestRunnerManager(threading.Thread):
         self.logger.error(message)
         self.restart_runner()
 
-    def stop_runner(self, force=False):
-        """Stop the TestRunner and the browser binary."""
+    def stop_runner(self, force=False, retire_server=False):
+        """Stop the TestRunner and the browser binary.
+
+        :param force: Stop the browser forcibly
+        :param retire_server: Don't reuse a pooled WebDriver server, because
+                              the browser may have been left in a broken state
+        """
         if self.test_runner_proc is None:
             return
 
         if self.test_runner_proc.is_alive():
             self.send_message("stop")
+        # The runner ends its WebDriver session as it stops, so a pooled
+        # server is only released for reuse once the runner has stopped
+        server_pool = active_pool()
+        if server_pool is not None:
+            server_pool.hold_detached()
+        runner_stopped = False
         try:
             self.browser.stop(force=force)
-            self.ensure_runner_stopped()
+            runner_stopped = self.ensure_runner_stopped()
         finally:
+            if server_pool is not None:
+                server_pool.release_held(force=force or retire_server or not runner_stopped)
             self.cleanup()
 
     def teardown(self):
         self.logger.debug("TestRunnerManager teardown")
         self.test_runner_proc = None
-        self.command_queue.close()
-        self.remote_queue.close()
-        self.command_queue = None
-        self.remote_queue = None
+        self.channel.close()
+        self.channel = None
 
     def ensure_runner_stopped(self):
+        """Wait for the runner process to end, and terminate it if it doesn't.
+
+        :returns: Boolean indicating whether the process ended by itself
+        """
         self.logger.debug("ensure_runner_stopped")
         if self.test_runner_proc is None:
-            return
+            return True
 
         self.logger.debug("waiting for runner process to end")
         self.test_runner_proc.join(10)
@@ -715,24 +1012,23 @@ class TestRunnerManager(threading.Thread):
             self.logger.warning("Forcibly terminating runner process")
             self.test_runner_proc.terminate()
 
-            # Multiprocessing queues are backed by operating system pipes. If
-            # the pipe in the child process had buffered data at the time of
-            # forced termination, the queue is no longer in a usable state
-            # (subsequent attempts to retrieve items may block indefinitely).
-            # Discard the potentially-corrupted queue and create a new one.
-            self.command_queue.close()
-            self.command_queue = Queue()
-            self.remote_queue.close()
-            self.remote_queue = Queue()
-        else:
-            self.logger.debug("Runner process exited with code %i" % self.test_runner_proc.exitcode)
+            # If the child process was part way through writing a message at
+            # the time of forced termination, the pipe is no longer in a usable
+            # state, so discard it. A new pipe is created for the next runner.
+            self.channel.close_remote()
+            return False
+        self.logger.debug("Runner process exited with code %i" % self.test_runner_proc.exitcode)
+        return True
 
     def runner_teardown(self):
         self.ensure_runner_stopped()
         return RunnerManagerState.stop()
 
     def send_message(self, command, *args):
-        self.remote_queue.put((command, args))
+        try:
+            self.channel.send((command, args))
+        except (IOError, OSError):
+            self.logger.warning("Failed to send command %s to runner process" % command)
 
     def cleanup(self):
         self.logger.debug("TestRunnerManager cleanup")
@@ -740,7 +1036,7 @@ class TestRunnerManager(threading.Thread):
             self.browser.cleanup()
         while True:
             try:
-                cmd, data = self.command_queue.get_nowait()
+                cmd, data = self.channel.get_nowait()
             except Empty:
                 break
             else:
@@ -752,27 +1048,18 @@ class TestRunnerManager(threading.Thread):
                     # to stop the TestRunner in `stop_runner`.
                     pass
                 else:
-                    self.logger.warning("Command left in command_queue during cleanup: %r, %r" % (cmd, data))
-        while True:
-            try:
-                cmd, data = self.remote_queue.get_nowait()
-                self.logger.warning("Command left in remote_queue during cleanup: %r, %r" % (cmd, data))
-            except Empty:
-                break
+                    self.logger.warning("Command left in channel during cleanup: %r, %r" % (cmd, data))
 
 
 def make_test_queue(tests, test_source_cls, **test_source_kwargs):
-    queue = test_source_cls.make_queue(tests, **test_source_kwargs)
-
-    # There is a race condition that means sometimes we continue
-    # before the tests have been written to the underlying pipe.
-    # Polling the pipe for data here avoids that
-    queue._reader.poll(10)
-    assert not queue.empty()
-    return queue
+    return test_source_cls.make_queue(tests, **test_source_kwargs)
 
 
 class ManagerGroup(object):
+    # Number of tests in each group when tests are added to the queue while
+    # they are still being loaded and the test source doesn't define groups
+    stream_batch_size = 100
+
     def __init__(self, suite_name, size, test_source_cls, test_source_kwargs,
                  browser_cls, browser_kwargs,
                  executor_cls, executor_kwargs,
@@ -781,8 +1068,26 @@ class ManagerGroup(object):
                  pause_on_unexpected=False,
                  restart_on_unexpected=True,
                  debug_info=None,
-                 capture_stdio=True):
-        """Main thread object that owns all the TestRunnerManager threads."""
+                 capture_stdio=True,
+                 prewarm_browser=False,
+                 pool_webdriver_servers=False,
+                 harness_profiler=None,
+                 adaptive_repeat=None,
+                 timeout_tuner=None):
+        """Main thread object that owns all the TestRunnerManager threads.
+
+        :param pool_webdriver_servers: Reuse WebDriver server processes across
+                                       browser restarts, and share them
+                                       between managers where the server
+                                       supports several sessions.
+        :param harness_profiler: HarnessProfiler used to profile each
+                                 TestRunnerManager thread and TestRunner
+                                 process, or None.
+        :param adaptive_repeat: stability.AdaptiveRepeat used to decide whether
+                                to stop rerunning a test, or None.
+        :param timeout_tuner: timeouts.TimeoutTuner used to choose shorter
+                              timeouts for tests, or None.
+        """
         self.suite_name = suite_name
         self.size = size
         self.test_source_cls = test_source_cls
@@ -797,18 +1102,31 @@ class ManagerGroup(object):
         self.debug_info = debug_info
         self.rerun = rerun
         self.capture_stdio = capture_stdio
+        self.prewarm_browser = prewarm_browser
+        self.pool_webdriver_servers = pool_webdriver_servers
+        self.server_pool = None
+        self.harness_profiler = harness_profiler
+        self.adaptive_repeat = adaptive_repeat
+        self.timeout_tuner = timeout_tuner
 
         self.pool = set()
         # Event that is polled by threads so that they can gracefully exit in the face
         # of sigint
         self.stop_flag = threading.Event()
+        self.fill_thread = None
+        self.fill_error = None
         self.logger = structuredlog.StructuredLogger(suite_name)
 
     def __enter__(self):
+        if self.pool_webdriver_servers:
+            self.server_pool = WebDriverServerPool(self.logger).__enter__()
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.stop()
+        if self.server_pool is not None:
+            self.server_pool.__exit__(exc_type, exc_val, exc_tb)
+            self.server_pool = None
 
     def run(self, test_type, tests):
         """Start all managers in the group"""
@@ -818,7 +1136,17 @@ class ManagerGroup(object):
             self.logger.info("No %s tests to run" % test_type)
             return
 
-        test_queue = make_test_queue(type_tests, self.test_source_cls, **self.test_source_kwargs)
+        if isinstance(type_tests, list):
+            test_queue = make_test_queue(type_tests, self.test_source_cls, **self.test_source_kwargs)
+        else:
+            # The tests are still being loaded, so fill the queue in the
+            # background and start running groups as soon as they are ready
+            test_queue = multiprocessing.Queue()
+            self.fill_thread = threading.Thread(name="TestQueueFiller",
+                                                target=self.fill_queue,
+                                                args=(test_queue, type_tests))
+            self.fill_thread.daemon = True
+            self.fill_thread.start()
 
         for _ in range(self.size):
             manager = TestRunnerManager(self.suite_name,
@@ -834,15 +1162,45 @@ class ManagerGroup(object):
                                         self.pause_on_unexpected,
                                         self.restart_on_unexpected,
                                         self.debug_info,
-                                        self.capture_stdio)
+                                        self.capture_stdio,
+                                        self.prewarm_browser,
+                                        self.harness_profiler,
+                                        self.adaptive_repeat,
+                                        self.timeout_tuner)
             manager.start()
             self.pool.add(manager)
         self.wait()
 
+    def fill_queue(self, test_queue, tests):
+        """Add tests to test_queue as they are loaded"""
+        test_source_kwargs = self.test_source_kwargs.copy()
+        test_source_kwargs["batch_size"] = self.stream_batch_size
+        try:
+            self.test_source_cls.fill_queue(test_queue,
+                                            self.iter_until_stopped(tests),
+                                            **test_source_kwargs)
+        except Exception:
+            self.fill_error = sys.exc_info()
+            self.logger.critical("Loading tests failed:\n%s" % traceback.format_exc())
+            self.stop_flag.set()
+            test_queue.put(None)
+
+    def iter_until_stopped(self, tests):
+        for test in tests:
+            if self.stop_flag.is_set():
+                break
+            yield test
+
     def wait(self):
         """Wait for all the managers in the group to finish"""
         for manager in self.pool:
             manager.join()
+        if self.fill_thread is not None:
+            self.fill_thread.join()
+            self.fill_thread = None
+        if self.fill_error is not None:
+            error, self.fill_error = self.fill_error, None
+            six.reraise(*error)
 
     def stop(self):
         """Set the stop flag so that all managers in the group stop as soon
@@ -855,3 +1213,22 @@ class ManagerGroup(object):
 
     def unexpected_count(self):
         return sum(manager.unexpected_count for manager in self.pool)
+
+    def prewarm_stats(self):
+        """Return a (hits, misses, seconds saved) tuple for standby browsers
+        across all managers in the group"""
+        hits = misses = time_saved = 0
+        for manager in self.pool:
+            if manager.browser is not None:
+                hits += manager.browser.prewarm_hits
+                misses += manager.browser.prewarm_misses
+                time_saved += manager.browser.prewarm_time_saved
+        return hits, misses, time_saved
+
+    def server_pool_stats(self):
+        """Return a (servers started, servers reused, seconds saved) tuple
+        for the WebDriver server pool"""
+        if self.server_pool is None:
+            return 0, 0, 0
+        return (self.server_pool.started, self.server_pool.reused,
+                self.server_pool.time_saved)
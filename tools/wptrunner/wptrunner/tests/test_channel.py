@@ -0,0 +1,42 @@
+import pytest
+from six.moves.queue import Empty
+
+from ..channel import Channel, ManagerChannel
+
+
+def test_manager_channel_roundtrip():
+    channel = ManagerChannel()
+    runner = Channel(channel.connect())
+
+    channel.send(("run_test", ()))
+    assert runner.get(True, 1) == ("run_test", ())
+
+    runner.put(("test_ended", ("/a.html", None)))
+    channel.put(("init_failed", ()))
+    messages = [channel.get(True, 1), channel.get(True, 1)]
+    assert ("test_ended", ("/a.html", None)) in messages
+    assert ("init_failed", ()) in messages
+
+    assert channel.empty()
+    with pytest.raises(Empty):
+        channel.get_nowait()
+
+    runner.close()
+    channel.close()
+
+
+def test_manager_channel_runner_closed():
+    channel = ManagerChannel()
+    runner = Channel(channel.connect())
+    runner.put(("log", ()))
+    runner.close()
+
+    # Messages written before the runner end was closed are still delivered
+    assert channel.get(True, 1) == ("log", ())
+    with pytest.raises(Empty):
+        channel.get(True, 1)
+    assert channel.remote is None
+
+    with pytest.raises(IOError):
+        channel.send(("stop", ()))
+    channel.close()
@@ -0,0 +1,104 @@
+import mock
+
+# Importing environment puts the wpt tools, including webdriver, on sys.path
+from .. import environment  # noqa: F401
+from .. import wpttest
+from ..executors import executorwebdriver
+from .test_resultchannel import post, stash
+
+
+class MockResponse(object):
+    def __init__(self, value):
+        self.status = 200
+        self.body = {"value": value}
+
+
+class MockTransport(object):
+    def __init__(self):
+        self.commands = []
+        self.handles = ["runner"]
+
+    def send(self, method, url, body=None, **kwargs):
+        self.commands.append((method, url))
+        if url.endswith("execute/sync") and "__wptrunner_channel_url" in body["script"]:
+            # The test page posts its result to the channel
+            script = body["script"]
+            test_url = script.split('__wptrunner_url = "', 1)[1].split('"', 1)[0]
+            channel_url = script.split('__wptrunner_channel_url = "', 1)[1].split('"', 1)[0]
+            post(channel_url, [test_url, "complete",
+                               [0, None, None, [["subtest", 0, None, None]]]])
+            return MockResponse(None)
+        if url.endswith("execute/async"):
+            test_url = body["script"].split('var result_url = "', 1)[1].split('"', 1)[0]
+            return MockResponse([test_url, "complete",
+                                 [0, None, None, [["subtest", 0, None, None]]]])
+        if url.endswith("execute/sync") and "window.open(" in body["script"]:
+            self.handles = ["runner", "test"]
+        if url.endswith("window") and method == "DELETE":
+            self.handles = ["runner"]
+        if url.endswith("window/handles"):
+            return MockResponse(self.handles)
+        return MockResponse(None)
+
+
+def make_executor(**kwargs):
+    browser = mock.Mock(webdriver_url="http://127.0.0.1:4444")
+    server_config = {"browser_host": "web-platform.test",
+                     "ports": {"http": [8000]}}
+    executor = executorwebdriver.WebDriverTestharnessExecutor(browser, server_config,
+                                                              **kwargs)
+    executor.runner = mock.Mock()
+    session = executorwebdriver.CountingSession("127.0.0.1", 4444)
+    session.session_id = "1"
+    session.transport = MockTransport()
+    executor.protocol.webdriver = session
+    executor.protocol.base.setup()
+    executor.protocol.testharness.setup()
+    executor.protocol.testharness.runner_handle = "runner"
+    return executor, session.transport
+
+
+def test_reuse_window_command_count():
+    executor, transport = make_executor(reuse_window=True)
+    tests = [wpttest.TestharnessTest("/", "/a/%i.html" % i, [], None) for i in range(3)]
+
+    results = [executor.do_test(test) for test in tests]
+
+    assert [harness.status for harness, _ in results] == ["OK", "OK", "OK"]
+    assert [subtests[0].status for _, subtests in results] == ["PASS", "PASS", "PASS"]
+    # After the first test, the script timeout is unchanged and the test window
+    # is reused, so each test is a single command
+    assert [harness.extra["webdriver_commands"] for harness, _ in results][1:] == [1, 1]
+    assert [url for _, url in transport.commands[-2:]] == ["session/1/execute/async",
+                                                          "session/1/execute/async"]
+
+
+def test_result_channel():
+    executor, transport = make_executor(result_channel=True)
+    executor.result_channel.stash = stash
+    tests = [wpttest.TestharnessTest("/", "/a/%i.html" % i, [], None) for i in range(2)]
+
+    try:
+        results = [executor.do_test(test) for test in tests]
+    finally:
+        executor.result_channel.close()
+
+    assert [harness.status for harness, _ in results] == ["OK", "OK"]
+    assert [subtests[0].status for _, subtests in results] == ["PASS", "PASS"]
+    # The result is posted by the page, so no async script is needed, and
+    # every test is run on the same thread
+    assert not any(url.endswith("execute/async") for _, url in transport.commands)
+    assert executor.run_thread is not None and not executor.run_thread.busy
+
+
+def test_phase_timings():
+    executor, transport = make_executor()
+    test = wpttest.TestharnessTest("/", "/a/0.html", [], None)
+
+    executor.run_test(test)
+
+    (command, test_id, results), _ = executor.runner.send_message.call_args
+    assert (command, test_id) == ("test_ended", test.id)
+    timings = results[0][3]["phase_timings"]
+    assert set(timings) == {"setup", "navigation", "script"}
+    assert all(value >= 0 for value in timings.values())
@@ -1,4 +1,7 @@
+import itertools
+import random
 import sys
+from math import log
 
 import pytest
 
@@ -130,3 +133,121 @@ def test_build_tree_4():
 
     assert tree.result_values["PASS"] == 2
     assert tree.result_values["FAIL"] == 1
+
+
+def reference_entropy(results):
+    """entropy as it was before build_tree used ResultColumns"""
+    result_counts = defaultdict(int)
+    total = float(len(results))
+    for values in results.itervalues():
+        for value in values:
+            result_counts[value] += 1
+
+    entropy_sum = 0
+
+    for count in result_counts.itervalues():
+        prop = float(count) / total
+        entropy_sum -= prop * log(prop, 2)
+
+    return entropy_sum
+
+
+def reference_build_tree(properties, dependent_props, results, tree=None):
+    """build_tree as it was before it used ResultColumns, splitting the
+    results dictionary directly, to check the output of build_tree against"""
+    if tree is None:
+        tree = expectedtree.Node(None, None)
+
+    prop_index = {prop: i for i, prop in enumerate(properties)}
+
+    all_results = defaultdict(int)
+    for result_values in results.itervalues():
+        for result_value, count in result_values.iteritems():
+            all_results[result_value] += count
+
+    if not properties or len(all_results) == 1:
+        for value, count in all_results.iteritems():
+            tree.result_values[value] += count
+        tree.run_info |= set(results.keys())
+        return tree
+
+    results_partitions = []
+    remove_properties = set()
+    for prop in properties:
+        result_sets = expectedtree.split_results(prop, results)
+        if len(result_sets) == 1:
+            remove_properties.add(prop)
+            continue
+        new_entropy = 0.
+        results_sets_entropy = []
+        for prop_value, result_set in result_sets.iteritems():
+            results_sets_entropy.append((reference_entropy(result_set), prop_value, result_set))
+            new_entropy += (float(len(result_set)) / len(results)) * results_sets_entropy[-1][0]
+
+        results_partitions.append((new_entropy,
+                                   prop,
+                                   results_sets_entropy))
+
+    if not results_partitions:
+        for value, count in all_results.iteritems():
+            tree.result_values[value] += count
+        tree.run_info |= set(results.keys())
+        return tree
+
+    results_partitions.sort(key=lambda x: (x[0], prop_index[x[1]]))
+    _, best_prop, sub_results = results_partitions[0]
+
+    new_props = properties[:prop_index[best_prop]] + properties[prop_index[best_prop] + 1:]
+    new_props.extend(dependent_props.get(best_prop, []))
+    if remove_properties:
+        new_props = [item for item in new_props if item not in remove_properties]
+
+    for _, prop_value, results_sets in sub_results:
+        node = expectedtree.Node(best_prop, prop_value)
+        tree.add(node)
+        reference_build_tree(new_props, dependent_props, results_sets, node)
+    return tree
+
+
+def dump_full_tree(tree):
+    """Canonical representation of a tree, including the run_infos and
+    result counts of each leaf"""
+    return (tree.prop, tree.value,
+            sorted(tree.result_values.items()),
+            sorted(run_info.canonical_repr for run_info in tree.run_info),
+            sorted(dump_full_tree(child) for child in tree.children))
+
+
+@pytest.mark.xfail(sys.version[0] == "3",
+                   reason="metadata doesn't support py3")
+def test_build_tree_matches_reference():
+    rand = random.Random(0)
+    configs = [{"os": os_name, "version": version, "debug": debug, "processor": processor,
+                "fission": fission}
+               for (os_name, versions) in [("linux", ["16.04", "18.04"]),
+                                           ("mac", ["10.14", "10.15"]),
+                                           ("win", ["7", "10"]),
+                                           ("android", ["7.0"])]
+               for version in versions
+               for debug, processor, fission in itertools.product([True, False],
+                                                                  ["x86", "x86_64"],
+                                                                  [True, False])]
+    statuses = ["PASS", "FAIL", "TIMEOUT", "CRASH"]
+    properties = ["os", "debug", "processor", "fission"]
+    dependent_props = {"os": ["version"]}
+
+    for _ in range(200):
+        results = []
+        failing = {prop: rand.choice([config[prop] for config in configs])
+                   for prop in rand.sample(properties, rand.randint(1, 2))}
+        for config in rand.sample(configs, rand.randint(1, len(configs))):
+            matches = all(config[prop] == value for prop, value in failing.iteritems())
+            for _ in range(rand.randint(1, 3)):
+                if rand.random() < 0.1:
+                    status = rand.choice(statuses)
+                else:
+                    status = "FAIL" if matches else "PASS"
+                results.append((config, status))
+        expected = reference_build_tree(properties, dependent_props, results_object(results))
+        actual = expectedtree.build_tree(properties, dependent_props, results_object(results))
+        assert dump_full_tree(actual) == dump_full_tree(expected)
@@ -1,11 +1,16 @@
+import gzip
 import json
+import sys
 import time
+from io import BytesIO
 from six.moves import cStringIO as StringIO
 
 import mock
+import pytest
 
 from mozlog import handlers, structuredlog
 
+from .. import wptlogging
 from ..formatters import wptreport
 from ..formatters.wptreport import WptreportFormatter
 
@@ -166,3 +171,132 @@ def test_wptreport_known_intermittent(capfd):
     subtest = test["subtests"][0]
     assert subtest["expected"] == u"PASS"
     assert subtest["known_intermittent"] == [u'FAIL']
+
+
+def test_wptreport_incremental(capfd):
+    output = StringIO()
+    formatter = WptreportFormatter()
+    logger = structuredlog.StructuredLogger("test_a")
+    logger.add_handler(handlers.StreamHandler(output, formatter))
+
+    logger.suite_start(["test-id-1", "test-id-2", "test-id-3"], run_info={"os": "linux"})
+    logger.test_start("test-id-1")
+    logger.test_status("test-id-1", "a-subtest", status="PASS")
+    logger.test_end("test-id-1", status="OK")
+
+    # The entry is written as soon as the test ends, and isn't kept
+    assert '"test": "test-id-1"' in output.getvalue()
+    assert formatter.raw_results == {}
+
+    logger.test_start("test-id-2")
+    logger.test_end("test-id-2", status="FAIL")
+    logger.test_start("test-id-3")
+    logger.lsan_leak(["frame"], scope="test-id-3")
+    logger.suite_end()
+
+    captured = capfd.readouterr()
+    assert captured.out == ""
+    assert captured.err == ""
+
+    output_obj = json.loads(output.getvalue())
+    assert output_obj["run_info"] == {"os": "linux"}
+    assert "time_start" in output_obj
+    assert "time_end" in output_obj
+    assert [(item["test"], item["status"]) for item in output_obj["results"]] == [
+        ("test-id-1", "OK"), ("test-id-2", "FAIL"), ("test-id-3", "")]
+    assert output_obj["results"][0]["subtests"][0]["name"] == "a-subtest"
+    assert output_obj["lsan_leaks"][0]["frames"] == ["frame"]
+
+
+def test_wptreport_rerun(capfd):
+    output = StringIO()
+    formatter = WptreportFormatter()
+    logger = structuredlog.StructuredLogger("test_a")
+    logger.add_handler(handlers.StreamHandler(output, formatter))
+
+    logger.suite_start(["test-id-1", "test-id-2"], extra={"rerun": 2})
+    for status in ["PASS", "FAIL"]:
+        logger.test_start("test-id-1")
+        logger.test_status("test-id-1", "a-subtest", status=status)
+        logger.test_end("test-id-1", status="OK")
+        logger.test_start("test-id-2")
+        logger.test_end("test-id-2", status=status)
+    logger.suite_end()
+
+    captured = capfd.readouterr()
+    assert captured.out == ""
+    assert captured.err == ""
+
+    # Each test has a single entry with the results of all its runs
+    output_obj = json.loads(output.getvalue())
+    assert sorted((item["test"], item["status"]) for item in output_obj["results"]) == [
+        ("test-id-1", "OK"), ("test-id-2", "FAIL")]
+    test = [item for item in output_obj["results"] if item["test"] == "test-id-1"][0]
+    assert [subtest["status"] for subtest in test["subtests"]] == ["PASS", "FAIL"]
+
+
+def test_wptreport_compress(capfd):
+    output = BytesIO()
+    formatter = WptreportFormatter()
+    formatter.compress = True
+    logger = structuredlog.StructuredLogger("test_a")
+    logger.add_handler(handlers.StreamHandler(output, formatter))
+
+    for i in range(2):
+        logger.suite_start(["test-id-1"])
+        logger.test_start("test-id-1")
+        logger.test_end("test-id-1", status="PASS")
+        logger.suite_end()
+
+    captured = capfd.readouterr()
+    assert captured.out == ""
+    assert captured.err == ""
+
+    # Each suite is a separate gzip member, so the file decompresses to the
+    # concatenated reports
+    data = gzip.GzipFile(fileobj=BytesIO(output.getvalue())).read().decode("utf-8")
+    decoder = json.JSONDecoder()
+    first, end = decoder.raw_decode(data)
+    second, _ = decoder.raw_decode(data, end)
+    assert first["results"][0]["status"] == "PASS"
+    assert second["results"][0]["test"] == "test-id-1"
+
+
+def test_wptreport_compress_file(tmpdir):
+    # Log files are opened in text mode, so the compressed output has to be
+    # written to the file in binary mode
+    path = str(tmpdir.join("report.json.gz"))
+    formatter = WptreportFormatter()
+    formatter.compress = True
+    logger = structuredlog.StructuredLogger("test_compress_file")
+    handler = handlers.StreamHandler(open(path, "w"), formatter)
+    logger.add_handler(handler)
+    wptlogging.use_binary_streams(logger)
+    assert "b" in handler.stream.mode
+
+    logger.suite_start(["test-id-1"], run_info={})
+    logger.test_start("test-id-1")
+    logger.test_status("test-id-1", "subtest\n1", status="FAIL", message="a\r\nb")
+    logger.test_end("test-id-1", status="OK")
+    logger.suite_end()
+    handler.stream.close()
+    logger.remove_handler(handler)
+
+    with gzip.open(path, "rb") as f:
+        output = json.loads(f.read().decode("utf-8"))
+    subtest = output["results"][0]["subtests"][0]
+    assert (subtest["name"], subtest["message"]) == ("subtest\n1", "a\r\nb")
+
+
+def test_binary_output_text_stream(monkeypatch):
+    formatter = WptreportFormatter()
+    formatter.compress = True
+    logger = structuredlog.StructuredLogger("test_binary_text_stream")
+    stream = mock.Mock(spec=["write", "flush"], mode="w")
+    stream.name = "<stdout>"
+    logger.add_handler(handlers.StreamHandler(stream, formatter))
+    # Streams that can't be reopened in binary mode are only usable where
+    # text mode doesn't translate newlines
+    monkeypatch.setattr(sys, "platform", "win32")
+    with pytest.raises(ValueError):
+        wptlogging.use_binary_streams(logger)
@@ -0,0 +1,62 @@
+import random
+
+import pytest
+
+from .. import imagecompare
+from ..imagecompare import ImageComparator, decode_png, encode_png
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def make_png(size, pixels):
+    image = Image.new("RGB", size, (255, 255, 255))
+    for position, color in pixels.items():
+        image.putpixel(position, color)
+    return encode_png(image)
+
+
+def random_pair(rng, size=(40, 30)):
+    pixels = {}
+    for _ in range(rng.randrange(0, 50)):
+        position = (rng.randrange(size[0]), rng.randrange(size[1]))
+        pixels[position] = (255 - rng.choice([0, 1, 2, 128, 255]),
+                            255 - rng.choice([0, 1, 2, 128, 255]),
+                            255 - rng.choice([0, 1, 2, 128, 255]))
+    return make_png(size, {}), make_png(size, pixels)
+
+
+def test_get_differences_matches_pil():
+    pytest.importorskip("numpy")
+    rng = random.Random(0)
+    comparator = ImageComparator()
+    for i in range(50):
+        screenshots = random_pair(rng)
+        expected = comparator._get_differences_pil(screenshots, False)
+        assert comparator.get_differences(screenshots) == expected
+
+
+def test_get_differences_pil_fallback(monkeypatch):
+    monkeypatch.setattr(imagecompare, "np", None)
+    screenshots = (make_png((10, 10), {}),
+                   make_png((10, 10), {(1, 1): (250, 255, 255), (2, 2): (0, 0, 0)}))
+    per_channel, count, mask = ImageComparator().get_differences(screenshots, mask=True)
+    assert (per_channel, count) == (255, 2)
+    assert decode_png(mask).getpixel((1, 1)) == (255, 255, 255)
+
+
+def test_get_differences_cache():
+    pytest.importorskip("numpy")
+    comparator = ImageComparator(max_cached=2)
+    ref = make_png((10, 10), {})
+    test = make_png((10, 12), {(3, 4): (255, 0, 255), (2, 2): (254, 255, 255),
+                               (0, 11): (0, 0, 0)})
+    per_channel, count, mask = comparator.get_differences((test, ref), ("test", "ref"), mask=True)
+    # Only the overlapping region is compared, and a difference of 1 in only
+    # the red channel isn't counted
+    assert (per_channel, count) == (255, 1)
+    assert decode_png(mask).getpixel((3, 4)) == (255, 255, 255)
+    assert decode_png(mask).getpixel((0, 0)) == (0, 0, 0)
+    assert list(comparator.cache.keys()) == ["test", "ref"]
+
+    comparator.get_differences((make_png((10, 10), {}), ref), ("other", "ref"))
+    assert list(comparator.cache.keys()) == ["other", "ref"]
@@ -1,3 +1,4 @@
+import os
 import sys
 from io import BytesIO
 
@@ -35,3 +36,47 @@ def test_fuzzy(fuzzy, expected):
                                                test_path="test/test.html",
                                                url_base="/")
     assert manifest.get_test("/test/test.html").fuzzy == expected
+
+
+@pytest.mark.xfail(sys.version[0] == "3",
+                   reason="bytes/text confusion in py3")
+def test_compiled_manifest_cache(tmpdir):
+    metadata_root = tmpdir.mkdir("meta")
+    metadata_root.mkdir("test").join("test.html.ini").write(b"""
+[test.html]
+  expected:
+    if os == "linux": FAIL
+    ERROR
+""")
+    cache_root = str(tmpdir.join("cache"))
+
+    def get_expected(run_info):
+        cache = manifestexpected.CompiledManifestCache(cache_root, run_info)
+        manifest = manifestexpected.get_manifest(str(metadata_root), "test/test.html", "/",
+                                                 run_info, cache=cache)
+        return manifest.get_test("/test/test.html").expected, cache.hits
+
+    assert get_expected({"os": "linux"}) == ("FAIL", 0)
+    assert get_expected({"os": "linux"}) == ("FAIL", 1)
+    # Different run_info values get separate entries
+    assert get_expected({"os": "win"}) == ("ERROR", 0)
+
+    # Changing the file invalidates the cached data
+    metadata_root.join("test", "test.html.ini").write(b"""
+[test.html]
+  expected: TIMEOUT
+""")
+    assert get_expected({"os": "linux"}) == ("TIMEOUT", 0)
+    assert get_expected({"os": "linux"}) == ("TIMEOUT", 1)
+
+    assert manifestexpected.get_manifest(str(metadata_root), "test/missing.html", "/",
+                                         {}, cache=manifestexpected.CompiledManifestCache(
+                                             cache_root, {})) is None
+    assert os.path.isdir(cache_root)
+
+    # Pruning removes the entries for other run_info values
+    assert len(os.listdir(cache_root)) == 2
+    cache = manifestexpected.CompiledManifestCache(cache_root, {"os": "linux"})
+    cache.prune()
+    assert os.listdir(cache_root) == [cache.key[:16]]
+    assert get_expected({"os": "linux"}) == ("TIMEOUT", 1)
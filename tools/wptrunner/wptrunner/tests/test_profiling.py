@@ -0,0 +1,51 @@
+import os
+import pstats
+import time
+
+from .. import profiling
+
+
+def busy_wait(duration):
+    end_time = time.time() + duration
+    while time.time() < end_time:
+        pass
+
+
+def test_profile(tmpdir):
+    output_dir = os.path.join(str(tmpdir), "profiles")
+    profiler = profiling.HarnessProfiler(output_dir, cprofile=True, interval=0.001)
+
+    with profiling.profile(profiler, "TestRunnerManager-1"):
+        busy_wait(0.1)
+
+    prefix = "profile-TestRunnerManager-1-%i" % os.getpid()
+    assert sorted(os.listdir(output_dir)) == [prefix + ".folded", prefix + ".prof"]
+
+    stats = pstats.Stats(os.path.join(output_dir, prefix + ".prof"))
+    assert any(name == "busy_wait" for _, _, name in stats.stats)
+
+    with open(os.path.join(output_dir, prefix + ".folded")) as f:
+        lines = f.read().splitlines()
+    assert lines
+    for line in lines:
+        stack, count = line.rsplit(" ", 1)
+        assert int(count) > 0
+        # Only the profiled thread is sampled
+        assert stack.startswith("MainThread;")
+    assert any("busy_wait (test_profiling.py:" in line for line in lines)
+
+
+def test_profile_disabled(tmpdir):
+    with profiling.profile(None, "main"):
+        pass
+    assert profiling.from_kwargs({"profile_harness": False}) is None
+    profiler = profiling.from_kwargs({"profile_harness": True,
+                                      "profile_harness_dir": str(tmpdir),
+                                      "profile_harness_cprofile": False})
+    assert profiler.output_dir == str(tmpdir)
+    assert not profiler.cprofile
+
+    # Without cProfile, only the sampled stacks are written
+    with profiling.profile(profiler, "main"):
+        busy_wait(0.05)
+    assert os.listdir(str(tmpdir)) == ["profile-main-%i.folded" % os.getpid()]
@@ -0,0 +1,47 @@
+import mock
+
+from ..executors.pytestrunner import PytestWorker
+
+
+test_file = """
+import time
+
+def test_pass():
+    pass
+
+def test_fail():
+    assert 1 == 2
+
+def test_sleep():
+    time.sleep(float(%s))
+"""
+
+
+def test_worker(tmpdir):
+    quick = tmpdir.join("test_quick.py")
+    quick.write(test_file % "0")
+    slow = tmpdir.join("test_slow.py")
+    slow.write(test_file % "60")
+
+    worker = PytestWorker(mock.Mock(), {})
+    try:
+        success, (harness, subtests) = worker.run(str(quick), 60)
+        assert success
+        assert harness == ["OK", None]
+        assert [item[:2] for item in subtests] == [["test_pass", "PASS"],
+                                                   ["test_fail", "FAIL"],
+                                                   ["test_sleep", "PASS"]]
+        pid = worker.proc.pid
+
+        # Later files are run by the same process
+        assert worker.run(str(quick), 60)[0]
+        assert worker.proc.pid == pid
+
+        # A file that times out stops the worker, and the next file starts a
+        # new one
+        assert worker.run(str(slow), 2) == (False, ("EXTERNAL-TIMEOUT", None))
+        assert worker.proc is None
+        assert worker.run(str(quick), 60)[0]
+        assert worker.proc.pid != pid
+    finally:
+        worker.stop()
@@ -0,0 +1,99 @@
+import json
+import socket
+import threading
+import uuid
+
+import mock
+import pytest
+from six.moves.urllib.parse import parse_qs, urlsplit
+
+# Importing environment puts wptserve on sys.path
+from .. import environment  # noqa: F401
+from ..resultchannel import ResultChannel, ResultChannelTimeout, channel_path, forward_message
+
+from wptserve.stash import Stash  # noqa: E402
+
+# Stash shared by the channels and the handler, in place of the one owned by
+# the test environment
+stash = Stash(channel_path)
+
+
+class MockQuery(object):
+    def __init__(self, query):
+        self.values = parse_qs(query)
+
+    def first(self, key):
+        return self.values[key.decode("ascii")][0].encode("ascii")
+
+
+def post(channel_url, message):
+    parts = urlsplit(channel_url)
+    request = mock.Mock(GET=MockQuery(parts.query),
+                        body=json.dumps(message).encode("utf8"),
+                        server=mock.Mock(stash=stash))
+    return forward_message.func(request, mock.Mock())
+
+
+@pytest.fixture
+def channel():
+    channel = ResultChannel(check_interval=0.1, stash=stash)
+    yield channel
+    channel.close()
+
+
+def test_forward_message(channel):
+    old_url = channel.start()
+    channel_url = channel.start()
+    assert channel_url.startswith("/_wptrunner/message?")
+
+    # Messages posted with a previous token aren't forwarded
+    assert post(old_url, ["/a.html", "complete", []])[0] == 404
+    assert post(channel_url, ["/b.html", "complete", []])[0] == 204
+    assert post(channel_url, ["/b.html", "complete", [1]])[0] == 204
+    assert channel.wait(5) == ["/b.html", "complete", []]
+    assert channel.wait(5) == ["/b.html", "complete", [1]]
+    assert channel.wait(0.01) is None
+
+    assert post("/_wptrunner/message?token=a", [])[0] == 400
+    assert post("/_wptrunner/message?token=%s%%0D%%0AGET" % uuid.uuid4().hex, [])[0] == 400
+
+    channel.close()
+    assert post(channel_url, [])[0] == 404
+
+
+def test_forward_message_unregistered():
+    # Messages are only sent to the ports of registered channels, whatever
+    # the query string says
+    with mock.patch.object(socket, "create_connection") as create_connection:
+        status = post("/_wptrunner/message?port=4444&token=%s" % uuid.uuid4().hex,
+                      ["/a.html", "complete", []])[0]
+    assert status == 404
+    assert not create_connection.called
+
+
+def test_run(channel):
+    channel_url = channel.start()
+    messages = [["/a.html", "action", {"action": "click"}],
+                ["/a.html", "complete", [0, None, None, []]]]
+
+    def handler(message):
+        if message[1] == "complete":
+            return True, message[2]
+        return False, None
+
+    for message in messages:
+        post(channel_url, message)
+    assert channel.run(handler, 5, lambda: True) == [0, None, None, []]
+
+    with pytest.raises(ResultChannelTimeout):
+        channel.run(handler, 0.05, lambda: True)
+
+    # If nothing arrives in check_interval and the browser isn't alive, stop
+    # waiting
+    assert channel.run(handler, 5, lambda: False) is None
+
+    # Messages that arrive while waiting are handled
+    timer = threading.Timer(0.05, post, [channel_url, messages[1]])
+    timer.start()
+    assert channel.run(handler, 5, lambda: True) == [0, None, None, []]
+    timer.join()
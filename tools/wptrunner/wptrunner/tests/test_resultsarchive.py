@@ -0,0 +1,116 @@
+from io import BytesIO
+
+from mozlog import structuredlog, handlers
+
+from .. import resultsarchive
+from ..formatters.resultsarchive import ResultsArchiveFormatter
+
+
+def log_run(results, run_info=None):
+    """Archive chunk for a run, given as a list of (test, status, subtest
+    statuses) tuples"""
+    output = BytesIO()
+    logger = structuredlog.StructuredLogger("test_resultsarchive")
+    logger.add_handler(handlers.StreamHandler(output, ResultsArchiveFormatter()))
+    logger.suite_start([item[0] for item in results], run_info=run_info or {})
+    for test, status, subtests in results:
+        logger.test_start(test)
+        for i, subtest_status in enumerate(subtests):
+            logger.test_status(test, "subtest %i" % i, subtest_status)
+        logger.test_end(test, status)
+    logger.suite_end()
+    return output.getvalue()
+
+
+def make_archive(path):
+    resultsarchive.append_chunk(path, log_run([("/a/b.html", "OK", ["PASS", "FAIL"]),
+                                               ("/a/c.html", "ERROR", []),
+                                               ("/b/a.html", "OK", ["PASS"])],
+                                              {"os": "linux"}))
+    resultsarchive.append_chunk(path, log_run([("/a/b.html", "OK", ["PASS", "PASS"]),
+                                               ("/b/a.html", "TIMEOUT", [])],
+                                              {"os": "win"}))
+    resultsarchive.append_chunk(path, log_run([("/a/c.html", "OK", []),
+                                               ("/ab.html", "OK", [])],
+                                              {"os": "linux"}))
+
+
+def statuses(durations):
+    return {test: [item[:2] for item in results] for test, results in durations.items()}
+
+
+def test_prefix_range():
+    names = ["/a/b.html", "/a/c.html", "/ab.html", "/b/a.html"]
+    assert resultsarchive.prefix_range(names, "/a/") == (0, 2)
+    assert resultsarchive.prefix_range(names, "/a") == (0, 3)
+    assert resultsarchive.prefix_range(names, "/c") == (4, 4)
+    assert resultsarchive.prefix_range(names, "") == (0, 4)
+
+
+def test_query(tmpdir):
+    path = str(tmpdir.join("results.wra"))
+    make_archive(path)
+
+    with open(path, "rb") as f:
+        archive = resultsarchive.ArchiveReader(f)
+        assert len(archive.chunks()) == 3
+        assert [run["run_info"] for run in archive.runs()] == [
+            {"os": "linux"}, {"os": "win"}, {"os": "linux"}]
+
+        assert statuses(archive.durations("/a/")) == {
+            "/a/b.html": [(0, "OK"), (1, "OK")],
+            "/a/c.html": [(0, "ERROR"), (2, "OK")]}
+        assert statuses(archive.durations("/a/", last=2)) == {
+            "/a/b.html": [(0, "OK")],
+            "/a/c.html": [(1, "OK")]}
+        # Only the chunks with the last runs are read
+        assert [chunk.offset for chunk, _ in archive.last_runs(1)] == [
+            archive.chunks()[-1].offset]
+
+        for results in archive.durations().values():
+            for _, _, duration in results:
+                assert duration is not None and duration >= 0
+
+        chunk = archive.chunks()[0]
+        assert [item[4] for item in chunk.results("/a/b", subtests=True)] == [
+            [("subtest 0", "PASS"), ("subtest 1", "FAIL")]]
+
+
+def test_merge(tmpdir):
+    path = str(tmpdir.join("results.wra"))
+    make_archive(path)
+    with open(path, "rb") as f:
+        archive = resultsarchive.ArchiveReader(f)
+        expected_runs = archive.runs()
+        expected = archive.durations()
+        expected_subtests = [list(chunk.results(subtests=True)) for chunk in archive.chunks()]
+
+    resultsarchive.merge([path], path)
+    with open(path, "rb") as f:
+        archive = resultsarchive.ArchiveReader(f)
+        chunks = archive.chunks()
+        assert len(chunks) == 1
+        assert chunks[0].header["run_infos"] == [{"os": "linux"}, {"os": "win"}]
+        assert archive.runs() == expected_runs
+        assert archive.durations() == expected
+        assert statuses(archive.durations("/b", last=2)) == {"/b/a.html": [(0, "TIMEOUT")]}
+        merged_subtests = list(chunks[0].results("/a/b.html", subtests=True))
+        assert [item[4] for item in merged_subtests] == [
+            item[4] for results in expected_subtests
+            for item in results if item[0] == "/a/b.html"]
+
+
+def test_from_wptreport(tmpdir):
+    data = {"run_info": {"os": "mac"},
+            "time_start": 1,
+            "time_end": 2,
+            "results": [{"test": "/a.html", "status": "OK", "duration": 20,
+                         "subtests": [{"name": "sub", "status": "FAIL", "message": None}]},
+                        {"test": "/b.html", "status": "PASS", "subtests": []}]}
+    path = str(tmpdir.join("results.wra"))
+    resultsarchive.append_chunk(path, resultsarchive.from_wptreport(data).to_bytes())
+    with open(path, "rb") as f:
+        archive = resultsarchive.ArchiveReader(f)
+        assert archive.runs() == [{"run_info": {"os": "mac"}, "time_start": 1, "time_end": 2}]
+        assert archive.durations() == {"/a.html": [(0, "OK", 20)],
+                                       "/b.html": [(0, "PASS", None)]}
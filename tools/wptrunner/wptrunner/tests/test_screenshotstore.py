@@ -0,0 +1,197 @@
+import base64
+import os
+import time
+
+from ..executors.base import RefTestImplementation
+from ..screenshotstore import ScreenshotCache, ScreenshotStore
+from ..timing import PhaseTimer
+from ..wpttest import ReftestTest
+
+
+def make_screenshot(i, size=100):
+    return base64.b64encode((b"%03i" % i) * size).decode("ascii")
+
+
+def test_store_roundtrip():
+    with ScreenshotCache() as cache:
+        store = cache.store()
+        key = ("/a.html", None, None)
+        assert store.get_hash(key) is None
+
+        data = make_screenshot(1)
+        hash_value = store.put(data)
+        store.set_hash(key, hash_value)
+        assert store.get_hash(key) == hash_value
+        assert store.get(hash_value) == data
+        assert os.path.exists(store.path(hash_value))
+
+        # Stores created from the same cache have separate indexes but share
+        # the screenshot data
+        other = cache.store()
+        assert other.get_hash(key) is None
+        assert other.put(data) == hash_value
+        assert other.written == 0
+
+        store.clear()
+        assert store.get_hash(key) is None
+        assert store.get(hash_value) == data
+
+        root = cache.root
+    assert not os.path.exists(root)
+
+
+def test_store_evict(tmpdir):
+    with ScreenshotCache(str(tmpdir), max_size=1000) as cache:
+        store = cache.store()
+        hashes = []
+        for i in range(5):
+            hashes.append(store.put(make_screenshot(i)))
+            path = store.path(hashes[-1])
+            os.utime(path, (i, i))
+        store.evict()
+
+        present = [store.get(item) is not None for item in hashes]
+        assert present == [False, False, True, True, True]
+
+
+def test_store_export(tmpdir):
+    with ScreenshotCache(str(tmpdir), max_size=0, log_files=True) as cache:
+        store = cache.store()
+        data = make_screenshot(1)
+        path = store.export(data)
+        hash_value = store.put(data)
+        assert store.get(hash_value) is None
+        with open(path, "rb") as f:
+            assert base64.b64encode(f.read()).decode("ascii") == data
+    assert os.path.exists(path)
+
+
+def test_store_claim(tmpdir):
+    with ScreenshotCache(str(tmpdir)) as cache:
+        store = cache.store()
+        other = ScreenshotStore(store.root, store.namespace)
+        key = ("/ref.html", None, None)
+
+        assert store.claim(key, 10)
+        assert not other.claim(key, 10)
+        store.set_hash(key, "abc")
+        assert other.wait_hash(key, 10) == "abc"
+        store.release_claim(key)
+
+        # A claim older than the timeout is assumed to be stale
+        assert store.claim(key, 10)
+        lock_path = store._index_path(key) + ".lock"
+        os.utime(lock_path, (0, 0))
+        assert other.claim(key, 10)
+        other.release_claim(key)
+        assert other.wait_hash(("/missing.html", None, None), 10) is None
+
+
+def test_store_evict_pinned(tmpdir):
+    with ScreenshotCache(str(tmpdir), max_size=700) as cache:
+        store = cache.store()
+        pinned = store.put(make_screenshot(0))
+        store.pin(pinned)
+        os.utime(store.path(pinned), (0, 0))
+        released = store.put(make_screenshot(1))
+        recent = store.put(make_screenshot(2))
+        store.release(released)
+        store.evict()
+        assert [store.get(item) is not None for item in (pinned, released, recent)] == [
+            True, False, True]
+
+        store.unpin(pinned)
+        assert os.stat(store.path(pinned)).st_mtime == 0
+
+
+class MockRefTestExecutor(object):
+    timeout_multiplier = 1
+    logger = None
+
+    def __init__(self, screenshot_cache, group_metadata):
+        self.screenshot_cache = screenshot_cache
+        self.group_metadata = group_metadata
+        self.screenshots = []
+        self.timer = PhaseTimer()
+
+    def screenshot(self, test, viewport_size, dpi):
+        self.screenshots.append(test.url)
+        data = make_screenshot(1 if "ref" in test.url else 2)
+        return True, data
+
+
+def test_reftest_shared_references(tmpdir):
+    ref = ReftestTest("/", "/ref.html", [], None, [])
+    tests = [ReftestTest("/", "/test%i.html" % i, [], None, [(ref, "!=")])
+             for i in range(3)]
+    # Tests are split between two processes, each with its own group
+    groups = [tests[0::2], tests[1::2]]
+    metadatas = [{}, {}]
+    for group, metadata in zip(groups, metadatas):
+        for test in group:
+            test.update_metadata(metadata)
+
+    with ScreenshotCache(str(tmpdir)) as cache:
+        store = cache.store()
+        executors = [MockRefTestExecutor(store, metadata) for metadata in metadatas]
+        implementations = [RefTestImplementation(executor) for executor in executors]
+
+        assert implementations[0].run_test(tests[0])["status"] == "PASS"
+        # The reference is still needed by tests[2], so it stays pinned
+        assert implementations[0].url_count == {("http", "/ref.html"): 1}
+        assert list(implementations[0].pinned.keys()) == [("/ref.html", None, None)]
+        ref_hash = implementations[0].pinned[("/ref.html", None, None)]
+
+        assert implementations[1].run_test(tests[1])["status"] == "PASS"
+        assert implementations[0].run_test(tests[2])["status"] == "PASS"
+
+        # The reference is only taken once, and is shared between executors
+        assert executors[0].screenshots == ["/test0.html", "/ref.html", "/test2.html"]
+        assert executors[1].screenshots == ["/test1.html"]
+        assert [item.pinned for item in implementations] == [{}, {}]
+        assert os.stat(store.path(ref_hash)).st_mtime == 0
+
+        # After a reset, the next run retakes its screenshots
+        implementations[1].reset()
+        implementations[1].run_test(tests[1])
+        assert executors[1].screenshots == ["/test1.html", "/test1.html", "/ref.html"]
+        implementations[1].run_test(tests[1])
+        assert executors[1].screenshots == ["/test1.html", "/test1.html", "/ref.html"]
+
+
+def test_reftest_reference_protocol(tmpdir):
+    # References are counted with the protocol they are loaded with, which
+    # may differ from that of the test
+    ref = ReftestTest("/", "/ref.html", [], None, [])
+    tests = [ReftestTest("/", "/test%i.https.html" % i, [], None, [(ref, "!=")],
+                         protocol="https")
+             for i in range(2)]
+    metadata = {}
+    for test in tests:
+        test.update_metadata(metadata)
+    assert dict(metadata["url_count"]) == {("http", "/ref.html"): 2}
+
+    with ScreenshotCache(str(tmpdir)) as cache:
+        implementation = RefTestImplementation(MockRefTestExecutor(cache.store(), metadata))
+        implementation.run_test(tests[0])
+        assert implementation.url_count == {("http", "/ref.html"): 1}
+        assert list(implementation.pinned.keys()) == [("/ref.html", None, None)]
+        implementation.run_test(tests[1])
+        assert implementation.url_count == {("http", "/ref.html"): 0}
+        assert implementation.pinned == {}
+
+
+def test_reftest_claim_wait(tmpdir, monkeypatch):
+    ref = ReftestTest("/", "/ref.html", [], None, [])
+    test = ReftestTest("/", "/test.html", [], None, [(ref, "!=")])
+    monkeypatch.setattr(RefTestImplementation, "claim_wait", 0.1)
+
+    with ScreenshotCache(str(tmpdir)) as cache:
+        store = cache.store()
+        # Another process claimed the reference but never takes it
+        assert store.claim(("/ref.html", None, None), 60)
+        executor = MockRefTestExecutor(store, {})
+        start = time.time()
+        assert RefTestImplementation(executor).run_test(test)["status"] == "PASS"
+        assert time.time() - start < 5
+        assert executor.screenshots == ["/test.html", "/ref.html"]
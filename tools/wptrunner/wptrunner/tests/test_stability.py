@@ -1,3 +1,8 @@
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from mozlog import structuredlog
+
 from .. import stability
 
 
@@ -29,3 +34,94 @@ def test_find_slow_status():
         "timeout": 100}) == "FAIL"
     assert stability.find_slow_status({
         "longest_duration": {"SKIP": 0}}) is None
+
+
+def test_log_handler_live():
+    logger = structuredlog.StructuredLogger("test_stability")
+    handler = stability.LogHandler()
+    logger.add_handler(handler)
+    iterations = 3
+
+    logger.suite_start(["/a.html", "/b.html"])
+    for i in range(iterations):
+        logger.test_start("/a.html")
+        logger.test_status("/a.html", "sub", "PASS" if i else "FAIL",
+                           message="failure %i" % i)
+        logger.test_end("/a.html", "OK", extra={"test_timeout": 10})
+        logger.test_start("/b.html")
+        logger.test_end("/b.html", "PASS")
+    logger.suite_end()
+    logger.remove_handler(handler)
+
+    results, inconsistent, slow = stability.summarise_results(handler.results, iterations)
+    assert list(results.keys()) == ["/a.html", "/b.html"]
+    assert results["/a.html"]["status"] == {"OK": 3}
+    assert results["/a.html"]["timeout"] == 10000
+    subtest = results["/a.html"]["subtests"]["sub"]
+    assert subtest["status"] == {"FAIL": 1, "PASS": 2}
+    # Only the first message for each status is kept
+    assert subtest["messages"] == {"failure 0", "failure 1"}
+    assert inconsistent == [("/a.html", "sub", subtest["status"], subtest["messages"])]
+    assert slow == []
+
+
+Test = namedtuple("Test", ["id"])
+
+
+def log_runs(handler, runs):
+    """Log runs of tests to handler, given as a list of (test id, status,
+    duration in seconds, subtest status) tuples"""
+    for test_id, status, duration, subtest_status in runs:
+        handler.test_start({"test": test_id, "time": 0})
+        if subtest_status is not None:
+            handler.test_status({"test": test_id, "subtest": "sub", "status": subtest_status})
+        handler.test_end({"test": test_id, "status": status, "time": duration * 1000,
+                          "extra": {"test_timeout": 10}})
+
+
+def test_adaptive_repeat():
+    handler = stability.LogHandler()
+    adaptive = stability.AdaptiveRepeat(handler)
+    tests = [Test("/fast.html"), Test("/flaky.html"), Test("/slow.html"),
+             Test("/medium.html"), Test("/new.html")]
+
+    log_runs(handler, [("/fast.html", "OK", 1, "PASS"),
+                       ("/flaky.html", "OK", 1, "PASS"),
+                       ("/slow.html", "OK", 7, "PASS"),
+                       ("/medium.html", "OK", 5, "PASS")])
+    assert not adaptive.stop_rerun("/fast.html")
+    # Tests close to timing out are rerun first, and tests with no results
+    # are run before anything else
+    assert [test.id for test in adaptive.select_tests(tests)] == [
+        "/new.html", "/slow.html", "/medium.html", "/fast.html", "/flaky.html"]
+
+    log_runs(handler, [("/flaky.html", "OK", 1, "FAIL"),
+                       ("/slow.html", "OK", 9, "PASS")])
+    assert adaptive.stop_rerun("/flaky.html")
+    assert adaptive.stop_rerun("/slow.html")
+    assert [test.id for test in adaptive.select_tests(tests)] == [
+        "/new.html", "/medium.html", "/fast.html"]
+
+    results, inconsistent, slow = stability.summarise_results(handler.results, 10, adaptive=True)
+    assert results["/flaky.html"]["iterations"] == 2
+    assert [item[:2] for item in inconsistent] == [("/flaky.html", "sub")]
+    assert [item[:2] for item in slow] == [("/slow.html", "OK")]
+
+
+def test_adaptive_repeat_deadline():
+    handler = stability.LogHandler()
+    log_runs(handler, [("/a.html", "OK", 4, None),
+                       ("/b.html", "OK", 2, None)])
+    tests = [Test("/a.html"), Test("/b.html"), Test("/c.html")]
+
+    adaptive = stability.AdaptiveRepeat(handler, processes=2,
+                                        deadline=datetime.now() + timedelta(seconds=2.5))
+    assert not adaptive.is_finished()
+    # There is time for 5s of tests in two processes, so only the tests with
+    # no results and the test closest to timing out fit
+    assert [test.id for test in adaptive.select_tests(tests)] == ["/c.html", "/a.html"]
+
+    adaptive.deadline = datetime.now() - timedelta(seconds=1)
+    assert adaptive.is_finished()
+    assert adaptive.stop_rerun("/a.html")
+    assert adaptive.select_tests(tests) == []
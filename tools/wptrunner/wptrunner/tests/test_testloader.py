@@ -2,15 +2,23 @@ from __future__ import unicode_literals
 
 import sys
 import tempfile
+import threading
 
 import pytest
+from mock import Mock
+from six.moves.queue import Queue
 
 from mozlog import structured
-from ..testloader import TestFilter as Filter
+from ..testloader import PathGroupedSource, SingleTestSource, TestFilter as Filter, TestLoader
 from .test_wpttest import make_mock_manifest
 
 structured.set_default_logger(structured.structuredlog.StructuredLogger("TestLoader"))
 
+expected_ini = """\
+[1.html]
+  expected: FAIL
+"""
+
 include_ini = """\
 skip: true
 [test_\u53F0]
@@ -31,3 +39,100 @@ def test_filter_unicode():
         f.flush()
 
         Filter(manifest_path=f.name, test_manifests=tests)
+
+
+class MockTest(object):
+    def __init__(self, url, affinity_key=None):
+        self.url = url
+        self.id = url
+        self.affinity_key = affinity_key
+
+    def update_metadata(self, metadata):
+        metadata.setdefault("tests", []).append(self.id)
+        return metadata
+
+
+def drain(source):
+    groups = []
+    while True:
+        group, metadata = source.group()
+        if group is None:
+            break
+        groups.append((list(group), metadata))
+        group.clear()
+    return groups
+
+
+def test_path_grouped_source_streaming():
+    urls = ["/a/1.html", "/a/2.html", "/b/1.html", "/b/c/1.html"]
+    test_queue = Queue()
+    queue_sizes = []
+
+    def iter_tests():
+        for url in urls:
+            queue_sizes.append(test_queue.qsize())
+            yield MockTest(url)
+
+    PathGroupedSource.fill_queue(test_queue, iter_tests(), depth=None)
+    # Each group is queued as soon as the first test of the next group is loaded
+    assert queue_sizes == [0, 0, 0, 1]
+
+    sources = [PathGroupedSource(test_queue), PathGroupedSource(test_queue)]
+    groups = drain(sources[0])
+    assert [[test.id for test in group] for group, _ in groups] == [
+        ["/a/1.html", "/a/2.html"], ["/b/1.html"], ["/b/c/1.html"]]
+    assert [metadata["scope"] for _, metadata in groups] == ["/a", "/b", "/b/c"]
+
+    # The end marker is left in place for other sources using the queue
+    assert sources[1].group() == (None, None)
+
+
+def test_single_test_source_batches():
+    tests = [MockTest("/a/%i.html" % i) for i in range(5)]
+    test_queue = Queue()
+    SingleTestSource.fill_queue(test_queue, iter(tests), processes=2, batch_size=2)
+
+    groups = drain(SingleTestSource(test_queue))
+    assert [len(group) for group, _ in groups] == [2, 2, 1]
+    # All batches share metadata, so running them doesn't restart the browser
+    metadata = groups[0][1]
+    assert all(item is metadata for _, item in groups)
+    assert metadata["tests"] == [test.id for test in tests]
+
+
+def test_single_test_source_affinity(monkeypatch):
+    monkeypatch.setattr(SingleTestSource, "affinity_max_imbalance", 2)
+    tests = ([MockTest("/a/%i.html" % i, "/ref-a.html") for i in range(4)] +
+             [MockTest("/b/%i.html" % i, "/ref-b.html") for i in range(4)])
+    test_queue = Queue()
+    SingleTestSource.fill_queue(test_queue, iter(tests), processes=2)
+
+    groups = drain(SingleTestSource(test_queue))
+    # Tests sharing a reference stay together until the queue they are
+    # assigned to gets too far ahead of the others
+    assert [test.url for test in groups[0][0]] == ["/a/0.html", "/a/1.html", "/a/2.html"]
+    assert [test.url for test in groups[1][0]] == ["/a/3.html", "/b/0.html", "/b/1.html",
+                                                   "/b/2.html", "/b/3.html"]
+
+
+@pytest.mark.xfail(sys.version[0] == "3",
+                   reason="wptmanifest.parser doesn't support py3")
+def test_metadata_pool(tmpdir):
+    tmpdir.mkdir("a").join("1.html.ini").write(expected_ini)
+    manifest_file = Mock(url_base="/")
+    # The worker processes are started when the loader is created, rather
+    # than from the thread that loads the tests
+    loader = TestLoader({manifest_file: {"metadata_path": str(tmpdir)}}, ["testharness"], {},
+                        lazy=True, metadata_processes=2)
+    assert loader.metadata_pool is not None
+
+    manifest_items = [(manifest_file, "testharness", "a/%i.html" % i, set()) for i in range(3)]
+    results = []
+    thread = threading.Thread(target=lambda: results.extend(loader.iter_metadata(manifest_items)))
+    thread.start()
+    thread.join()
+    assert [test_metadata is not None for _, test_metadata in results] == [False, True, False]
+    assert results[1][1].get_test("/a/1.html").expected == "FAIL"
+
+    loader.close()
+    assert loader.metadata_pool is None
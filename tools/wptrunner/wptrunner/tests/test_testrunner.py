@@ -0,0 +1,153 @@
+import threading
+import time
+
+from mozlog import structuredlog
+from six.moves.queue import Queue
+
+from ..browsers.base import Browser
+from ..testrunner import BrowserManager
+
+
+class MockBrowser(Browser):
+    supports_prewarm = True
+    start_uses_group_metadata = True
+
+    def __init__(self, logger, launched=None):
+        Browser.__init__(self, logger)
+        self.running = False
+        self.start_count = 0
+        self.cleaned_up = False
+        # Event that start waits for, to simulate a slow launch
+        self.launched = launched
+
+    def start(self, group_metadata=None, **kwargs):
+        if self.launched is not None:
+            self.launched.wait()
+        self.start_count += 1
+        self.running = True
+
+    def stop(self, force=False):
+        self.running = False
+
+    def pid(self):
+        return None
+
+    def is_alive(self):
+        return self.running
+
+    def cleanup(self):
+        self.cleaned_up = True
+
+
+def make_manager(browser_cls=MockBrowser, launched=None):
+    logger = structuredlog.StructuredLogger("test_testrunner")
+    browsers = []
+
+    def browser_factory():
+        browsers.append(browser_cls(logger, launched))
+        return browsers[-1]
+
+    initial = MockBrowser(logger)
+    manager = BrowserManager(logger, initial, Queue(), no_timeout=True,
+                             browser_factory=browser_factory)
+    manager.browser_settings = {}
+    return manager, initial, browsers
+
+
+def test_standby_browser_used_on_restart():
+    manager, initial, browsers = make_manager()
+
+    assert manager.init({"scope": "/a"})
+    manager.start_standby()
+    assert len(browsers) == 1
+
+    manager.stop()
+    assert manager.init({"scope": "/a"})
+    assert manager.browser is browsers[0]
+    assert browsers[0].start_count == 1
+    assert initial.start_count == 1
+    assert manager.prewarm_hits == 1
+    assert manager.prewarm_misses == 0
+
+    manager.start_standby()
+    manager.teardown()
+    assert browsers[0].cleaned_up
+    assert browsers[1].cleaned_up
+    assert not initial.cleaned_up
+    assert manager.browser is initial
+
+
+def test_standby_browser_discarded_on_mismatch():
+    manager, initial, browsers = make_manager()
+
+    assert manager.init({"scope": "/a"})
+    manager.start_standby()
+
+    manager.stop()
+    assert manager.init({"scope": "/b"})
+    assert manager.browser is initial
+    assert initial.start_count == 2
+    manager.teardown()
+    assert browsers[0].cleaned_up
+    assert manager.prewarm_hits == 0
+    assert manager.prewarm_misses == 1
+
+
+def test_standby_browser_mismatch_does_not_block():
+    launched = threading.Event()
+    manager, initial, browsers = make_manager(launched=launched)
+
+    assert manager.init({"scope": "/a"})
+    manager.start_standby()
+
+    # The standby browser is still starting, so it is stopped in the
+    # background rather than delaying the start of the new browser
+    manager.stop()
+    start = time.time()
+    assert manager.init({"scope": "/b"})
+    assert time.time() - start < 1
+    assert manager.browser is initial
+    assert not browsers[0].cleaned_up
+
+    launched.set()
+    manager.teardown()
+    assert browsers[0].cleaned_up
+    assert not browsers[0].running
+
+
+def test_standby_browser_prepared_for_group():
+    manager, initial, browsers = make_manager()
+
+    assert manager.init({"scope": "/a"})
+    manager.start_standby()
+    # When the next group is known, the standby browser is replaced by one
+    # started for that group
+    manager.prepare_group({"scope": "/b"})
+    assert len(browsers) == 2
+
+    manager.stop()
+    assert manager.init({"scope": "/b"})
+    assert manager.browser is browsers[1]
+    assert manager.prewarm_hits == 1
+    manager.teardown()
+    assert browsers[0].cleaned_up
+
+
+class GroupIndependentBrowser(MockBrowser):
+    start_uses_group_metadata = False
+
+
+def test_standby_browser_used_for_new_group():
+    manager, initial, browsers = make_manager(GroupIndependentBrowser)
+
+    assert manager.init({"scope": "/a"})
+    manager.start_standby()
+    manager.prepare_group({"scope": "/b"})
+    assert len(browsers) == 1
+
+    # The browser doesn't depend on the group, so the standby browser is used
+    manager.stop()
+    assert manager.init({"scope": "/b"})
+    assert manager.browser is browsers[0]
+    assert manager.prewarm_hits == 1
+    manager.teardown()
@@ -0,0 +1,113 @@
+import json
+
+from mozlog import structuredlog, handlers
+
+from .. import resultsarchive, timeouts
+from .test_wpttest import make_test_object, test_3
+
+
+class MockTest(object):
+    def __init__(self, id, timeout=10, expected="OK", known_intermittent=None,
+                 subtest_metadata=False):
+        self.id = id
+        self.subtest_metadata = subtest_metadata
+        self.timeout = timeout
+        self._expected = expected
+        self._known_intermittent = known_intermittent or []
+
+    def expected(self):
+        return self._expected
+
+    def known_intermittent(self):
+        return self._known_intermittent
+
+    def has_subtest_metadata(self):
+        return self.subtest_metadata
+
+
+def test_read_durations(tmpdir):
+    raw_path = tmpdir.join("raw.log")
+    with open(str(raw_path), "w") as f:
+        logger = structuredlog.StructuredLogger("test_timeouts")
+        logger.add_handler(handlers.StreamHandler(f, lambda data: json.dumps(data) + "\n"))
+        logger.suite_start(["/a.html", "/b.html"])
+        logger.test_start("/a.html")
+        logger.test_end("/a.html", "OK")
+        logger.test_start("/b.html")
+        logger.test_end("/b.html", "TIMEOUT")
+        logger.suite_end()
+
+    report_path = tmpdir.join("report.json")
+    report_path.write(json.dumps({
+        "results": [{"test": "/a.html", "status": "OK", "duration": 120, "subtests": []},
+                    {"test": "/b.html", "status": "CRASH", "duration": 500, "subtests": []},
+                    {"test": "/c.html", "status": "ERROR", "duration": 30, "subtests": []}]}))
+
+    archive_path = str(tmpdir.join("results.wra"))
+    builder = resultsarchive.ChunkBuilder()
+    run = builder.add_run({})
+    builder.add_result(run, "/c.html", "OK", 40)
+    builder.add_result(run, "/c.html", "TIMEOUT", 10000)
+    resultsarchive.append_chunk(archive_path, builder.to_bytes())
+
+    durations = timeouts.read_durations([str(raw_path), str(report_path), archive_path])
+    # Durations of runs that didn't complete aren't included
+    assert sorted(durations) == ["/a.html", "/c.html"]
+    assert len(durations["/a.html"]) == 2
+    assert durations["/a.html"][1] == 120
+    assert sorted(durations["/c.html"]) == [30, 40]
+
+
+def test_timeout_tuner():
+    tuner = timeouts.TimeoutTuner({"/fast.html": [100, 200, 300],
+                                   "/slow.html": [4000, 5000, 6000],
+                                   "/few.html": [100, 100]},
+                                  factor=2, floor=1)
+    # Timeouts include the timeout multiplier of 2
+    assert tuner.timeout(MockTest("/fast.html"), 2) == 1
+    assert tuner.timeout(MockTest("/slow.html"), 2) == 12
+    assert tuner.timeout(MockTest("/slow.html", timeout=5), 1) is None
+    assert tuner.timeout(MockTest("/few.html"), 1) is None
+    assert tuner.timeout(MockTest("/new.html"), 1) is None
+    # Tests expected to time out get the minimum timeout
+    assert tuner.timeout(MockTest("/slow.html", expected="TIMEOUT"), 2) == 1
+    assert tuner.shortened == 3
+
+    tuner.record(20, 1, "OK", False)
+    tuner.record(20, 1, "EXTERNAL-TIMEOUT", False)
+    assert (tuner.cut_short, tuner.time_saved) == (1, 19)
+    # Restarting the browser after the test was stopped costs time
+    tuner.record_restart(4)
+    assert (tuner.restarts, tuner.time_saved) == (1, 15)
+    assert "saving 15.0s including 1 browser restarts" in tuner.summary()
+
+
+def test_timeout_tuner_subtests():
+    # The in-page harness timeout isn't shortened, so a test stopped with a
+    # shortened timeout would lose its subtest results; tests with subtest
+    # expectations always get their full timeout
+    tuner = timeouts.TimeoutTuner({"/a.html": [100, 200, 300]})
+    assert tuner.timeout(MockTest("/a.html"), 1) is not None
+    assert tuner.timeout(MockTest("/a.html", subtest_metadata=True), 1) is None
+    assert tuner.timeout(MockTest("/a.html", expected="TIMEOUT", subtest_metadata=True),
+                         1) is None
+
+    tests = [make_test_object(test_3, "a/3.html", index, ("test", "a", 4), None, False)
+             for index in (3, 0)]
+    tuner = timeouts.TimeoutTuner({test.id: [100, 200, 300] for test in tests})
+    assert [test.has_subtest_metadata() for test in tests] == [True, False]
+    assert tuner.timeout(tests[0], 1) is None
+    assert tuner.timeout(tests[1], 1) is not None
+
+
+def test_timeout_tuner_retry():
+    tuner = timeouts.TimeoutTuner({}, retry=True)
+    assert tuner.should_retry(MockTest("/a.html"), "EXTERNAL-TIMEOUT")
+    assert not tuner.should_retry(MockTest("/a.html"), "FAIL")
+    assert not tuner.should_retry(MockTest("/a.html", expected="TIMEOUT"), "TIMEOUT")
+    assert not tuner.should_retry(MockTest("/a.html", known_intermittent=["TIMEOUT"]),
+                                  "TIMEOUT")
+    assert not timeouts.TimeoutTuner({}).should_retry(MockTest("/a.html"), "TIMEOUT")
+
+    tuner.record(10, 5, "TIMEOUT", True)
+    assert (tuner.retried, tuner.time_saved) == (1, -5)
@@ -0,0 +1,66 @@
+import json
+
+from mozlog import structuredlog, handlers
+from six import StringIO
+
+from .. import timing
+
+
+def test_phase_timer():
+    timer = timing.PhaseTimer()
+    timer.add("run", 0.5)
+    timer.update({"run": 0.25, "log": 0.0004})
+    with timer.phase("queue_wait"):
+        pass
+    timings = timer.pop()
+    assert timings["run"] == 0.75
+    assert timings["log"] == 0
+    assert timings["queue_wait"] >= 0
+    assert timer.pop() == {}
+
+
+def test_read_timings():
+    log = StringIO()
+    logger = structuredlog.StructuredLogger("test_timing")
+    logger.add_handler(handlers.StreamHandler(log, lambda data: json.dumps(data) + "\n"))
+    logger.suite_start(["/a/b/1.html", "/a/b/2.html"])
+    logger.test_start("/a/b/1.html")
+    logger.test_end("/a/b/1.html", "OK", extra={"phase_timings": {"run": 1.0}})
+    logger.test_start("/a/b/2.html")
+    logger.test_end("/a/b/2.html", "OK")
+    logger.suite_end()
+    log.seek(0)
+
+    assert timing.read_timings([log]) == [("/a/b/1.html", {"run": 1.0})]
+
+
+def test_summarise():
+    timings = [
+        ("/a/b/c/1.html", {"browser_start": 2.0, "run": 1.0, "navigation": 0.25,
+                           "script": 0.5, "log": 0.1}),
+        ("/a/b/2.html?x=1", {"run": 2.0, "navigation": 0.5, "script": 1.0}),
+        ("/d/3.html", {"queue_wait": 1.0, "run": 0.5}),
+    ]
+    summary = timing.summarise(timings, depth=2)
+
+    assert summary["tests"] == 3
+    # Executor phases are part of the run phase
+    assert summary["total"] == 6.6
+    assert summary["phases"]["run"]["tests"] == 3
+    assert summary["phases"]["run"]["total"] == 3.5
+    assert summary["phases"]["run"]["max"] == 2.0
+    assert summary["phases"]["run_other"]["total"] == 1.25
+    assert summary["phases"]["navigation"]["mean"] == 0.375
+    assert sorted(summary["dirs"]) == ["/a/b", "/d"]
+    assert summary["dirs"]["/a/b"]["tests"] == 2
+    assert summary["dirs"]["/a/b"]["phases"]["script"] == 1.5
+    assert summary["dirs"]["/d"]["total"] == 1.5
+
+    text = timing.format_text(summary)
+    lines = text.splitlines()
+    assert lines[0] == "3 tests, 6.6s in total"
+    # Phases are listed in the order they happen
+    assert [line.split()[0] for line in lines[5:12]] == [
+        "queue_wait", "browser_start", "run", "log", "navigation", "script", "run_other"]
+    assert "/a/b" in text
+    assert json.loads(timing.format_json(summary))["tests"] == 3
@@ -5,7 +5,7 @@ import pytest
 import sys
 from io import BytesIO
 
-from .. import metadata, manifestupdate
+from .. import metadata, manifestupdate, wptmanifest
 from ..update.update import WPTUpdate
 from ..update.base import StepRunner, Step
 from mozlog import structuredlog, handlers, formatters
@@ -60,12 +60,25 @@ def update(tests, *logs, **kwargs):
     disable_intermittent = kwargs.pop("disable_intermittent", False)
     update_intermittent = kwargs.pop("update_intermittent", False)
     remove_intermittent = kwargs.pop("remove_intermittent", False)
+    log_dir = kwargs.pop("log_dir", None)
     assert not kwargs
     id_test_map, updater = create_updater(tests)
 
-    for log in logs:
-        log = create_log(log)
-        updater.update_from_log(log)
+    if log_dir is not None:
+        # Read the logs from files in worker processes
+        log_paths = []
+        for i, log in enumerate(logs):
+            log_paths.append(os.path.join(log_dir, "log%i.json" % i))
+            with open(log_paths[-1], "wb") as f:
+                f.write(create_log(log).getvalue())
+        # Interned values in this process differ from those in the workers
+        metadata.status_intern.store("CRASH")
+        metadata.run_info_intern.store(metadata.RunInfo({"os": "other"}))
+        metadata.read_logs(updater, log_paths, processes=2)
+    else:
+        for log in logs:
+            log = create_log(log)
+            updater.update_from_log(log)
 
     update_properties = (["debug", "os", "version", "processor"],
                          {"os": ["version"], "processor": "bits"})
@@ -1511,3 +1524,160 @@ def test_update_pickle():
     wptupdate = WPTUpdate(logger, **args2)
     wptupdate = WPTUpdate(logger, runner_cls=UpdateRunner, **args)
     wptupdate.run()
+
+
+@pytest.mark.xfail(sys.version[0] == "3",
+                   reason="metadata doesn't support py3")
+def test_update_processes(tmpdir):
+    tests = [("path/to/test.htm", [test_id], "testharness", """
+[test.htm]
+  [test1]
+    expected: FAIL""")]
+
+    log_0 = suite_log([("test_start", {"test": test_id}),
+                       ("test_status", {"test": test_id,
+                                        "subtest": "test1",
+                                        "status": "PASS",
+                                        "expected": "FAIL"}),
+                       ("test_end", {"test": test_id,
+                                     "status": "OK"})])
+    log_1 = suite_log([("test_start", {"test": test_id}),
+                       ("test_status", {"test": test_id,
+                                        "subtest": "test1",
+                                        "status": "FAIL",
+                                        "expected": "FAIL"}),
+                       ("test_end", {"test": test_id,
+                                     "status": "TIMEOUT",
+                                     "expected": "OK"})],
+                      run_info={"os": "win"})
+    log_2 = {"run_info": default_run_info.copy(),
+             "results": [{"test": "/path/to/unknown.htm",
+                          "status": "OK",
+                          "subtests": []}]}
+
+    serial = update(tests, log_0, log_1, log_2)
+    parallel = update(tests, log_0, log_1, log_2, log_dir=str(tmpdir))
+
+    assert len(serial) == len(parallel) == 1
+    run_info_win = get_run_info({"os": "win"})
+    for updated in [serial, parallel]:
+        new_manifest = updated[0][1]
+        test = new_manifest.get_test(test_id)
+        assert test.children[0].get("expected", run_info_win) == "FAIL"
+        assert test.get("expected", run_info_win) == "TIMEOUT"
+    assert (wptmanifest.serialize(serial[0][1].node) ==
+            wptmanifest.serialize(parallel[0][1].node))
+
+
+@pytest.mark.xfail(sys.version[0] == "3",
+                   reason="metadata doesn't support py3")
+def test_write_results_processes(tmpdir):
+    tests = [("path/to/test%i.htm" % i, ["/path/to/test%i.htm" % i], "testharness", """
+[test%i.htm]
+  [test1]
+    expected: FAIL""" % i) for i in range(4)]
+
+    log = suite_log([item for i in range(3)
+                     for item in [("test_start", {"test": "/path/to/test%i.htm" % i}),
+                                  ("test_status", {"test": "/path/to/test%i.htm" % i,
+                                                   "subtest": "test1",
+                                                   "status": "PASS",
+                                                   "expected": "FAIL"}),
+                                  ("test_end", {"test": "/path/to/test%i.htm" % i,
+                                                "status": "TIMEOUT",
+                                                "expected": "OK"})]])
+
+    update_properties = (["debug", "os", "version", "processor"],
+                         {"os": ["version"], "processor": "bits"})
+    expected_data = {test_path: manifestupdate.compile(BytesIO(manifest_str),
+                                                       test_path,
+                                                       "/",
+                                                       update_properties)
+                     for test_path, _, _, manifest_str in tests}
+    metadata.load_expected = lambda _, __, test_path, *args: expected_data.get(test_path)
+
+    written = {}
+    for processes in [1, 2]:
+        metadata_path = tmpdir.mkdir("metadata%i" % processes)
+        id_test_map, updater = create_updater(tests)
+        for test_file in id_test_map.itervalues():
+            test_file.metadata_path = str(metadata_path)
+        updater.update_from_log(create_log(log))
+        metadata.write_results(id_test_map, update_properties, False, False,
+                               processes=processes)
+        written[processes] = {path.relto(metadata_path): path.read()
+                              for path in metadata_path.visit() if path.isfile()}
+
+    assert sorted(written[1].keys()) == ["path/to/test0.htm.ini",
+                                         "path/to/test1.htm.ini",
+                                         "path/to/test2.htm.ini"]
+    assert written[1]["path/to/test0.htm.ini"] == "[test0.htm]\n  expected: TIMEOUT\n"
+    assert written[1] == written[2]
+
+
+def test_log_format():
+    raw = create_log(suite_log([]))
+    assert metadata.log_format(raw) == "raw"
+    assert raw.tell() == 0
+
+    report = create_log({"run_info": default_run_info.copy(),
+                         "results": [{"test": "/%i.htm" % i,
+                                      "status": "OK",
+                                      "subtests": []} for i in range(5000)]})
+    assert len(report.getvalue()) > 64 * 1024
+    assert metadata.log_format(report) == "wptreport"
+
+    assert metadata.log_format(BytesIO(b"not json\n")) == "raw"
+
+
+def test_log_format_long_first_line():
+    tests = ["/path/to/test%i.htm" % i for i in range(5000)]
+    raw = create_log([("suite_start", {"tests": tests, "run_info": default_run_info.copy()}),
+                      ("test_start", {"test": tests[0]}),
+                      ("test_end", {"test": tests[0], "status": "OK"}),
+                      ("suite_end", {})])
+    assert len(raw.getvalue().split(b"\n", 1)[0]) > 64 * 1024
+    assert metadata.log_format(raw) == "raw"
+    assert raw.tell() == 0
+
+    report = create_log({"run_info": default_run_info.copy(),
+                         "results": [{"test": test,
+                                      "status": "OK",
+                                      "subtests": []} for test in tests]})
+    report.seek(0, 2)
+    report.write(b"\n")
+    report.seek(0)
+    assert metadata.log_format(report) == "wptreport"
+    assert report.tell() == 0
+
+    # A wptreport log over several lines, with a long first line
+    indented = BytesIO(b'{"results": [' + b", ".join(b'{"test": "%s"}' % test.encode("ascii")
+                                                     for test in tests) +
+                       b'],\n"run_info": {}}\n')
+    assert metadata.log_format(indented) == "wptreport"
+
+
+def test_packed_result_list_many_run_infos():
+    reset_globals()
+    try:
+        status_prop = metadata.prop_intern.store("status")
+        statuses = [metadata.status_intern.store(status)
+                    for status in ["PASS", "FAIL", "TIMEOUT", "CRASH"]]
+        results = metadata.PackedResultList()
+        run_infos = []
+        for i in range(1000):
+            run_info = metadata.RunInfo(get_run_info({"version": str(i)}))
+            run_infos.append(run_info)
+            results.append(status_prop, metadata.run_info_intern.store(run_info),
+                           statuses[i % len(statuses)])
+        results.append(metadata.prop_intern.store("asserts"),
+                       metadata.run_info_intern.store(run_infos[-1]),
+                       (0, 2))
+
+        unpacked = list(results)
+        assert len(unpacked) == 1001
+        assert unpacked[300] == ("status", run_infos[300], "PASS")
+        assert unpacked[999] == ("status", run_infos[999], "CRASH")
+        assert unpacked[1000] == ("asserts", run_infos[999], (0, 2))
+    finally:
+        reset_globals()
@@ -0,0 +1,152 @@
+import os
+
+from mozlog import structuredlog
+
+from .. import webdriver_server
+from ..webdriver_server import WebDriverServer, WebDriverServerPool
+
+logger = structuredlog.StructuredLogger("test_webdriver_server")
+
+
+class MockProcess(object):
+    def __init__(self):
+        self.proc = object()
+        self.pid = id(self)
+        self.killed = False
+
+    def poll(self):
+        return 0 if self.killed else None
+
+    def kill(self):
+        self.killed = True
+        return True
+
+
+class MockServer(WebDriverServer):
+    responding = True
+
+    def __init__(self, *args, **kwargs):
+        WebDriverServer.__init__(self, logger, "mockdriver", *args, **kwargs)
+        self.runs = 0
+
+    def make_command(self):
+        return [self.binary, "--port=%s" % self.port]
+
+    def _run(self, block):
+        self.runs += 1
+        self._cmd = self.make_command()
+        self._proc = MockProcess()
+
+    def status(self, timeout=2):
+        return {"ready": True} if self.responding else None
+
+
+class MockMultiSessionServer(MockServer):
+    max_sessions = None
+
+
+def test_pool_reuse():
+    with WebDriverServerPool(logger) as pool:
+        server = MockServer()
+        server.start()
+        proc, port = server._proc, server.port
+        server.stop()
+        assert not proc.killed
+
+        restarted = MockServer()
+        restarted.start()
+        assert restarted.runs == 0
+        assert restarted._proc is proc
+        assert restarted.port == port
+
+        # Only one session at a time, so another server is started
+        other = MockServer()
+        other.start()
+        assert other.runs == 1
+        assert other._proc is not proc
+
+        # Servers with different arguments aren't interchangeable
+        different = MockServer(args=["--verbose"])
+        different.start()
+        assert different.runs == 1
+
+        assert (pool.started, pool.reused) == (3, 1)
+    assert all(item._proc is None or item._proc.killed
+               for item in (restarted, other, different))
+    assert proc.killed
+
+
+def test_pool_shared_sessions():
+    with WebDriverServerPool(logger) as pool:
+        servers = [MockMultiSessionServer() for _ in range(3)]
+        for server in servers:
+            server.start()
+        proc = servers[0]._proc
+        assert [server.runs for server in servers] == [1, 0, 0]
+        assert all(server._proc is proc for server in servers)
+
+        # A forced stop retires the server once all its sessions have ended
+        servers[0].stop(force=True)
+        servers[1].stop()
+        assert not proc.killed
+        servers[2].stop()
+        assert proc.killed
+        assert pool.servers == []
+
+
+def test_pool_not_responding(monkeypatch):
+    with WebDriverServerPool(logger) as pool:
+        server = MockServer()
+        server.start()
+        proc = server._proc
+        server.stop()
+
+        monkeypatch.setattr(MockServer, "responding", False)
+        restarted = MockServer()
+        restarted.start()
+        assert restarted.runs == 1
+        assert restarted._proc is not proc
+        assert proc.killed
+        assert pool.reused == 0
+
+
+def test_pool_other_process(monkeypatch):
+    with WebDriverServerPool(logger):
+        assert webdriver_server.active_pool() is not None
+        pid = os.getpid()
+        monkeypatch.setattr(os, "getpid", lambda: pid + 1)
+        assert webdriver_server.active_pool() is None
+
+        server = MockServer()
+        server.start()
+        proc = server._proc
+        server.stop()
+        assert proc.killed
+
+
+def test_pool_hold_detached():
+    with WebDriverServerPool(logger) as pool:
+        server = MockServer()
+        server.start()
+        proc = server._proc
+
+        # A held server isn't reused until it's released
+        pool.hold_detached()
+        server.stop()
+        other = MockServer()
+        other.start()
+        assert other.runs == 1
+        other.stop()
+        pool.release_held()
+        restarted = MockServer()
+        restarted.start()
+        assert restarted._proc is proc
+        restarted.stop()
+
+        # Releasing with force retires the server
+        pool.hold_detached()
+        restarted.start()
+        restarted.stop()
+        assert not proc.killed
+        pool.release_held(force=True)
+        assert proc.killed
@@ -0,0 +1,144 @@
+import json
+import os
+import sys
+import threading
+
+import pytest
+
+# Importing environment puts the wpt tools, including webdriver, on sys.path
+from .. import environment  # noqa: F401
+
+import webdriver  # noqa: E402
+from webdriver import protocol, transport  # noqa: E402
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "benchmarks"))
+from webdriver_transport import StubDriver, StubDriverHandler  # noqa: E402
+
+
+class RecordingHandler(StubDriverHandler):
+    def handle_command(self):
+        self.server.requests.append((self.command, self.client_address))
+        if self.client_address in self.server.drop_reused:
+            # Close a reused connection after reading the request, as if the
+            # remote end had closed it while the request was being sent
+            length = int(self.headers.get("Content-Length", 0))
+            if length:
+                self.rfile.read(length)
+            self.close_connection = True
+            return
+        if self.server.drop_after_request:
+            self.server.drop_reused.add(self.client_address)
+        StubDriverHandler.handle_command(self)
+
+
+@pytest.fixture
+def server():
+    server = StubDriver(("127.0.0.1", 0), RecordingHandler)
+    server.requests = []
+    server.drop_reused = set()
+    server.drop_after_request = False
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def connections(server):
+    return set(address for _, address in server.requests)
+
+
+def test_pooled_connections(server):
+    wire = transport.HTTPWireProtocol("127.0.0.1", server.server_address[1], pool_size=1)
+    for method in ["GET", "POST", "DELETE"]:
+        assert wire.send(method, "session/stub/url").status == 200
+    # Sequential commands share one connection
+    assert len(server.requests) == 3
+    assert len(connections(server)) == 1
+
+    # Concurrent callers each get a connection, and the pool keeps at most
+    # pool_size of them
+    conns = [wire._acquire_connection()[0] for _ in range(2)]
+    for conn in conns:
+        conn.connect()
+        wire._release_connection(conn)
+    assert len(wire._pool) == 1
+
+    wire.close()
+    assert wire._pool == []
+
+
+def test_dropped_connection_not_reused(server):
+    wire = transport.HTTPWireProtocol("127.0.0.1", server.server_address[1])
+    wire.send("GET", "status")
+    conn = wire._pool[0]
+    # The remote end closes the idle connection
+    conn.sock.shutdown(2)
+    assert transport.is_dropped(conn)
+    assert wire.send("POST", "session/stub/url", {}).status == 200
+    assert len(connections(server)) == 2
+
+
+def test_retry_idempotent(server):
+    wire = transport.HTTPWireProtocol("127.0.0.1", server.server_address[1])
+    server.drop_after_request = True
+    wire.send("GET", "status")
+    server.drop_after_request = False
+
+    # A GET on a connection that fails is sent again on a new connection
+    assert wire.send("GET", "status").status == 200
+    assert [method for method, _ in server.requests] == ["GET", "GET", "GET"]
+    assert len(connections(server)) == 2
+
+
+def test_no_retry_post(server):
+    wire = transport.HTTPWireProtocol("127.0.0.1", server.server_address[1])
+    server.drop_after_request = True
+    wire.send("GET", "status")
+    server.drop_after_request = False
+
+    # The remote end may have acted on the POST, so it isn't sent again
+    with pytest.raises(Exception):
+        wire.send("POST", "session/stub/element/click", {})
+    assert [method for method, _ in server.requests] == ["GET", "POST"]
+
+
+class RecordingCodec(object):
+    def __init__(self):
+        self.calls = []
+
+    def dumps(self, obj):
+        self.calls.append("dumps")
+        return json.dumps(obj)
+
+    def loads(self, data):
+        self.calls.append("loads")
+        return json.loads(data)
+
+
+def test_fast_codec(server, monkeypatch):
+    codec = RecordingCodec()
+    monkeypatch.setattr(transport, "fast_json", codec)
+
+    session = webdriver.Session("127.0.0.1", server.server_address[1])
+    session.session_id = "stub"
+    value = session.send_session_command("POST", "execute/sync",
+                                         {"script": "", "args": []})
+    # Session commands are encoded with protocol.Encoder, which needs the
+    # json module, but are decoded by the faster codec, with the decoder's
+    # object hook applied to the parsed document
+    assert codec.calls == ["loads"]
+    assert isinstance(value["element"], webdriver.Element)
+    session.session_id = None
+
+    del codec.calls[:]
+    assert transport.dumps({"a": 1}) == '{"a": 1}'
+    assert codec.calls == ["dumps"]
+
+    # Encoders other than the default use the json module
+    del codec.calls[:]
+    assert json.loads(transport.dumps({"a": 1}, encoder=protocol.Encoder,
+                                      session=session)) == {"a": 1}
+    assert transport.loads('{"a": 1}', decoder=json.JSONDecoder, strict=False) == {"a": 1}
+    assert codec.calls == []
@@ -0,0 +1,173 @@
+"""Shorter per-test timeouts based on the durations of earlier runs.
+
+A test normally gets its full timeout, scaled by the timeout multiplier,
+so a test that hangs costs the full timeout before it's stopped. Given a
+history of durations from earlier runs, a test that has completed often
+enough instead gets the 99th percentile of its durations times a factor,
+with a lower limit, when that is shorter than the full timeout. Tests that
+are expected to time out get the lower limit.
+
+The shortened timeout is only known to the test runner, not to the harness
+in the page, so a test that runs out of time is stopped from outside with an
+EXTERNAL-TIMEOUT, without any subtest results, and the browser is
+restarted. Tests with subtest expectations therefore keep their full
+timeout, and the time taken by those restarts is taken off the time saved.
+"""
+
+import json
+import threading
+
+from mozlog import reader
+from six import iteritems
+
+from . import resultsarchive
+from .metadata import log_format
+from .timing import percentile
+
+# Statuses of runs whose durations don't show how long the test takes to
+# complete
+incomplete_statuses = {"TIMEOUT", "EXTERNAL-TIMEOUT", "CRASH", "SKIP", "NOTRUN"}
+timeout_statuses = {"TIMEOUT", "EXTERNAL-TIMEOUT"}
+
+# Number of completed runs needed to shorten the timeout of a test
+min_samples = 3
+
+
+class DurationHandler(reader.LogHandler):
+    def __init__(self, durations):
+        self.durations = durations
+        self.start_times = {}
+
+    def test_start(self, data):
+        self.start_times[data["test"]] = data["time"]
+
+    def test_end(self, data):
+        start_time = self.start_times.pop(data["test"], None)
+        if start_time is not None and data["status"] not in incomplete_statuses:
+            self.durations.setdefault(data["test"], []).append(data["time"] - start_time)
+
+
+def read_durations(paths):
+    """Get the durations of the completed runs of each test.
+
+    :param paths: Paths to wptreport or raw logs, or results archives
+    :returns: Dictionary of test id to a list of durations in ms
+    """
+    durations = {}
+    for path in paths:
+        with open(path, "rb") as f:
+            if f.read(len(resultsarchive.magic)) == resultsarchive.magic:
+                archive = resultsarchive.ArchiveReader(f)
+                for test_id, results in iteritems(archive.durations()):
+                    durations.setdefault(test_id, []).extend(
+                        duration for _, status, duration in results
+                        if duration is not None and status not in incomplete_statuses)
+                continue
+            f.seek(0)
+            if log_format(f) == "wptreport":
+                for result in json.load(f)["results"]:
+                    if (result.get("duration") is not None and
+                        result["status"] not in incomplete_statuses):
+                        durations.setdefault(result["test"], []).append(result["duration"])
+            else:
+                reader.handle_log(reader.read(f), DurationHandler(durations))
+    return durations
+
+
+class TimeoutTuner(object):
+    def __init__(self, durations, factor=3, floor=5, retry=False):
+        """Chooses shorter timeouts for tests, and keeps count of the time
+        saved. Shared between the TestRunnerManager threads.
+
+        :param durations: Dictionary of test id to a list of durations in ms
+                          of completed runs
+        :param factor: Multiple of the 99th percentile duration to use as the
+                       timeout
+        :param floor: Minimum timeout in seconds
+        :param retry: Rerun tests that time out with a shortened timeout once
+                      more with the full timeout, and report that result
+        """
+        self.floor = floor
+        self.retry = retry
+        self.timeouts = {}
+        for test_id, values in iteritems(durations):
+            if len(values) >= min_samples:
+                self.timeouts[test_id] = max(percentile(sorted(values), 0.99) * factor / 1000.,
+                                             floor)
+        self.lock = threading.Lock()
+        self.shortened = 0
+        self.cut_short = 0
+        self.retried = 0
+        self.restarts = 0
+        self.time_saved = 0
+
+    def expects_timeout(self, test):
+        return test.expected() == "TIMEOUT" or "TIMEOUT" in test.known_intermittent()
+
+    def timeout(self, test, timeout_multiplier):
+        """Shortened timeout in seconds for a test, including the timeout
+        multiplier, or None if the test should get its full timeout"""
+        if test.has_subtest_metadata():
+            # The subtest results would be lost if the test timed out
+            return None
+        if test.expected() == "TIMEOUT":
+            timeout = self.floor
+        else:
+            timeout = self.timeouts.get(test.id)
+        if timeout is None or timeout >= test.timeout * timeout_multiplier:
+            return None
+        with self.lock:
+            self.shortened += 1
+        return timeout
+
+    def should_retry(self, test, status):
+        """Whether to rerun a test with the full timeout after it ended with
+        status with a shortened timeout"""
+        return self.retry and status in timeout_statuses and not self.expects_timeout(test)
+
+    def record(self, full_timeout, timeout, status, retry):
+        """Record the result of running a test with a shortened timeout.
+
+        :param full_timeout: Full timeout of the test in seconds
+        :param timeout: Shortened timeout in seconds
+        :param status: Status of the test
+        :param retry: Whether the test is being rerun with the full timeout
+        """
+        if status not in timeout_statuses:
+            return
+        with self.lock:
+            self.cut_short += 1
+            if retry:
+                self.retried += 1
+                self.time_saved -= timeout
+            else:
+                self.time_saved += full_timeout - timeout
+
+    def record_restart(self, duration):
+        """Record the time taken to restart the browser after a test with a
+        shortened timeout was stopped.
+
+        :param duration: Time taken by the restart in seconds
+        """
+        with self.lock:
+            self.restarts += 1
+            self.time_saved -= duration
+
+    def summary(self):
+        rv = ("Shortened the timeouts of %i tests, of which %i timed out, saving %.1fs "
+              "including %i browser restarts" %
+              (self.shortened, self.cut_short, self.time_saved, self.restarts))
+        if self.retry:
+            rv += "; %i were rerun with the full timeout" % self.retried
+        return rv
+
+
+def from_kwargs(kwargs):
+    """TimeoutTuner for the command line arguments, or None if timeouts
+    aren't being shortened"""
+    if not kwargs.get("timeout_history") or kwargs.get("debug_info") is not None:
+        return None
+    return TimeoutTuner(read_durations(kwargs["timeout_history"]),
+                        factor=kwargs["timeout_history_factor"],
+                        floor=kwargs["timeout_history_floor"],
+                        retry=kwargs["timeout_history_retry"])
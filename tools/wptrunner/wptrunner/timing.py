@@ -0,0 +1,220 @@
+"""Per-test timings of the phases of running a test, and summaries of the
+timings recorded in raw logs.
+
+Timings are attached to the extra data of each test_end log message as
+a dictionary of phase name to seconds. Phases recorded by the
+TestRunnerManager don't overlap, and together cover the time spent on each
+test; the executor phases break down the time of the run phase.
+"""
+
+import json
+import posixpath
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from mozlog import reader
+from six import iteritems
+
+# Key of the timings in the extra data of test_end messages
+extra_key = "phase_timings"
+
+# Phases recorded by the TestRunnerManager and BrowserManager. Browser
+# restarts are counted towards the test that runs after the restart.
+manager_phases = [
+    ("queue_wait", "Waiting for the next test from the test queue"),
+    ("browser_stop", "Stopping the browser"),
+    ("browser_start", "Starting the browser, or waiting for a standby browser"),
+    ("runner_start", "Starting the TestRunner process and connecting to the browser"),
+    ("run", "Running the test, from sending it to the TestRunner to getting its results"),
+    ("log", "Logging the results of subtests"),
+]
+
+# Phases recorded by executors, as part of the run phase
+executor_phases = [
+    ("setup", "Setting timeouts and clearing state before loading the test"),
+    ("navigation", "Opening the test window and loading the test"),
+    ("script", "Waiting for the test to complete and send its results"),
+    ("screenshot", "Waiting for reftest-wait and taking screenshots"),
+    ("hash", "Hashing and storing screenshots"),
+    ("compare", "Comparing screenshots"),
+]
+
+# Time in the run phase that isn't accounted for by executor phases, such
+# as sending messages between processes; computed when summarising logs
+run_other = "run_other"
+
+
+class PhaseTimer(object):
+    def __init__(self):
+        """Accumulates the time spent in each phase of running a test."""
+        self.timings = {}
+
+    @contextmanager
+    def phase(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, time.time() - start)
+
+    def add(self, name, duration):
+        self.timings[name] = self.timings.get(name, 0) + duration
+
+    def update(self, timings):
+        for name, duration in iteritems(timings):
+            self.add(name, duration)
+
+    def pop(self):
+        """Return the timings recorded so far, rounded to milliseconds, and
+        start again."""
+        rv = {name: round(duration, 3) for name, duration in iteritems(self.timings)}
+        self.timings = {}
+        return rv
+
+
+class TimingHandler(reader.LogHandler):
+    def __init__(self):
+        self.timings = []
+
+    def test_end(self, data):
+        timings = data.get("extra", {}).get(extra_key)
+        if timings:
+            self.timings.append((data["test"], timings))
+
+
+def read_timings(log_files):
+    """Get the timings of each test from raw log files.
+
+    :param log_files: Iterable of open raw log files
+    :returns: List of (test id, {phase: seconds}) tuples
+    """
+    handler = TimingHandler()
+    for log_file in log_files:
+        reader.handle_log(reader.read(log_file), handler)
+    return handler.timings
+
+
+def test_dir(test_id, depth):
+    path = test_id.split("?", 1)[0].split("#", 1)[0]
+    parts = [item for item in posixpath.dirname(path).split("/") if item]
+    return "/" + "/".join(parts[:depth])
+
+
+def percentile(values, fraction):
+    """Value at the given fraction of the sorted list values"""
+    if not values:
+        return 0
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def summarise(timings, depth=2):
+    """Aggregate per-test timings by phase and by directory.
+
+    :param timings: List of (test id, {phase: seconds}) tuples
+    :param depth: Number of path components of the directories to group
+                  tests by
+    :returns: Dictionary with the total time, a summary of each phase and
+              the time spent in each phase for each directory
+    """
+    phase_values = defaultdict(list)
+    dirs = defaultdict(lambda: {"tests": 0, "total": 0, "phases": defaultdict(float)})
+    executor_names = set(name for name, _ in executor_phases)
+    total = 0
+
+    for test_id, test_timings in timings:
+        test_timings = dict(test_timings)
+        if "run" in test_timings:
+            executor_time = sum(value for name, value in iteritems(test_timings)
+                                if name in executor_names)
+            test_timings[run_other] = max(test_timings["run"] - executor_time, 0)
+        # Executor phases are part of the run phase, so aren't counted
+        # towards the total
+        test_total = sum(value for name, value in iteritems(test_timings)
+                         if name not in executor_names and name != run_other)
+        total += test_total
+
+        dir_data = dirs[test_dir(test_id, depth)]
+        dir_data["tests"] += 1
+        dir_data["total"] += test_total
+        for name, value in iteritems(test_timings):
+            phase_values[name].append(value)
+            dir_data["phases"][name] += value
+
+    phases = {}
+    for name, values in iteritems(phase_values):
+        values.sort()
+        phase_total = sum(values)
+        phases[name] = {"tests": len(values),
+                        "total": phase_total,
+                        "mean": phase_total / len(values),
+                        "median": percentile(values, 0.5),
+                        "p95": percentile(values, 0.95),
+                        "max": values[-1]}
+
+    return {"tests": len(timings),
+            "total": total,
+            "phases": phases,
+            "dirs": {name: {"tests": value["tests"],
+                            "total": value["total"],
+                            "phases": dict(value["phases"])}
+                     for name, value in iteritems(dirs)}}
+
+
+def phase_order(phases):
+    """Sort phase names into the order they happen in, with any unknown
+    phases at the end"""
+    known = ([name for name, _ in manager_phases] + [name for name, _ in executor_phases] +
+             [run_other])
+    return sorted(phases, key=lambda name: (known.index(name) if name in known else len(known),
+                                            name))
+
+
+def format_table(headings, rows):
+    widths = [max(len(str(row[i])) for row in [headings] + rows)
+              for i in range(len(headings))]
+    lines = []
+    for row in [headings] + rows:
+        lines.append("  ".join(str(value).ljust(width) if i == 0 else str(value).rjust(width)
+                               for i, (value, width) in enumerate(zip(row, widths))))
+    lines.insert(1, "  ".join("-" * width for width in widths))
+    return "\n".join(lines)
+
+
+def format_text(summary, limit=20):
+    """Format a summary returned by summarise as plain text tables"""
+    total = summary["total"]
+    executor_names = set(name for name, _ in executor_phases) | {run_other}
+
+    def percent(value):
+        return "%.1f%%" % (100. * value / total if total else 0)
+
+    rows = []
+    for name in phase_order(summary["phases"]):
+        data = summary["phases"][name]
+        label = "  " + name if name in executor_names else name
+        rows.append([label, data["tests"], "%.1f" % data["total"], percent(data["total"]),
+                     "%.3f" % data["mean"], "%.3f" % data["median"], "%.3f" % data["p95"],
+                     "%.3f" % data["max"]])
+    output = ["%i tests, %.1fs in total" % (summary["tests"], total),
+              "",
+              "Time by phase (seconds; indented phases are part of run)",
+              format_table(["phase", "tests", "total", "%", "mean", "median", "p95", "max"],
+                           rows)]
+
+    dirs = sorted(iteritems(summary["dirs"]), key=lambda item: -item[1]["total"])
+    if limit:
+        dirs = dirs[:limit]
+    columns = phase_order(set(name for _, data in dirs for name in data["phases"]))
+    rows = []
+    for name, data in dirs:
+        rows.append([name, data["tests"], "%.1f" % data["total"], percent(data["total"])] +
+                    ["%.1f" % data["phases"].get(phase, 0) for phase in columns])
+    output.extend(["",
+                   "Time by directory (seconds)",
+                   format_table(["directory", "tests", "total", "%"] + columns, rows)])
+    return "\n".join(output)
+
+
+def format_json(summary):
+    return json.dumps(summary, indent=2, sort_keys=True)
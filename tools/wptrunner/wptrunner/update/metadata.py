@@ -30,7 +30,8 @@ class UpdateExpected(Step):
                                  sync_root=sync_root,
                                  disable_intermittent=state.disable_intermittent,
                                  update_intermittent=state.update_intermittent,
-                                 remove_intermittent=state.remove_intermittent)
+                                 remove_intermittent=state.remove_intermittent,
+                                 processes=state.processes)
 
 
 class CreateMetadataPatch(Step):
@@ -94,6 +94,7 @@ class UpdateMetadata(Step):
             state.config = kwargs["config"]
             state.full_update = kwargs["full"]
             state.extra_properties = kwargs["extra_property"]
+            state.processes = kwargs["processes"]
             runner = MetadataUpdateRunner(self.logger, state)
             runner.run()
 
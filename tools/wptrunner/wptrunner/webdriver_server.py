@@ -1,10 +1,13 @@
 import abc
 import errno
+import json
 import os
 import platform
 import socket
+import threading
 import time
 import traceback
+from six.moves.http_client import HTTPConnection
 
 import mozprocess
 
@@ -12,13 +15,20 @@ import mozprocess
 __all__ = ["SeleniumServer", "ChromeDriverServer", "CWTChromeDriverServer",
            "EdgeChromiumDriverServer", "OperaDriverServer", "GeckoDriverServer",
            "InternetExplorerDriverServer", "EdgeDriverServer",
-           "ServoDriverServer", "WebKitDriverServer", "WebDriverServer"]
+           "ServoDriverServer", "WebKitDriverServer", "WebDriverServer",
+           "WebDriverServerPool"]
+
+# Pool of running servers, set by WebDriverServerPool for the duration of a run
+server_pool = None
 
 
 class WebDriverServer(object):
     __metaclass__ = abc.ABCMeta
 
     default_base_path = "/"
+    # Maximum number of sessions the server supports at once, or None if it
+    # supports any number
+    max_sessions = 1
 
     def __init__(self, logger, binary, host="127.0.0.1", port=None,
                  base_path="", env=None, args=None):
@@ -36,6 +46,7 @@ class WebDriverServer(object):
         self.env = os.environ.copy() if env is None else env
 
         self._port = port
+        self._fixed_port = port is not None
         self._cmd = None
         self._args = args if args is not None else []
         self._proc = None
@@ -45,8 +56,14 @@ class WebDriverServer(object):
         """Returns the full command for starting the server process as a list."""
 
     def start(self, block=False):
+        pool = active_pool()
+        if pool is not None and not block and pool.attach(self):
+            return
         try:
+            start_time = time.time()
             self._run(block)
+            if pool is not None and not block:
+                pool.add(self, time.time() - start_time)
         except KeyboardInterrupt:
             self.stop()
 
@@ -81,11 +98,33 @@ class WebDriverServer(object):
             self._proc.wait()
 
     def stop(self, force=False):
+        pool = active_pool()
+        if pool is not None and pool.detach(self, force):
+            return True
         self.logger.debug("Stopping WebDriver")
         if self.is_alive:
             return self._proc.kill()
         return not self.is_alive
 
+    def status(self, timeout=2):
+        """Get the value returned by the server's status endpoint, or None if
+        it doesn't respond successfully."""
+        conn = HTTPConnection(self.host, self.port, timeout=timeout)
+        try:
+            conn.request("GET", self.base_path.rstrip("/") + "/status")
+            response = conn.getresponse()
+            if response.status != 200:
+                return None
+            return json.loads(response.read()).get("value", {})
+        except (socket.error, ValueError, AttributeError):
+            return None
+        finally:
+            conn.close()
+
+    def pool_key(self):
+        """Key identifying servers that are interchangeable with this one"""
+        return (type(self), self.binary, tuple(self._args), self.host, self.base_path)
+
     @property
     def is_alive(self):
         return hasattr(self._proc, "proc") and self._proc.poll() is None
@@ -119,6 +158,8 @@ class SeleniumServer(WebDriverServer):
 
 
 class ChromeDriverServer(WebDriverServer):
+    max_sessions = None
+
     def __init__(self, logger, binary="chromedriver", port=None,
                  base_path="", args=None):
         WebDriverServer.__init__(
@@ -138,6 +179,8 @@ class CWTChromeDriverServer(WebDriverServer):
                 "--port=%s" % str(self.port)] + self._args
 
 class EdgeChromiumDriverServer(WebDriverServer):
+    max_sessions = None
+
     def __init__(self, logger, binary="msedgedriver", port=None,
                  base_path="", args=None):
         WebDriverServer.__init__(
@@ -227,6 +270,175 @@ class WebKitDriverServer(WebDriverServer):
         return [self.binary, "--port=%s" % str(self.port)] + self._args
 
 
+class PooledServer(object):
+    def __init__(self, key, proc, cmd, port, start_time, max_sessions):
+        self.key = key
+        self.proc = proc
+        self.cmd = cmd
+        self.port = port
+        self.start_time = start_time
+        self.max_sessions = max_sessions
+        self.sessions = 1
+        # Set when the server may be unusable, so it is stopped once it has
+        # no remaining users rather than being reused
+        self.retired = False
+
+    @property
+    def is_alive(self):
+        return self.proc.poll() is None
+
+
+class WebDriverServerPool(object):
+    def __init__(self, logger):
+        """Pool of WebDriver server processes shared by all the test runner
+        managers in a run, keyed by server type, binary and arguments.
+
+        When a browser stops, its server is returned to the pool rather than
+        being killed, so that restarting the browser only needs a new
+        WebDriver session. Servers that support several sessions at once are
+        also shared between managers. A server is checked with its status
+        endpoint before it is reused, and is killed rather than reused if the
+        browser was stopped forcibly.
+
+        A thread that stops a browser while its test runner may still be using
+        the WebDriver session holds the server with hold_detached until the
+        runner has stopped, and then returns it with release_held.
+
+        Use as a context manager; servers are only pooled in the process that
+        entered it.
+        """
+        self.logger = logger
+        self.servers = []
+        self.lock = threading.Lock()
+        # Servers detached while the current thread holds them, as a list of
+        # (entry, force) tuples
+        self.held = threading.local()
+        self.pid = None
+        self.reused = 0
+        self.started = 0
+        self.time_saved = 0
+
+    def __enter__(self):
+        global server_pool
+        self.pid = os.getpid()
+        server_pool = self
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        global server_pool
+        server_pool = None
+        with self.lock:
+            servers, self.servers = self.servers, []
+        for entry in servers:
+            if entry.is_alive:
+                entry.proc.kill()
+
+    def attach(self, server):
+        """Make server use a running server process from the pool, if there
+        is a suitable one.
+
+        :returns: Boolean indicating whether a pooled server was used
+        """
+        key = server.pool_key()
+        with self.lock:
+            candidates = [entry for entry in self.servers
+                          if entry.key == key and not entry.retired and
+                          (entry.max_sessions is None or entry.sessions < entry.max_sessions) and
+                          (not server._fixed_port or entry.port == server._port)]
+            # Prefer servers without any current users
+            candidates.sort(key=lambda entry: entry.sessions)
+            for entry in candidates:
+                entry.sessions += 1
+                break
+            else:
+                return False
+
+        server._proc = entry.proc
+        server._cmd = entry.cmd
+        server._port = entry.port
+        if entry.is_alive and server.status() is not None:
+            with self.lock:
+                self.reused += 1
+                self.time_saved += entry.start_time
+            self.logger.debug("Reusing WebDriver server at %s" % server.url)
+            return True
+
+        self.logger.info("WebDriver server at %s is not responding, starting a new one" %
+                         server.url)
+        self.detach(server, True)
+        return False
+
+    def add(self, server, start_time):
+        """Add a newly started server, used by one browser, to the pool"""
+        with self.lock:
+            self.started += 1
+            self.servers.append(PooledServer(server.pool_key(), server._proc, server._cmd,
+                                             server.port, start_time, server.max_sessions))
+
+    def detach(self, server, force=False):
+        """Record that a browser has stopped using a server. The server
+        process is killed if it may be unusable and has no other users.
+        If the current thread is holding detached servers, this only happens
+        once they are released.
+
+        :returns: Boolean indicating whether the server was from the pool
+        """
+        with self.lock:
+            for entry in self.servers:
+                if entry.proc is server._proc:
+                    break
+            else:
+                return False
+
+        held = getattr(self.held, "servers", None)
+        if held is not None:
+            held.append((entry, force))
+        else:
+            self._release(entry, force)
+        server._proc = None
+        if not server._fixed_port:
+            server._port = None
+        return True
+
+    def hold_detached(self):
+        """Keep servers detached on the current thread in use until
+        release_held is called."""
+        self.held.servers = []
+
+    def release_held(self, force=False):
+        """Release the servers detached on the current thread since
+        hold_detached was called.
+
+        :param force: Retire the servers, because the session may not have
+                      ended cleanly
+        """
+        held = getattr(self.held, "servers", None)
+        self.held.servers = None
+        for entry, entry_force in held or []:
+            self._release(entry, force or entry_force)
+
+    def _release(self, entry, force):
+        with self.lock:
+            entry.sessions -= 1
+            if force or not entry.is_alive:
+                entry.retired = True
+            stop = entry.retired and entry.sessions <= 0
+            if stop and entry in self.servers:
+                self.servers.remove(entry)
+
+        if stop and entry.is_alive:
+            self.logger.debug("Stopping WebDriver")
+            entry.proc.kill()
+
+
+def active_pool():
+    """The server pool for the current run, if there is one in this process"""
+    pool = server_pool
+    if pool is not None and pool.pid == os.getpid():
+        return pool
+    return None
+
+
 def cmd_arg(name, value=None):
     prefix = "-" if platform.system() == "Windows" else "--"
     rv = prefix + name
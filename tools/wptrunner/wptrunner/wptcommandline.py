@@ -1,5 +1,6 @@
 from __future__ import print_function
 import argparse
+import multiprocessing
 import os
 import sys
 from collections import OrderedDict
@@ -8,7 +9,7 @@ from datetime import timedelta
 
 from . import config
 from . import wpttest
-from .formatters import chromium, wptreport, wptscreenshot
+from .formatters import chromium, resultsarchive, wptreport, wptscreenshot
 
 def abs_path(path):
     return os.path.abspath(os.path.expanduser(path))
@@ -58,12 +59,61 @@ scheme host and port.""")
 
     parser.add_argument("--timeout-multiplier", action="store", type=float, default=None,
                         help="Multiplier relative to standard test timeout to use")
+    parser.add_argument("--timeout-history", action="append", type=abs_path, default=None,
+                        help="wptreport or raw log, or results archive, from earlier runs. "
+                        "Tests that completed in enough of the runs get a timeout based on "
+                        "their durations, when that is shorter than their full timeout, and "
+                        "tests expected to time out get the minimum timeout. Tests with "
+                        "subtest expectations keep their full timeout. May be given "
+                        "more than once")
+    parser.add_argument("--timeout-history-factor", action="store", type=float, default=3.0,
+                        help="With --timeout-history, multiple of the 99th percentile "
+                        "duration of a test to use as its timeout")
+    parser.add_argument("--timeout-history-floor", action="store", type=float, default=5.0,
+                        help="With --timeout-history, minimum timeout in seconds")
+    parser.add_argument("--timeout-history-retry", action="store_true", default=False,
+                        help="With --timeout-history, rerun tests that unexpectedly time out "
+                        "with a shortened timeout once more with their full timeout, and "
+                        "report only that result")
     parser.add_argument("--run-by-dir", type=int, nargs="?", default=False,
                         help="Split run into groups by directories. With a parameter,"
                         "limit the depth of splits e.g. --run-by-dir=1 to split by top-level"
                         "directory")
     parser.add_argument("--processes", action="store", type=int, default=None,
                         help="Number of simultaneous processes to use")
+    parser.add_argument("--prewarm-browser", action="store_true", default=False,
+                        help="Launch a standby browser in the background so that browser "
+                        "restarts can use an already started instance")
+    parser.add_argument("--stream-tests", action="store_true", default=False,
+                        help="Start running tests while later tests are still being loaded")
+    parser.add_argument("--metadata-processes", action="store", type=int, default=None,
+                        help="Number of processes to use for compiling expectation metadata. "
+                        "Defaults to the number of CPUs with --stream-tests, otherwise 1")
+    parser.add_argument("--metadata-cache", action="store_true", default=False,
+                        help="Cache compiled expectation metadata between runs, in the .cache "
+                        "directory of each metadata path")
+    parser.add_argument("--reuse-window", action="store_true", default=False,
+                        help="With WebDriver, load testharness tests that don't use testdriver "
+                        "into a single test window from the runner page, using one WebDriver "
+                        "command per test")
+    parser.add_argument("--result-channel", action="store_true", default=False,
+                        help="With WebDriver and Marionette, have testharness tests post their "
+                        "results and testdriver actions to a socket owned by the test runner, "
+                        "rather than collecting them with long-running scripts")
+    parser.add_argument("--webdriver-server-pool", action="store_true", default=False,
+                        help="Reuse running WebDriver servers when a browser is restarted, rather "
+                        "than starting a new server each time")
+    parser.add_argument("--wdspec-worker", action="store_true", default=False,
+                        help="Run wdspec tests in a long-lived pytest worker process, rather "
+                        "than starting pytest in the test runner process for each test file")
+    parser.add_argument("--reftest-screenshot-dir", action="store", type=abs_path, default=None,
+                        help="Directory in which to store reftest screenshots. Defaults to a "
+                        "temporary directory that is removed at the end of the run")
+    parser.add_argument("--reftest-screenshot-max-size", action="store", type=int, default=1024,
+                        help="Maximum size in MB of cached reftest screenshots")
+    parser.add_argument("--reftest-screenshot-files", action="store_true", default=False,
+                        help="Refer to files in --reftest-screenshot-dir from the logged "
+                        "reftest_screenshots rather than including the image data")
 
     parser.add_argument("--no-capture-stdio", action="store_true", default=False,
                         help="Don't capture stdio and write to logging")
@@ -113,6 +163,11 @@ scheme host and port.""")
                             default=None,
                             help="The maximum number of minutes for the job to run",
                             type=lambda x: timedelta(minutes=float(x)))
+    mode_group.add_argument("--verify-adaptive", action="store_true",
+                            default=False,
+                            help="Stop rerunning tests once they are known to be unstable, rerun the "
+                            "tests closest to timing out first, and check --verify-max-time between "
+                            "iterations rather than only between steps")
     output_results_group = mode_group.add_mutually_exclusive_group()
     output_results_group.add_argument("--verify-no-output-results", action="store_false",
                                       dest="verify_output_results",
@@ -173,6 +228,17 @@ scheme host and port.""")
 
     debugging_group.add_argument("--pdb", action="store_true",
                                  help="Drop into pdb on python exception")
+    debugging_group.add_argument("--profile-harness", action="store_true",
+                                 help="Profile the harness in the main process, each TestRunnerManager "
+                                 "thread and each TestRunner process by sampling their stacks, "
+                                 "writing a collapsed-stack file for flame graphs for each")
+    debugging_group.add_argument("--profile-harness-dir", action="store", type=abs_path,
+                                 help="Directory to write harness profiles to. Defaults to the "
+                                 "directory of the first log file, or the current directory")
+    debugging_group.add_argument("--profile-harness-cprofile", action="store_true",
+                                 help="Also profile the harness with cProfile, writing a pstats file "
+                                 "for each profiled thread or process. This is much slower than "
+                                 "sampling")
 
     config_group = parser.add_argument_group("Configuration")
     config_group.add_argument("--binary", action="store",
@@ -339,8 +405,18 @@ scheme host and port.""")
                                       "Cache API (default: %s)" % wptscreenshot.DEFAULT_API,
                                       {"wptscreenshot"}, "store")
 
+    def compress_wrapper(formatter, compress):
+        formatter.compress = compress
+        return formatter
+
+    commandline.fmt_options["compress"] = (compress_wrapper,
+                                           "Write gzip-compressed output",
+                                           {"wptreport"}, "store_true")
+
     commandline.log_formatters["chromium"] = (chromium.ChromiumFormatter, "Chromium Layout Tests format")
     commandline.log_formatters["wptreport"] = (wptreport.WptreportFormatter, "wptreport format")
+    commandline.log_formatters["resultsarchive"] = (resultsarchive.ResultsArchiveFormatter,
+                                                    "Results archive format")
     commandline.log_formatters["wptscreenshot"] = (wptscreenshot.WptscreenshotFormatter, "wpt.fyi screenshots")
 
     commandline.add_logging_group(parser)
@@ -488,6 +564,13 @@ def check_args(kwargs):
     if kwargs["processes"] is None:
         kwargs["processes"] = 1
 
+    if kwargs["metadata_processes"] is None:
+        kwargs["metadata_processes"] = multiprocessing.cpu_count() if kwargs["stream_tests"] else 1
+
+    if kwargs["reftest_screenshot_files"] and kwargs["reftest_screenshot_dir"] is None:
+        print("--reftest-screenshot-files requires --reftest-screenshot-dir", file=sys.stderr)
+        sys.exit(1)
+
     if kwargs["debugger"] is not None:
         import mozdebug
         if kwargs["debugger"] == "__default__":
@@ -557,9 +640,26 @@ def check_args(kwargs):
     if kwargs["enable_webrender"] is None:
         kwargs["enable_webrender"] = False
 
+    if kwargs["profile_harness_cprofile"]:
+        kwargs["profile_harness"] = True
+
+    if kwargs["profile_harness"] and kwargs["profile_harness_dir"] is None:
+        kwargs["profile_harness_dir"] = log_dir(kwargs) or os.getcwd()
+
     return kwargs
 
 
+def log_dir(kwargs):
+    """Directory of the first log file given on the command line, if any"""
+    for key, value in sorted(kwargs.items()):
+        if not key.startswith("log_") or not isinstance(value, list):
+            continue
+        for log_file in value:
+            name = getattr(log_file, "name", None)
+            if name and not name.startswith("<"):
+                return os.path.dirname(os.path.abspath(name))
+
+
 def check_args_update(kwargs):
     set_from_config(kwargs)
 
@@ -573,6 +673,9 @@ def check_args_update(kwargs):
             print("Log file %s is a directory" % item, file=sys.stderr)
             sys.exit(1)
 
+    if kwargs["processes"] == 0:
+        kwargs["processes"] = multiprocessing.cpu_count()
+
     return kwargs
 
 
@@ -632,6 +735,9 @@ def create_parser_update(product_choices=None):
                         help="List of glob-style paths to include which would otherwise be excluded when syncing tests")
     parser.add_argument("--extra-property", action="append", default=[],
                         help="Extra property from run_info.json to use in metadata update")
+    parser.add_argument("--processes", action="store", type=int, default=1,
+                        help="Number of processes to use to read logs and update metadata files, "
+                        "or 0 for one per CPU")
     # Should make this required iff run=logfile
     parser.add_argument("run_log", nargs="*", type=abs_path,
                         help="Log file from run of tests")
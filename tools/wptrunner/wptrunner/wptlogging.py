@@ -1,4 +1,6 @@
 import logging
+import os
+import sys
 
 from mozlog import commandline, stdadapter, set_default_logger
 from mozlog.structuredlog import StructuredLogger
@@ -11,6 +13,7 @@ def setup(args, defaults):
         StructuredLogger._logger_states["web-platform-tests"] = logger._state
     else:
         logger = commandline.setup_logging("web-platform-tests", args, defaults)
+        use_binary_streams(logger)
     setup_stdlib_logger()
 
     for name in args.keys():
@@ -20,6 +23,32 @@ def setup(args, defaults):
     return logger
 
 
+def use_binary_streams(logger):
+    """Write the output of formatters that produce binary data to a binary
+    stream, since log files are opened in text mode.
+
+    Python 2 files have no underlying binary file, so log files are instead
+    reopened in binary mode; otherwise newlines in the output would be
+    translated on Windows."""
+    for handler in logger.handlers:
+        formatter = getattr(handler, "formatter", None)
+        if not getattr(formatter, "binary", False):
+            continue
+        stream = handler.stream
+        if hasattr(stream, "buffer"):
+            stream.flush()
+            handler.stream = stream.buffer
+        elif "b" not in getattr(stream, "mode", "b"):
+            name = getattr(stream, "name", None)
+            if name is not None and os.path.isfile(name):
+                stream.flush()
+                handler.stream = open(name, "ab")
+                stream.close()
+            elif sys.platform == "win32":
+                raise ValueError("%s output is binary, so it can't be written to %s" %
+                                 (type(formatter).__name__, name or "a text stream"))
+
+
 def setup_stdlib_logger():
     logging.root.handlers = []
     logging.root = stdadapter.std_logging_adapter(logging.root)
@@ -14,6 +14,8 @@
 
 from __future__ import unicode_literals
 
+import re
+
 from six import binary_type, text_type, BytesIO
 
 from .node import (Node, AtomNode, BinaryExpressionNode, BinaryOperatorNode,
@@ -64,6 +66,22 @@ class TokenTypes(object):
 
 token_types = TokenTypes()
 
+# Runs of characters that don't need any special handling in the various
+# tokenizer states. Matching these with a regexp rather than one character
+# at a time is much faster for typical input.
+space_re = re.compile(r" *")
+heading_run_re = re.compile(r"[^\\\]]*")
+key_run_re = re.compile(r"[^ :\\]*")
+string_run_res = {"'": re.compile(r"[^\\']*"),
+                  '"': re.compile(r'[^\\"]*')}
+# These match either a run of ordinary characters or a run of spaces, since
+# spaces are only included in the value when followed by an ordinary character
+list_value_run_re = re.compile(r"([^\\#,\] ]+)|( +)")
+value_run_re = re.compile(r"([^\\# ]+)|( +)")
+operator_run_re = re.compile(r"[=!]*")
+number_run_re = re.compile(r"[0-9.]*")
+ident_run_re = re.compile(r"[^.\[\]()=! :]*")
+
 
 class Tokenizer(object):
     def __init__(self):
@@ -86,18 +104,17 @@ class Tokenizer(object):
             self.filename = stream.name
 
         self.next_line_state = self.line_start_state
+        eol_state = self.eol_state
         for i, line in enumerate(stream):
             assert isinstance(line, binary_type)
             self.state = self.next_line_state
             assert self.state is not None
-            states = []
             self.next_line_state = None
             self.line_number = i + 1
             self.index = 0
             self.line = line.decode('utf-8').rstrip()
-            assert isinstance(self.line, text_type)
-            while self.state != self.eol_state:
-                states.append(self.state)
+            self.line_length = len(self.line)
+            while self.state != eol_state:
                 tokens = self.state()
                 if tokens:
                     for token in tokens:
@@ -107,20 +124,46 @@ class Tokenizer(object):
             yield (token_types.eof, None)
 
     def char(self):
-        if self.index == len(self.line):
+        if self.index == self.line_length:
             return eol
         return self.line[self.index]
 
     def consume(self):
-        if self.index < len(self.line):
+        if self.index < self.line_length:
             self.index += 1
 
     def peek(self, length):
         return self.line[self.index:self.index + length]
 
+    def consume_run(self, regexp):
+        """Consume the characters matching regexp at the current position and
+        return them"""
+        index_0 = self.index
+        self.index = regexp.match(self.line, index_0).end()
+        return self.line[index_0:self.index]
+
+    def consume_value_run(self, regexp, rv, spaces):
+        """Consume ordinary characters and spaces matching regexp, which must
+        have one group for each.
+
+        :returns: A tuple of the new value and the number of spaces since the
+                  last ordinary character
+        """
+        while True:
+            m = regexp.match(self.line, self.index)
+            if not m:
+                return rv, spaces
+            self.index = m.end()
+            if m.group(1) is not None:
+                if spaces:
+                    rv += " " * spaces
+                    spaces = 0
+                rv += m.group(1)
+            else:
+                spaces += len(m.group(2))
+
     def skip_whitespace(self):
-        while self.char() == " ":
-            self.consume()
+        self.index = space_re.match(self.line, self.index).end()
 
     def eol_state(self):
         if self.next_line_state is None:
@@ -158,16 +201,15 @@ class Tokenizer(object):
     def heading_state(self):
         rv = ""
         while True:
+            rv += self.consume_run(heading_run_re)
             c = self.char()
             if c == "\\":
                 rv += self.consume_escape()
             elif c == "]":
                 break
-            elif c == eol:
-                raise ParseError(self.filename, self.line_number, "EOL in heading")
             else:
-                rv += c
-                self.consume()
+                assert c == eol
+                raise ParseError(self.filename, self.line_number, "EOL in heading")
 
         yield (token_types.string, decode(rv))
         yield (token_types.paren, "]")
@@ -178,6 +220,7 @@ class Tokenizer(object):
     def key_state(self):
         rv = ""
         while True:
+            rv += self.consume_run(key_run_re)
             c = self.char()
             if c == " ":
                 self.skip_whitespace()
@@ -188,11 +231,9 @@ class Tokenizer(object):
                 break
             elif c == eol:
                 raise ParseError(self.filename, self.line_number, "EOL in key name (missing ':'?)")
-            elif c == "\\":
-                rv += self.consume_escape()
             else:
-                rv += c
-                self.consume()
+                assert c == "\\"
+                rv += self.consume_escape()
         yield (token_types.string, decode(rv))
         yield (token_types.separator, ":")
         self.consume()
@@ -262,6 +303,7 @@ class Tokenizer(object):
         rv = ""
         spaces = 0
         while True:
+            rv, spaces = self.consume_value_run(list_value_run_re, rv, spaces)
             c = self.char()
             if c == "\\":
                 escape = self.consume_escape()
@@ -274,18 +316,11 @@ class Tokenizer(object):
                 self.state = self.list_value_start_state
                 self.consume()
                 break
-            elif c == " ":
-                spaces += 1
-                self.consume()
-            elif c == "]":
+            else:
+                assert c == "]"
                 self.state = self.list_end_state
                 self.consume()
                 break
-            else:
-                rv += " " * spaces
-                spaces = 0
-                rv += c
-                self.consume()
 
         if rv:
             yield (token_types.string, decode(rv))
@@ -321,24 +356,20 @@ class Tokenizer(object):
         rv = ""
         spaces = 0
         while True:
+            # Spaces are only added to the value when followed by another
+            # character, to prevent whitespace before comments from being
+            # included in the value
+            rv, spaces = self.consume_value_run(value_run_re, rv, spaces)
             c = self.char()
             if c == "\\":
                 rv += self.consume_escape()
             elif c == "#":
                 self.state = self.comment_state
                 break
-            elif c == " ":
-                # prevent whitespace before comments from being included in the value
-                spaces += 1
-                self.consume()
-            elif c == eol:
+            else:
+                assert c == eol
                 self.state = self.line_end_state
                 break
-            else:
-                rv += " " * spaces
-                spaces = 0
-                rv += c
-                self.consume()
         rv = decode(rv)
         if rv.startswith("if "):
             # Hack to avoid a problem where people write
@@ -349,8 +380,7 @@ class Tokenizer(object):
         yield (token_types.string, rv)
 
     def comment_state(self):
-        while self.char() is not eol:
-            self.consume()
+        self.index = self.line_length
         self.state = self.eol_state
 
     def line_end_state(self):
@@ -365,18 +395,18 @@ class Tokenizer(object):
 
     def consume_string(self, quote_char):
         rv = ""
+        run_re = string_run_res[quote_char]
         while True:
+            rv += self.consume_run(run_re)
             c = self.char()
             if c == "\\":
                 rv += self.consume_escape()
             elif c == quote_char:
                 self.consume()
                 break
-            elif c == eol:
-                raise ParseError(self.filename, self.line_number, "EOL in quoted string")
             else:
-                rv += c
-                self.consume()
+                assert c == eol
+                raise ParseError(self.filename, self.line_number, "EOL in quoted string")
 
         return decode(rv)
 
@@ -412,66 +442,26 @@ class Tokenizer(object):
 
     def operator_state(self):
         # Only symbolic operators
-        index_0 = self.index
-        while True:
-            c = self.char()
-            if c == eol:
-                break
-            elif c in operator_chars:
-                self.consume()
-            else:
-                self.state = self.expr_state
-                break
-        yield (token_types.ident, self.line[index_0:self.index])
+        value = self.consume_run(operator_run_re)
+        if self.index < self.line_length:
+            self.state = self.expr_state
+        yield (token_types.ident, value)
 
     def digit_state(self):
-        index_0 = self.index
-        seen_dot = False
-        while True:
-            c = self.char()
-            if c == eol:
-                break
-            elif c in digits:
-                self.consume()
-            elif c == ".":
-                if seen_dot:
-                    raise ParseError(self.filename, self.line_number, "Invalid number")
-                self.consume()
-                seen_dot = True
-            elif c in parens:
-                break
-            elif c in operator_chars:
-                break
-            elif c == " ":
-                break
-            elif c == ":":
-                break
-            else:
-                raise ParseError(self.filename, self.line_number, "Invalid character in number")
+        value = self.consume_run(number_run_re)
+        if value.count(".") > 1:
+            raise ParseError(self.filename, self.line_number, "Invalid number")
+        c = self.char()
+        if c != eol and c not in parens and c not in operator_chars and c not in " :":
+            raise ParseError(self.filename, self.line_number, "Invalid character in number")
 
         self.state = self.expr_state
-        yield (token_types.number, self.line[index_0:self.index])
+        yield (token_types.number, value)
 
     def ident_state(self):
-        index_0 = self.index
-        while True:
-            c = self.char()
-            if c == eol:
-                break
-            elif c == ".":
-                break
-            elif c in parens:
-                break
-            elif c in operator_chars:
-                break
-            elif c == " ":
-                break
-            elif c == ":":
-                break
-            else:
-                self.consume()
+        value = self.consume_run(ident_run_re)
         self.state = self.expr_state
-        yield (token_types.ident, self.line[index_0:self.index])
+        yield (token_types.ident, value)
 
     def consume_escape(self):
         assert self.char() == "\\"
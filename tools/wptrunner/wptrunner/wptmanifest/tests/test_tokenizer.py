@@ -197,6 +197,21 @@ key: [a, #b]
              (token_types.string, "b"),
              (token_types.list_end, "]")])
 
+    def test_list_7(self):
+        self.compare(b"""key: [a  b , c d]""",
+            [(token_types.string, "key"),
+             (token_types.separator, ":"),
+             (token_types.list_start, "["),
+             (token_types.string, "a  b"),
+             (token_types.string, "c d"),
+             (token_types.list_end, "]")])
+
+    def test_value_spaces(self):
+        self.compare(br"""key: a  b\ c   # comment""",
+            [(token_types.string, "key"),
+             (token_types.separator, ":"),
+             (token_types.string, "a  b c")])
+
     def test_expr_0(self):
         self.compare(b"""
 key:
@@ -8,12 +8,15 @@ from wptserve import sslutils
 
 import environment as env
 import products
+import profiling
 import testloader
+import timeouts
 import wptcommandline
 import wptlogging
 import wpttest
 from mozlog import capture
 from font import FontInstaller
+from screenshotstore import ScreenshotCache
 from testrunner import ManagerGroup
 from browsers.base import NullBrowser
 
@@ -43,7 +46,7 @@ def setup_logging(*args, **kwargs):
     return logger
 
 
-def get_loader(test_paths, product, debug=None, run_info_extras=None, **kwargs):
+def get_loader(test_paths, product, debug=None, run_info_extras=None, lazy=False, **kwargs):
     if run_info_extras is None:
         run_info_extras = {}
 
@@ -76,7 +79,10 @@ def get_loader(test_paths, product, debug=None, run_info_extras=None, **kwargs):
                                         total_chunks=kwargs["total_chunks"],
                                         chunk_number=kwargs["this_chunk"],
                                         include_https=ssl_enabled,
-                                        skip_timeout=kwargs["skip_timeout"])
+                                        skip_timeout=kwargs["skip_timeout"],
+                                        lazy=lazy,
+                                        metadata_processes=kwargs["metadata_processes"],
+                                        cache_metadata=kwargs["metadata_cache"])
     return run_info, test_loader
 
 
@@ -121,7 +127,11 @@ def list_tests(test_paths, product, **kwargs):
 
 
 def get_pause_after_test(test_loader, **kwargs):
-    total_tests = sum(len(item) for item in test_loader.tests.itervalues())
+    if test_loader.lazy:
+        # Avoid loading all the tests just to count them
+        total_tests = len(test_loader.test_ids)
+    else:
+        total_tests = sum(len(item) for item in test_loader.tests.itervalues())
     if kwargs["pause_after_test"] is None:
         if kwargs["repeat_until_unexpected"]:
             return False
@@ -133,6 +143,25 @@ def get_pause_after_test(test_loader, **kwargs):
     return kwargs["pause_after_test"]
 
 
+def iter_runnable_tests(test_loader, test_type, executor_cls, skipped):
+    """Iterate over the tests of test_type that can be run with executor_cls,
+    logging the remaining tests as skipped.
+
+    :param skipped: List to which the ids of skipped tests are appended
+    """
+    for test, enabled in test_loader.iter_loaded_tests(test_type):
+        if (enabled and test_type == "testharness" and
+            ((test.testdriver and not executor_cls.supports_testdriver) or
+             (test.jsshell and not executor_cls.supports_jsshell))):
+            enabled = False
+        if enabled:
+            yield test
+        else:
+            logger.test_start(test.id)
+            logger.test_end(test.id, status="SKIP")
+            skipped.append(test.id)
+
+
 def run_tests(config, test_paths, product, **kwargs):
     with capture.CaptureIO(logger, not kwargs["no_capture_stdio"]):
         env.do_delayed_imports(logger, test_paths)
@@ -152,6 +181,7 @@ def run_tests(config, test_paths, product, **kwargs):
         run_info, test_loader = get_loader(test_paths,
                                            product.name,
                                            run_info_extras=product.run_info_extras(**kwargs),
+                                           lazy=kwargs["stream_tests"],
                                            **kwargs)
 
         test_source_kwargs = {"processes": kwargs["processes"]}
@@ -173,6 +203,7 @@ def run_tests(config, test_paths, product, **kwargs):
             for path in kwargs["test_list"]:
                 logger.error("  %s" % path)
             logger.error("Please check spelling and make sure there are tests in the specified path(s).")
+            test_loader.close()
             return False
         kwargs["pause_after_test"] = get_pause_after_test(test_loader, **kwargs)
 
@@ -184,13 +215,19 @@ def run_tests(config, test_paths, product, **kwargs):
 
         testharness_timeout_multipler = product.get_timeout_multiplier("testharness", run_info, **kwargs)
 
+        screenshot_cache = ScreenshotCache(kwargs["reftest_screenshot_dir"],
+                                           kwargs["reftest_screenshot_max_size"] * 1024 * 1024,
+                                           kwargs["reftest_screenshot_files"])
+
         with env.TestEnvironment(test_paths,
                                  testharness_timeout_multipler,
                                  kwargs["pause_after_test"],
                                  kwargs["debug_info"],
                                  product.env_options,
                                  ssl_config,
-                                 env_extras) as test_environment:
+                                 env_extras,
+                                 screenshot_cache,
+                                 kwargs["result_channel"]) as test_environment:
             try:
                 test_environment.ensure_started()
             except env.TestEnvironmentError as e:
@@ -200,8 +237,15 @@ def run_tests(config, test_paths, product, **kwargs):
             repeat = kwargs["repeat"]
             repeat_count = 0
             repeat_until_unexpected = kwargs["repeat_until_unexpected"]
+            adaptive_repeat = kwargs.get("adaptive_repeat")
+            timeout_tuner = timeouts.from_kwargs(kwargs)
+            if timeout_tuner is not None:
+                logger.info("Using duration history for %i tests" % len(timeout_tuner.timeouts))
 
             while repeat_count < repeat or repeat_until_unexpected:
+                if adaptive_repeat is not None and repeat_count > 0 and adaptive_repeat.is_finished():
+                    logger.info("Stopping after %i repetitions: out of time" % repeat_count)
+                    break
                 repeat_count += 1
                 if repeat_until_unexpected:
                     logger.info("Repetition %i" % (repeat_count))
@@ -213,7 +257,8 @@ def run_tests(config, test_paths, product, **kwargs):
                 logger.suite_start(test_loader.test_ids,
                                    name='web-platform-test',
                                    run_info=run_info,
-                                   extra={"run_by_dir": kwargs["run_by_dir"]})
+                                   extra={"run_by_dir": kwargs["run_by_dir"],
+                                          "rerun": kwargs["rerun"]})
                 for test_type in kwargs["test_types"]:
                     logger.info("Running %s tests" % test_type)
 
@@ -244,23 +289,13 @@ def run_tests(config, test_paths, product, **kwargs):
                                      (test_type, product.name))
                         continue
 
-                    for test in test_loader.disabled_tests[test_type]:
-                        logger.test_start(test.id)
-                        logger.test_end(test.id, status="SKIP")
-                        skipped_tests += 1
-
-                    if test_type == "testharness":
-                        run_tests = {"testharness": []}
-                        for test in test_loader.tests["testharness"]:
-                            if ((test.testdriver and not executor_cls.supports_testdriver) or
-                                (test.jsshell and not executor_cls.supports_jsshell)):
-                                logger.test_start(test.id)
-                                logger.test_end(test.id, status="SKIP")
-                                skipped_tests += 1
-                            else:
-                                run_tests["testharness"].append(test)
-                    else:
-                        run_tests = test_loader.tests
+                    skipped = []
+                    type_tests = iter_runnable_tests(test_loader, test_type, executor_cls, skipped)
+                    if adaptive_repeat is not None:
+                        type_tests = adaptive_repeat.select_tests(type_tests)
+                    elif not test_loader.lazy:
+                        type_tests = list(type_tests)
+                    run_tests = {test_type: type_tests}
 
                     with ManagerGroup("web-platform-tests",
                                       kwargs["processes"],
@@ -275,7 +310,12 @@ def run_tests(config, test_paths, product, **kwargs):
                                       kwargs["pause_on_unexpected"],
                                       kwargs["restart_on_unexpected"],
                                       kwargs["debug_info"],
-                                      not kwargs["no_capture_stdio"]) as manager_group:
+                                      not kwargs["no_capture_stdio"],
+                                      kwargs["prewarm_browser"],
+                                      kwargs["webdriver_server_pool"],
+                                      profiling.from_kwargs(kwargs),
+                                      adaptive_repeat,
+                                      timeout_tuner) as manager_group:
                         try:
                             manager_group.run(test_type, run_tests)
                         except KeyboardInterrupt:
@@ -284,6 +324,17 @@ def run_tests(config, test_paths, product, **kwargs):
                             raise
                         test_count += manager_group.test_count()
                         unexpected_count += manager_group.unexpected_count()
+                        skipped_tests += len(skipped)
+
+                        if kwargs["prewarm_browser"]:
+                            hits, misses, time_saved = manager_group.prewarm_stats()
+                            logger.info("Standby browsers used for %i of %i restarts, saving %.1fs" %
+                                        (hits, hits + misses, time_saved))
+                        if kwargs["webdriver_server_pool"]:
+                            started, reused, time_saved = manager_group.server_pool_stats()
+                            if started or reused:
+                                logger.info("Started %i WebDriver servers and reused them %i times, "
+                                            "saving %.1fs" % (started, reused, time_saved))
 
                 test_total += test_count
                 unexpected_total += unexpected_count
@@ -294,6 +345,11 @@ def run_tests(config, test_paths, product, **kwargs):
                 if repeat_count == 1 and len(test_loader.test_ids) == skipped_tests:
                     break
 
+            if timeout_tuner is not None:
+                logger.info(timeout_tuner.summary())
+
+        test_loader.close()
+
     if test_total == 0:
         if skipped_tests > 0:
             logger.warning("All requested tests were skipped")
@@ -328,6 +384,7 @@ def check_stability(**kwargs):
                                      repeat_loop=kwargs['verify_repeat_loop'],
                                      repeat_restart=kwargs['verify_repeat_restart'],
                                      output_results=kwargs['verify_output_results'],
+                                     adaptive=kwargs['verify_adaptive'],
                                      **kwargs)
 
 
@@ -339,9 +396,11 @@ def start(**kwargs):
     elif kwargs["list_tests"]:
         list_tests(**kwargs)
     elif kwargs["verify"] or kwargs["stability"]:
-        return check_stability(**kwargs)
+        with profiling.profile(profiling.from_kwargs(kwargs), "main"):
+            return check_stability(**kwargs)
     else:
-        return not run_tests(**kwargs)
+        with profiling.profile(profiling.from_kwargs(kwargs), "main"):
+            return not run_tests(**kwargs)
 
 
 def main():
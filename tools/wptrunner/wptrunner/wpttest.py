@@ -71,6 +71,23 @@ class WdspecSubtestResult(SubtestResult):
     statuses = {"PASS", "FAIL", "ERROR"}
 
 
+def pack_results(results):
+    """Convert a (file_result, subtest_results) pair into plain tuples, so that
+    it is cheap to send between processes."""
+    file_result, subtest_results = results
+    return ((file_result.status, file_result.message, file_result.expected,
+             file_result.extra, file_result.stack, file_result.known_intermittent),
+            [(item.name, item.status, item.message, item.stack, item.expected,
+              item.known_intermittent) for item in subtest_results])
+
+
+def unpack_results(test, data):
+    """Inverse of pack_results, using the result classes of test."""
+    file_data, subtest_data = data
+    return (test.result_cls(*file_data),
+            [test.subtest_result_cls(*item) for item in subtest_data])
+
+
 def get_run_info(metadata_root, product, **kwargs):
     return RunInfo(metadata_root, product, **kwargs)
 
@@ -179,6 +196,12 @@ class Test(object):
     def keys(self):
         return tuple()
 
+    @property
+    def affinity_key(self):
+        """Key used as a hint to run tests sharing resources in the same
+        process, or None if there is no such preference."""
+        return None
+
     @property
     def abs_path(self):
         return os.path.join(self.tests_root, self.path)
@@ -189,6 +212,10 @@ class Test(object):
         else:
             return self._test_metadata
 
+    def has_subtest_metadata(self):
+        """Whether the expectation metadata has an entry for any subtest"""
+        return self._test_metadata is not None and bool(self._test_metadata.subtests)
+
     def itermeta(self, subtest=None):
         if self._test_metadata is not None:
             if subtest is not None:
@@ -477,7 +504,7 @@ class ReftestTest(Test):
             # We assume a naive implementation in which a url with multiple
             # possible screenshots will need to take both the lhs and rhs screenshots
             # for each possible match
-            metadata["url_count"][(self.environment["protocol"], reference.url)] += 1
+            metadata["url_count"][(reference.environment["protocol"], reference.url)] += 1
             reference.update_metadata(metadata)
         return metadata
 
@@ -489,6 +516,13 @@ class ReftestTest(Test):
     def keys(self):
         return ("reftype", "refurl")
 
+    @property
+    def affinity_key(self):
+        # Tests with the same reference can reuse its screenshot
+        if self.references:
+            return self.references[0][0].url
+        return None
+
     @property
     def fuzzy(self):
         return self._fuzzy